@@ -1,13 +1,21 @@
-import geopandas as gpd
+import os
+
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-from streamlit.components.v1 import html
-from streamlit_option_menu import option_menu
 import streamlit as st
 import streamlit.components.v1 as components
-import plotly.express as px
-import plotly.graph_objects as go
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+import data_store
+import figure_cache
+import map_cache
+import map_engine
+import memory_report
+import prefetch
+import query_engine
+import search_index
+import slaughter_distance
+import spatial_join
+import timing
+import warmup
 
 ##########################################################################################
 # source:
@@ -19,32 +27,162 @@ import plotly.graph_objects as go
 ##########################################################################################
 ############ Helper Functions ############################################################
 
-# Function to load and display a map in Streamlit using html from folium
-def display_map(file_name):
-    with open(file_name, "r", encoding="utf-8") as f:
-        map_html = f.read()
-    st.components.v1.html(map_html, height=500)
-
-# Function to extract top 5 breeds
-def extract_top_5(df):
-    breed_counts = {}
-    for breeds in df['top_5_breeds']:
-        breed_list = breeds.split(',')
-        for breed in breed_list:
-            breed = breed.strip()
-            if ' ' in breed:
-                breed_parts = breed.rsplit(' ', 1)
-                if len(breed_parts) == 2:
-                    name, count = breed_parts
-                    count = int(count)
-                    if name != 'Andere':
-                        if name in breed_counts:
-                            breed_counts[name] += count
-                        else:
-                            breed_counts[name] = count
-    breed_df = pd.DataFrame(list(breed_counts.items()), columns=['Breed', 'Count'])
-    breed_df = breed_df.sort_values(by='Count', ascending=False).head(5)
-    return breed_df
+# Function to display the slaughterhouses accepting a species (one shared layer,
+# filtered by its Tierart bitmask)
+def display_slaughterhouses(animal_type, language):
+    with timing.span('map', 'slaughterhouses'):
+        map_html = map_engine.render_slaughterhouse_map(species_keys[animal_type], language)
+        components.html(map_html, height=500)
+
+# Function to build a choropleth map from the data and display it in Streamlit
+# (drawn from the vector tiles of the local tile endpoint when they are enabled and the
+# endpoint is running)
+def display_choropleth(level, animal_type, language, metric='count'):
+    with timing.span('map', f'{level} {metric}'):
+        map_html = None
+        if os.environ.get('MAP_TILES') == '1':
+            import vector_tiles  # loads the folium plugins, only needed for the tile maps
+            if vector_tiles.enabled() and vector_tiles.serve() is not None:
+                map_html = vector_tiles.render_map(level, species_keys[animal_type], language, metric)
+        if map_html is None:
+            map_html = map_engine.render_map(level, species_keys[animal_type], language, metric)
+        components.html(map_html, height=500)
+
+# Selectbox labels of both languages -> species used in the data files
+species_keys = {
+    'Rinder': 'cattle', 'Ziegen': 'goats', 'Schafe': 'sheep',
+    'Bovins': 'cattle', 'Caprins': 'goats', 'Ovins': 'sheep',
+}
+
+# Function to display a precomputed figure of the figure cache (species 'all' when
+# animal_type is None)
+def display_figure(section, animal_type, language, metric='count', **kwargs):
+    species = species_keys[animal_type] if animal_type else 'all'
+    with timing.span('figure', f'{section} {metric}'):
+        st.plotly_chart(figure_cache.get_figure(section, species, language, metric), **kwargs)
+
+# Labels of the filters and pages of the tables
+table_labels = {
+    'de': {'commune': 'Gemeinde beginnt mit', 'place': 'Ort beginnt mit', 'canton': 'Kanton', 'all': 'Alle',
+           'count_min': 'Anzahl ab', 'count_max': 'Anzahl bis', 'code': 'Tierart', 'sort': 'Sortieren nach',
+           'descending': 'Absteigend', 'page': 'Seite', 'page_size': 'Zeilen pro Seite',
+           'rows': 'Zeilen {first}–{last} von {total}'},
+    'fr': {'commune': 'La commune commence par', 'place': 'Le lieu commence par', 'canton': 'Canton', 'all': 'Tous',
+           'count_min': 'Nombre dès', 'count_max': 'Nombre jusqu’à', 'code': 'Espèce', 'sort': 'Trier par',
+           'descending': 'Décroissant', 'page': 'Page', 'page_size': 'Lignes par page',
+           'rows': 'Lignes {first}–{last} sur {total}'},
+}
+
+# Columns of the slaughterhouse table (labels of the source file)
+slaughterhouse_columns = {column: column for column in query_engine.tables['slaughterhouses']['columns']}
+
+# Function to display a table page by page: filters, sorting and paging run on the
+# server (query_engine), only the rows of the page are sent to the browser.
+# columns: column -> label, search: prefix filter of the text input, fixed: filters
+# without a widget, counts / codes: show the count range / Tierart code filters
+def paged_table(table, key, language, columns, search, sort, fixed=None, counts=False, codes=False, height=500):
+    labels = table_labels[language]
+    filters = dict(fixed or {})
+    widgets = st.columns(5 if counts else 4)
+    filters[search] = widgets[0].text_input(labels[search], key=f'{key}_search')
+    filters['canton'] = widgets[1].selectbox(labels['canton'], [None] + query_engine.distinct(table, 'canton'),
+                                             format_func=lambda canton: labels['all'] if canton is None else canton,
+                                             key=f'{key}_canton')
+    if counts:
+        filters['count_min'] = widgets[2].number_input(labels['count_min'], min_value=0, value=None, key=f'{key}_count_min')
+        filters['count_max'] = widgets[3].number_input(labels['count_max'], min_value=0, value=None, key=f'{key}_count_max')
+    if codes:
+        filters['code'] = widgets[2].selectbox(labels['code'], [None] + query_engine.slaughterhouse_codes(),
+                                               format_func=lambda code: labels['all'] if code is None else code,
+                                               key=f'{key}_code')
+    sort_column = widgets[-1].selectbox(labels['sort'], query_engine.tables[table]['sort'],
+                                        index=query_engine.tables[table]['sort'].index(sort),
+                                        format_func=lambda column: columns[column], key=f'{key}_sort')
+    descending = widgets[-1].checkbox(labels['descending'], value=sort == 'count', key=f'{key}_descending')
+
+    # back to the first page when the filters or the sorting change
+    state = (tuple(sorted(filters.items())), sort_column, descending)
+    page_size = st.session_state.get(f'{key}_page_size', 50)
+    if st.session_state.get(f'{key}_state') != state:
+        st.session_state[f'{key}_state'] = state
+        st.session_state[f'{key}_page'] = 1
+    page = st.session_state.get(f'{key}_page', 1)
+
+    with timing.span('dataframe', f'{table} query'):
+        df, total = query_engine.query(table, filters, sort_column, descending, page, page_size)
+    n_pages = max(1, -(-total // page_size))
+    if page > n_pages:
+        st.session_state[f'{key}_page'] = page = n_pages
+        df, total = query_engine.query(table, filters, sort_column, descending, page, page_size)
+    with timing.span('dataframe', table):
+        st.dataframe(df[list(columns)].rename(columns=columns), height=height, hide_index=True)
+
+    pages = st.columns([1, 1, 2])
+    pages[0].number_input(labels['page'], min_value=1, max_value=n_pages, step=1, key=f'{key}_page')
+    pages[1].selectbox(labels['page_size'], query_engine.page_sizes, index=query_engine.page_sizes.index(page_size),
+                       key=f'{key}_page_size')
+    first = (page - 1) * page_size + 1 if total else 0
+    pages[2].caption(labels['rows'].format(first=first, last=min(page * page_size, total), total=total))
+
+# Labels of the breed and name search
+search_labels = {
+    'de': {'query': 'Rasse oder Name', 'kind': 'Suche in', 'level': 'Ebene', 'species': 'Tier',
+           'kinds': {None: 'Rassen und Namen', 'breeds': 'Rassen', 'names': 'Namen'},
+           'levels': {None: 'Kantone und Gemeinden', 'canton': 'Kantone', 'commune': 'Gemeinden'},
+           'kind_names': {'breeds': 'Rasse', 'names': 'Name'}, 'level_names': {'canton': 'Kanton', 'commune': 'Gemeinde'},
+           'all': 'Alle', 'hits': '{total} Treffer, die besten {shown} werden angezeigt',
+           'columns': {'kind': 'Art', 'value': 'Rasse / Name', 'level': 'Ebene', 'species': 'Tier',
+                       'region': 'Kanton / Gemeinde', 'rank': 'Rang', 'count': 'Anzahl'}},
+    'fr': {'query': 'Race ou nom', 'kind': 'Rechercher dans', 'level': 'Niveau', 'species': 'Animal',
+           'kinds': {None: 'Races et noms', 'breeds': 'Races', 'names': 'Noms'},
+           'levels': {None: 'Cantons et communes', 'canton': 'Cantons', 'commune': 'Communes'},
+           'kind_names': {'breeds': 'Race', 'names': 'Nom'}, 'level_names': {'canton': 'Canton', 'commune': 'Commune'},
+           'all': 'Tous', 'hits': '{total} résultats, les {shown} meilleurs sont affichés',
+           'columns': {'kind': 'Type', 'value': 'Race / nom', 'level': 'Niveau', 'species': 'Animal',
+                       'region': 'Canton / commune', 'rank': 'Rang', 'count': 'Nombre'}},
+}
+
+# Function to search the top 5 breeds and names of every region (inverted index of
+# search_index) and show the best ranked regions
+def breed_search(language, limit=200):
+    labels = search_labels[language]
+    species_labels = map_engine.species_labels[language]
+    widgets = st.columns([2, 1, 1, 1])
+    text = widgets[0].text_input(labels['query'], key=f'breed_search_{language}')
+    kind = widgets[1].selectbox(labels['kind'], list(labels['kinds']), format_func=labels['kinds'].get,
+                                key=f'breed_search_kind_{language}')
+    level = widgets[2].selectbox(labels['level'], list(labels['levels']), format_func=labels['levels'].get,
+                                 key=f'breed_search_level_{language}')
+    species = widgets[3].selectbox(labels['species'], [None] + list(species_labels),
+                                   format_func=lambda species: labels['all'] if species is None else species_labels[species],
+                                   key=f'breed_search_species_{language}')
+    if not text.strip():
+        return
+    with timing.span('aggregate', 'breed search'):
+        df, total = search_index.search(text, kind, level, species, limit)
+    df['kind'] = df['kind'].cat.rename_categories(labels['kind_names'])
+    df['level'] = df['level'].cat.rename_categories(labels['level_names'])
+    df['species'] = df['species'].cat.rename_categories(species_labels)
+    st.caption(labels['hits'].format(total=total, shown=len(df)))
+    with timing.span('dataframe', 'breed search'):
+        st.dataframe(df.rename(columns=labels['columns']), height=300, hide_index=True, use_container_width=True)
+
+# Function to get the communes with the most animal kilometres to a slaughterhouse for
+# the table
+@timing.timed('aggregate')
+def underserved_communes(animal_type, columns):
+    df = slaughter_distance.underserved(species_keys[animal_type], n=50)
+    df = df[['commune', 'count', 'distance_1_km', 'slaughterhouse_1', 'distance_2_km', 'slaughterhouse_2', 'animal_km']]
+    df.columns = columns
+    return df.reset_index(drop=True)
+
+# Function to get the slaughterhouses per canton next to the number of animals
+@timing.timed('aggregate')
+def capacity_by_canton(animal_type, columns):
+    df = spatial_join.capacity(species_keys[animal_type], 'canton')
+    df = df[['canton', 'count', 'slaughterhouses', 'animals_per_slaughterhouse']]
+    df.columns = columns
+    return df
 
 # Function to create custom tabs with custom css
 def custom_tabs(labels):
@@ -116,63 +254,17 @@ def german_section():
     st.sidebar.markdown('**Datenquellen:** identitas AG')
     st.sidebar.markdown('**Stichdatum:** 30.04.2024')
     
-    # Load the cleaned data
-    df_cattle = pd.read_csv('cattle-cleaned-canton.csv')
-    df_goats = pd.read_csv('goats-cleaned-canton.csv')
-    df_sheep = pd.read_csv('sheep-cleaned-canton.csv')
-
-    # Extract the top 5 breeds
-    top_5_cattle = extract_top_5(df_cattle)
-    top_5_goats = extract_top_5(df_goats)
-    top_5_sheep = extract_top_5(df_sheep)
-
     # Title of the dashboard
     st.title('Schweizer Viehbestand')
 
-    # prepare the data
-    df_cattle['Type'] = 'Rinder'
-    df_goats['Type'] = 'Ziegen'
-    df_sheep['Type'] = 'Schafe'
-    df_cattle = df_cattle[['canton', 'count', 'count_per_100_inhabitants', 'count_per_surface_km2', 'Type']]
-    df_goats = df_goats[['canton', 'count', 'count_per_100_inhabitants', 'count_per_surface_km2','Type']]
-    df_sheep = df_sheep[['canton', 'count','count_per_100_inhabitants', 'count_per_surface_km2', 'Type']]
-    df_combined = pd.concat([df_cattle, df_goats, df_sheep])
-    df_grouped_count = df_combined.groupby(['canton', 'Type'])['count'].sum().reset_index()
-    df_grouped_100_inh = df_combined.groupby(['canton', 'Type'])['count_per_100_inhabitants'].mean().reset_index()
-    df_grouped_surface = df_combined.groupby(['canton', 'Type'])['count_per_surface_km2'].mean().reset_index()
-    df_grouped_count = df_grouped_count.sort_values(by='canton', ascending=True)
-    df_grouped_100_inh = df_grouped_100_inh.sort_values(by='canton', ascending=True)
-    df_grouped_surface = df_grouped_surface.sort_values(by='canton', ascending=True)
-
     # Create the plots for the distribution of animals
     col01, col02, col03 = st.columns(3)
     with col01:
-        fig1 = px.bar(df_grouped_count, x='canton', y='count', color='Type', 
-                        title='Viehbestand in Kantonen', 
-                        labels={'count': 'Anzahl absolut', 'canton': 'Kanton'}, 
-                        barmode='stack',
-                        color_discrete_map={'Rinder': '#6c757d', 'Schafe': '#8ecae6', 'Ziegen': 'green'},
-                        hover_data={'count': True, 'Type': True, 'canton': False})
-        fig1.update_xaxes(tickfont=dict(size=8))
-        st.plotly_chart(fig1, use_container_width=True, height=400)
+        display_figure('canton_bar', None, 'de', 'count', use_container_width=True, height=400)
     with col02:
-        fig2 = px.bar(df_grouped_100_inh, x='canton', y='count_per_100_inhabitants', color='Type', 
-                        title='Viehbestand pro 100 Einwohnerin in Kantonen', 
-                        labels={'count_per_100_inhabitants': 'Anzahl pro 100 Einwohner', 'canton': 'Kanton'}, 
-                        barmode='stack',
-                        color_discrete_map={'Rinder': '#6c757d', 'Schafe': '#8ecae6', 'Ziegen': 'green'},
-                        hover_data={'count_per_100_inhabitants': True, 'Type': True, 'canton': False})
-        fig2.update_xaxes(tickfont=dict(size=8))
-        st.plotly_chart(fig2, use_container_width=True, height=400)
+        display_figure('canton_bar', None, 'de', 'count_per_100_inhabitants', use_container_width=True, height=400)
     with col03:
-        fig3 = px.bar(df_grouped_surface, x='canton', y='count_per_surface_km2', color='Type', 
-                        title='Viehbestand pro km² in Kantonen', 
-                        labels={'count_per_surface_km2': 'Anzahl pro km²', 'canton': 'Kanton'}, 
-                        barmode='stack',
-                        color_discrete_map={'Rinder': '#6c757d', 'Schafe': '#8ecae6', 'Ziegen': 'green'},
-                        hover_data={'count_per_surface_km2': True, 'Type': True, 'canton': False})
-        fig3.update_xaxes(tickfont=dict(size=8))
-        st.plotly_chart(fig3, use_container_width=True, height=700)
+        display_figure('canton_bar', None, 'de', 'count_per_surface_km2', use_container_width=True, height=700)
 
     # selction of the animal type
     st.markdown('<span style="color:black; font-size:1.2rem;">Geografische Darstellung der Dichte von lebenden, registrierten Tieren pro Kanton: Anzahl absolut, Anzahl pro Landfläche in km² ohne Gewässer, Anzahl pro 100 Einwohner sowie die fünf beliebtesten Rassen und Namen. Bewegen Sie die «Maus» über die Karte, um die Ergebnisse anzuzeigen.</span>',
@@ -189,207 +281,68 @@ def german_section():
         "Schafe": "Sheep"
     })
 
-
-    # Sort the dataframes by count, count_per_100_inhabitants, and count_per_surface_km2
-    top_10_inhabitants = df_cattle.nlargest(10, 'count_per_100_inhabitants')
-    top_10_surface = df_cattle.nlargest(10, 'count_per_surface_km2')
-
-    top_10_inhabitants_goats = df_goats.nlargest(10, 'count_per_100_inhabitants')
-    top_10_surface_goats = df_goats.nlargest(10, 'count_per_surface_km2')
-
-    top_10_inhabitants_sheep = df_sheep.nlargest(10, 'count_per_100_inhabitants')
-    top_10_surface_sheep = df_sheep.nlargest(10, 'count_per_surface_km2')
-
-    def categorize(count, thresholds):
-        for i, threshold in enumerate(thresholds):
-            if count < threshold:
-                return f"{thresholds[i-1]} - {threshold}"
-        return f"{thresholds[-1]}+"
-
-    if animal_type == "Rinder":
-        df = df_cattle
-        thresholds = [0, 25000, 50000, 100000, 200000]
-        #colors lightest to darkest for cattle
-        # ['#f2f2f2', '#cccccc','#9999a1', '#66666e', '#000000']
-        colors = ['#66666e', '#9999a1','#000000', '#cccccc', '#f2f2f2'] # order bug fix
-    elif animal_type == "Ziegen":
-        df = df_goats
-        thresholds = [0, 1000, 3000, 5000, 10000, 20000]
-        # lightest to darkest  for goats:
-        # '#E9F3F5', '#caf0f8', '#90e0ef', '#00b4d8', '#0077b6', '#184e77']
-        colors = ['#0077b6', '#00b4d8', '#184e77', '#caf0f8', '#90e0ef', '#E9F3F5'] # order bug fix
-    else:
-        df = df_sheep
-        thresholds = [0, 5000, 15000, 30000, 50000, 70000]
-        # lightest to darkest for sheep
-        # ['#ccff33', '#9ef01a', '#38b000', '#007200', '#004b23', '#00331a']
-        colors = ['#38b000', '#007200', '#00331a', '#9ef01a', '#004b23', '#ccff33'] # order bug fix
-
-
-    df['category'] = df['count'].apply(lambda x: categorize(x, thresholds))
-    df_pie = df.groupby('category').agg({'count': 'sum'}).reset_index()
-    df_pie['category'] = pd.Categorical(df_pie['category'], 
-                                        categories=[f"{thresholds[i]} - {thresholds[i+1]}" for i in range(len(thresholds)-1)] + [f"{thresholds[-1]}+"], 
-                                        ordered=True)
-    df_pie = df_pie.sort_values('category')
-
-    fig_pie = px.pie(df_pie, 
-                    names='category', 
-                    values='count',
-                    title=f'Anteil der {animal_type} nach Anzahl absolut pro Kanton',
-                    color_discrete_sequence=colors)
-    fig_pie.update_traces(textposition='inside', texttemplate='%{label}<br>%{percent:.1%}')
-    fig_pie.update_layout(title={
-        'text': f'Anteil der {animal_type} nach Anzahl absolut pro Kanton',
-        'y': 0.95,
-        'x': 0.5,
-        'xanchor': 'center',
-        'yanchor': 'top'
-        },
-        showlegend=False, width=440, height=500)
-
     col1, col2 = st.columns([2, 1])
 
-    if animal_type == "Rinder":
-        with col1:
-            display_map("swiss_canton_map_cattle_de.html")   
-    elif animal_type == "Ziegen":
-        with col1:
-            display_map("swiss_canton_map_goats_de.html")       
-    else:
-        with col1:
-            display_map("swiss_canton_map_sheep_de.html")
+    with col1:
+        display_choropleth("canton", animal_type, "de")
 
     with col2:
-        st.plotly_chart(fig_pie)
+        display_figure('pie', animal_type, 'de')
 
     col11, col22, col33 = st.columns([1, 1, 1])
     with col11:
-        metric = "Anzahl pro Landfläche in km²"
-        if animal_type == "Rinder":
-            data = top_10_surface
-            bar_color = 'gray'
-        elif animal_type == "Ziegen":
-            data = top_10_surface_goats
-            bar_color = '#219ebc'
-        else:
-            data = top_10_surface_sheep
-            bar_color = 'green'
-        fig_surface = px.bar(data, x='count_per_surface_km2', y='canton', orientation='h', title=f'Top 10 {metric} von {animal_type} per Kanton',
-                labels={'count_per_surface_km2': f'{metric}', 'canton': 'Kanton'}, text='count_per_surface_km2')
-        fig_surface.update_traces(marker_color=bar_color, textfont_color='white')
-        fig_surface.update_layout(
-            xaxis_title=f'{metric}',
-            yaxis_title='Kanton',
-            yaxis_categoryorder='total ascending',
-            xaxis=dict(showgrid=False, showticklabels=False, showline=False),
-            yaxis=dict(showgrid=False),
-            plot_bgcolor='rgba(0,0,0,0)', width=440, height=500
-        )
-        st.plotly_chart(fig_surface)
+        display_figure('top_10', animal_type, 'de', 'count_per_surface_km2')
     with col22:
-        metric = "Anzahl pro 100 Einwohner"
-        if animal_type == "Rinder":
-            data = top_10_inhabitants
-            bar_color = 'gray'
-        elif animal_type == "Ziegen":
-            data = top_10_inhabitants_goats
-            bar_color = '#219ebc'
-        else:
-            data = top_10_inhabitants_sheep
-            bar_color = 'green'
-        fig_inhabitants = px.bar(data, x='count_per_100_inhabitants', y='canton', orientation='h', title=f'Top 10 {metric} von {animal_type} per Kanton',
-                labels={'count_per_100_inhabitants': f'{metric}', 'canton': 'Kanton'}, text='count_per_100_inhabitants')
-        fig_inhabitants.update_traces(marker_color=bar_color, textfont_color='white')
-        fig_inhabitants.update_layout(
-            xaxis_title=f'{metric}',
-            yaxis_title='Kanton',
-            yaxis_categoryorder='total ascending',
-            xaxis=dict(showgrid=False, showticklabels=False, showline=False),
-            yaxis=dict(showgrid=False),
-            plot_bgcolor='rgba(0,0,0,0)', width=440, height=500
-        )
-        st.plotly_chart(fig_inhabitants)
+        display_figure('top_10', animal_type, 'de', 'count_per_100_inhabitants')
     with col33:
-        if animal_type == "Rinder":
-            fig_breed = px.bar(top_5_cattle, x='Count', y='Breed', orientation='h', title='Top 5 Rassen der Rinder')
-            bar_color = 'gray'
-        elif animal_type == "Ziegen":
-            fig_breed = px.bar(top_5_goats, x='Count', y='Breed', orientation='h', title='Top 5 Rassen der Ziegen')
-            bar_color = '#219ebc'
-        else:
-            fig_breed = px.bar(top_5_sheep, x='Count', y='Breed', orientation='h', title='Top 5 Rassen der Schafe')
-            bar_color = 'green'
-        fig_breed.update_traces(marker_color=bar_color)
-        fig_breed.update_layout(xaxis_title='Anzahl absolut', yaxis_title='Rasse', showlegend=False, 
-                                yaxis_categoryorder='total ascending', 
-                                plot_bgcolor='rgba(0,0,0,0)', width=440, height=500)
-        if animal_type == "Rinder":
-            image_path = "https://source.unsplash.com/eine-braun-weisse-kuh-steht-auf-einem-uppigen-grunen-feld-aAi6d0PPX-Y"
-        elif animal_type == "Ziegen":
-            image_path = "https://source.unsplash.com/braune-und-weisse-hirsche-die-tagsuber-auf-grauem-betonboden-stehen-kls0AxWhUOw"
-        else:
-            image_path = "https://source.unsplash.com/ein-schaf-steht-auf-einem-feldfeld-neben-einem-zaun-HnOxnKntU3E"
-        fig_breed.add_layout_image(
-            dict(
-                source=image_path,
-                xref="paper", yref="paper",
-                x=0.6, y=0.52,
-                sizex=0.5, sizey=0.5, opacity=1, layer="below", xanchor="left", yanchor="top"
-            )
-        )
-        st.plotly_chart(fig_breed)
-
-    sheep_df = pd.read_csv("sheep-map-commune.csv",delimiter=";", skiprows=1)
-    goats_df = pd.read_csv("goats-map-commune.csv", delimiter=";", skiprows=1)
-    cattle_df = pd.read_csv("cattle-map-commune.csv", delimiter=";", skiprows=1)
-
-    sheep_df.columns = ['Gemeinde', 'Anzahl Schafe', 'Anzahl Schafe pro 100 Einwohner', 'Anzahl Schafe pro km²', '10 beliebteste Rassen', '10 beliebteste Namen']
-    goats_df.columns = ['Gemeinde',  'Anzahl Ziegen', 'Anzahl Ziegen pro 100 Einwohner', 'Anzahl Ziegen pro km²', '10 beliebteste Rassen', '10 beliebteste Namen']
-    cattle_df.columns = ['Gemeinde',  'Anzahl Rinder', 'Anzahl Rinder pro 100 Einwohner', 'Anzahl Rinder pro km²', '10 beliebteste Rassen', '10 beliebteste Namen']
+        display_figure('top_5_breeds', animal_type, 'de')
+
+    st.markdown('<span style="color:black; font-size:1.2rem;">Suche nach Rassen und Namen: In welchen Kantonen und Gemeinden gehört eine Rasse oder ein Name zu den beliebtesten?</span>', unsafe_allow_html=True)
+    breed_search('de')
 
     col111, col222 = st.columns([1, 1])
 
-    if animal_type == "Rinder":
-        with col111:
-            st.markdown('<span style="color:black; font-size:1.2rem;">Geografische Darstellung der Dichte von lebenden, registrierten Tieren pro Gemeinde.</span>', unsafe_allow_html=True)
-            display_map("swiss_communes_map_cattle_de.html")   
-    elif animal_type == "Ziegen":
-        with col111:
-            st.markdown('<span style="color:black; font-size:1.2rem;">Geografische Darstellung der Dichte von lebenden, registrierten Tieren pro Gemeinde.</span>', unsafe_allow_html=True)
-            display_map("swiss_communes_map_goats_de.html")       
-    else:
-        with col111:
-            st.markdown('<span style="color:black; font-size:1.2rem;">Geografische Darstellung der Dichte von lebenden, registrierten Tieren pro Gemeinde.</span>', unsafe_allow_html=True)
-            display_map("swiss_communes_map_sheep_de.html")
+    with col111:
+        st.markdown('<span style="color:black; font-size:1.2rem;">Geografische Darstellung der Dichte von lebenden, registrierten Tieren pro Gemeinde.</span>', unsafe_allow_html=True)
+        display_choropleth("commune", animal_type, "de")
 
     with col222:
-        if animal_type == "Rinder":
-            df = cattle_df
-        elif animal_type == "Ziegen":
-            df = goats_df             
-        else:
-            df = sheep_df
-
-        st.markdown('<span style="color:black; font-size:1.2rem;">Tabellarische Darstellung der Daten nach Gemeinden. Mit der Suche 🔍 können Sie die Daten nach Gemeinden filtern.</span>', unsafe_allow_html=True)
-        st.dataframe(df, height=500)
-
-    df_slaughterhouses = pd.read_csv("slaughterhouse_with_coordinates.csv")
+        st.markdown('<span style="color:black; font-size:1.2rem;">Tabellarische Darstellung der Daten nach Gemeinden. Mit den Filtern 🔍 können Sie die Daten nach Gemeinde, Kanton und Anzahl eingrenzen.</span>', unsafe_allow_html=True)
+        paged_table('communes', 'communes_de', 'de', {
+            'commune': 'Gemeinde', 'canton': 'Kanton', 'count': f'Anzahl {animal_type}',
+            'count_per_100_inhabitants': f'Anzahl {animal_type} pro 100 Einwohner', 'count_per_surface_km2': f'Anzahl {animal_type} pro km²',
+            'top5breeds': '10 beliebteste Rassen', 'top5names': '10 beliebteste Namen'},
+            'commune', 'count', fixed={'species': species_keys[animal_type]}, counts=True)
 
     col1111, col2222 = st.columns([1, 1])
 
     with col1111:
         st.markdown('<span style="color:black; font-size:1.2rem;">Geografische Darstellung von Schlachthöfe</span>', unsafe_allow_html=True)
-        if animal_type == "Rinder":            
-            display_map("slaughterhouses_map_cattle_de.html")
-        elif animal_type == "Ziegen":
-            display_map("slaughterhouses_map_goats_de.html")
-        else:
-            display_map("slaughterhouses_map_sheep_de.html")
+        display_slaughterhouses(animal_type, 'de')
 
     with col2222:
         st.markdown('<span style="color:black; font-size:1.2rem;">Detaillierte Auflistung der Schlachthöfe.</span>', unsafe_allow_html=True)
-        st.dataframe(df_slaughterhouses, height=500)
+        paged_table('slaughterhouses', 'slaughterhouses_de', 'de', dict(slaughterhouse_columns, canton='Kanton'),
+                    'place', 'Firmenname', codes=True)
+
+    col11111, col22222 = st.columns([1, 1])
+
+    with col11111:
+        st.markdown('<span style="color:black; font-size:1.2rem;">Distanz jeder Gemeinde zum nächsten Schlachthof, der diese Tierart schlachtet.</span>', unsafe_allow_html=True)
+        display_choropleth("commune", animal_type, "de", "distance_km")
+
+    with col22222:
+        st.markdown('<span style="color:black; font-size:1.2rem;">Gemeinden mit den meisten Tier-Kilometern zum nächsten Schlachthof (Anzahl Tiere × Distanz).</span>', unsafe_allow_html=True)
+        with timing.span('dataframe', 'underserved communes'):
+            st.dataframe(underserved_communes(animal_type, ['Gemeinde', f'Anzahl {animal_type}', 'Distanz (km)', 'Nächster Schlachthof',
+                                                            'Distanz 2 (km)', 'Zweitnächster Schlachthof', 'Tier-km']), height=500)
+
+    st.markdown('<span style="color:black; font-size:1.2rem;">Schlachthöfe pro Kanton, die diese Tierart schlachten, im Vergleich zur Anzahl Tiere.</span>', unsafe_allow_html=True)
+    with timing.span('dataframe', 'capacity'):
+        st.dataframe(capacity_by_canton(animal_type, ['Kanton', f'Anzahl {animal_type}', 'Schlachthöfe', f'{animal_type} pro Schlachthof']), use_container_width=True)
+
+    # the view is drawn, load the other species and language in the background
+    prefetch.start(species_keys[animal_type], 'de')
 
 
 ### end german section ####################
@@ -406,57 +359,15 @@ def french_section():
     st.sidebar.markdown('**Sources des données :** identitas AG')
     st.sidebar.markdown('**Date de référence :** 30.04.2024')
 
-    df_cattle = pd.read_csv('cattle-cleaned-canton.csv')
-    df_goats = pd.read_csv('goats-cleaned-canton.csv')
-    df_sheep = pd.read_csv('sheep-cleaned-canton.csv')
-
-    top_5_cattle = extract_top_5(df_cattle)
-    top_5_goats = extract_top_5(df_goats)
-    top_5_sheep = extract_top_5(df_sheep)
-
     st.title('Cheptel Suisse')
-    df_cattle['Type'] = 'Bovins'
-    df_goats['Type'] = 'Caprins'
-    df_sheep['Type'] = 'Ovins'
-    df_cattle = df_cattle[['canton', 'count', 'count_per_100_inhabitants', 'count_per_surface_km2', 'Type']]
-    df_goats = df_goats[['canton', 'count', 'count_per_100_inhabitants', 'count_per_surface_km2','Type']]
-    df_sheep = df_sheep[['canton', 'count','count_per_100_inhabitants', 'count_per_surface_km2', 'Type']]
-    df_combined = pd.concat([df_cattle, df_goats, df_sheep])
-    df_grouped_count = df_combined.groupby(['canton', 'Type'])['count'].sum().reset_index()
-    df_grouped_100_inh = df_combined.groupby(['canton', 'Type'])['count_per_100_inhabitants'].mean().reset_index()
-    df_grouped_surface = df_combined.groupby(['canton', 'Type'])['count_per_surface_km2'].mean().reset_index()
-    df_grouped_count = df_grouped_count.sort_values(by='canton', ascending=True)
-    df_grouped_100_inh = df_grouped_100_inh.sort_values(by='canton', ascending=True)
-    df_grouped_surface = df_grouped_surface.sort_values(by='canton', ascending=True)
 
     col01, col02, col03 = st.columns(3)
     with col01:
-        fig1 = px.bar(df_grouped_count, x='canton', y='count', color='Type', 
-                        title='Cheptel par canton', 
-                        labels={'count': 'Nombre absolu', 'canton': 'Canton'}, 
-                        barmode='stack',
-                        color_discrete_map={'Bovins': '#6c757d', 'Ovins': '#8ecae6', 'Caprins': 'green'},
-                        hover_data={'count': True, 'Type': True, 'canton': False})
-        fig1.update_xaxes(tickfont=dict(size=8))
-        st.plotly_chart(fig1, use_container_width=True, height=400)
+        display_figure('canton_bar', None, 'fr', 'count', use_container_width=True, height=400)
     with col02:
-        fig2 = px.bar(df_grouped_100_inh, x='canton', y='count_per_100_inhabitants', color='Type', 
-                        title='Cheptel pour 100 habitants par canton', 
-                        labels={'count_per_100_inhabitants': 'Nombre pour 100 habitants', 'canton': 'Canton'}, 
-                        barmode='stack',
-                        color_discrete_map={'Bovins': '#6c757d', 'Ovins': '#8ecae6', 'Caprins': 'green'},
-                        hover_data={'count_per_100_inhabitants': True, 'Type': True, 'canton': False})
-        fig2.update_xaxes(tickfont=dict(size=8))
-        st.plotly_chart(fig2, use_container_width=True, height=400)
+        display_figure('canton_bar', None, 'fr', 'count_per_100_inhabitants', use_container_width=True, height=400)
     with col03:
-        fig3 = px.bar(df_grouped_surface, x='canton', y='count_per_surface_km2', color='Type', 
-                        title='Cheptel par km² par canton', 
-                        labels={'count_per_surface_km2': 'Nombre par km²', 'canton': 'Canton'}, 
-                        barmode='stack',
-                        color_discrete_map={'Bovins': '#6c757d', 'Ovins': '#8ecae6', 'Caprins': 'green'},
-                        hover_data={'count_per_surface_km2': True, 'Type': True, 'canton': False})
-        fig3.update_xaxes(tickfont=dict(size=8))
-        st.plotly_chart(fig3, use_container_width=True, height=700)
+        display_figure('canton_bar', None, 'fr', 'count_per_surface_km2', use_container_width=True, height=700)
 
     st.markdown('<span style="color:black; font-size:1.2rem;">Représentation géographique de la densité des animaux vivants enregistrés par canton : nombre absolu, nombre par surface terrestre en km² sans cours d’eau, nombre pour 100 habitants ainsi que les cinq races et noms les plus populaires. Déplacez la souris sur la carte pour afficher les résultats.</span>',
                 unsafe_allow_html=True)
@@ -472,205 +383,103 @@ def french_section():
         "Ovins": "Sheep"
     })
 
-    top_10_inhabitants = df_cattle.nlargest(10, 'count_per_100_inhabitants')
-    top_10_surface = df_cattle.nlargest(10, 'count_per_surface_km2')
-
-   
-    top_10_inhabitants_goats = df_goats.nlargest(10, 'count_per_100_inhabitants')
-    top_10_surface_goats = df_goats.nlargest(10, 'count_per_surface_km2')
-
-    top_10_inhabitants_sheep = df_sheep.nlargest(10, 'count_per_100_inhabitants')
-    top_10_surface_sheep = df_sheep.nlargest(10, 'count_per_surface_km2')
-
-    def categorize(count, thresholds):
-        for i, threshold in enumerate(thresholds):
-            if count < threshold:
-                return f"{thresholds[i-1]} - {threshold}"
-        return f"{thresholds[-1]}+"
-
-    if animal_type == "Bovins":
-        df = df_cattle
-        thresholds = [0, 25000, 50000, 100000, 200000]
-        #colors lightest to darkest = ['#f2f2f2', '#cccccc','#9999a1', '#66666e', '#000000']
-        colors = ['#66666e', '#9999a1','#000000', '#cccccc', '#f2f2f2'] # order bug fix
-    elif animal_type == "Caprins":
-        df = df_goats
-        thresholds = [0, 1000, 3000, 5000, 10000, 20000]
-        # from lightest to darkest = ['#E9F3F5', '#caf0f8', '#90e0ef', '#00b4d8', '#0077b6', '#184e77']
-        colors = ['#0077b6', '#00b4d8', '#184e77', '#caf0f8', '#90e0ef', '#E9F3F5'] # order bug fix
-    else:
-        df = df_sheep
-        thresholds = [0, 5000, 15000, 30000, 50000, 70000]
-        #colors = ['#ccff33', '#9ef01a', '#38b000', '#007200', '#004b23', '#00331a']$
-        colors = ['#38b000', '#007200', '#00331a', '#9ef01a', '#004b23', '#ccff33'] # order bug fix
-
-    df['category'] = df['count'].apply(lambda x: categorize(x, thresholds))
-    df_pie = df.groupby('category').agg({'count': 'sum'}).reset_index()
-    df_pie['category'] = pd.Categorical(df_pie['category'], 
-                                        categories=[f"{thresholds[i]} - {thresholds[i+1]}" for i in range(len(thresholds)-1)] + [f"{thresholds[-1]}+"], 
-                                        ordered=True)
-    df_pie = df_pie.sort_values('category')
-
-    fig_pie = px.pie(df_pie, 
-                    names='category', 
-                    values='count',
-                    title=f'Part des {animal_type} par nombre absolu par canton',
-                    color_discrete_sequence=colors)
-    fig_pie.update_traces(textposition='inside', texttemplate='%{label}<br>%{percent:.1%}')
-    fig_pie.update_layout(title={
-        'text': f'Part des {animal_type} par nombre absolu par canton',
-        'y': 0.95,
-        'x': 0.5,
-        'xanchor': 'center',
-        'yanchor': 'top'
-        },
-        showlegend=False, width=440, height=500)
-
     col1, col2 = st.columns([2, 1])
 
-    if animal_type == "Bovins":
-        with col1:
-            display_map("swiss_canton_map_cattle_fr.html")   
-    elif animal_type == "Caprins":
-        with col1:
-            display_map("swiss_canton_map_goats_fr.html")       
-    else:
-        with col1:
-            display_map("swiss_canton_map_sheep_fr.html")
+    with col1:
+        display_choropleth("canton", animal_type, "fr")
 
     with col2:
-        st.plotly_chart(fig_pie)
+        display_figure('pie', animal_type, 'fr')
 
     col11, col22, col33 = st.columns([1, 1, 1])
     with col11:
-        metric = "Nombre par surface en km²"
-        if animal_type == "Bovins":
-            data = top_10_surface
-            bar_color = 'gray'
-        elif animal_type == "Caprins":
-            data = top_10_surface_goats
-            bar_color = '#219ebc'
-        else:
-            data = top_10_surface_sheep
-            bar_color = 'green'
-        fig_surface = px.bar(data, x='count_per_surface_km2', y='canton', orientation='h', title=f'Top 10 {metric} de {animal_type} par canton',
-                labels={'count_per_surface_km2': f'{metric}', 'canton': 'Canton'}, text='count_per_surface_km2')
-        fig_surface.update_traces(marker_color=bar_color, textfont_color='white')
-        fig_surface.update_layout(
-            xaxis_title=f'{metric}',
-            yaxis_title='Canton',
-            yaxis_categoryorder='total ascending',
-            xaxis=dict(showgrid=False, showticklabels=False, showline=False),
-            yaxis=dict(showgrid=False),
-            plot_bgcolor='rgba(0,0,0,0)', width=440, height=500
-        )
-        st.plotly_chart(fig_surface)
+        display_figure('top_10', animal_type, 'fr', 'count_per_surface_km2')
     with col22:
-        metric = "Nombre pour 100 habitants"
-        if animal_type == "Bovins":
-            data = top_10_inhabitants
-            bar_color = 'gray'
-        elif animal_type == "Caprins":
-            data = top_10_inhabitants_goats
-            bar_color = '#219ebc'
-        else:
-            data = top_10_inhabitants_sheep
-            bar_color = 'green'
-        fig_inhabitants = px.bar(data, x='count_per_100_inhabitants', y='canton', orientation='h', title=f'Top 10 {metric} de {animal_type} par canton',
-                labels={'count_per_100_inhabitants': f'{metric}', 'canton': 'Canton'}, text='count_per_100_inhabitants')
-        fig_inhabitants.update_traces(marker_color=bar_color, textfont_color='white')
-        fig_inhabitants.update_layout(
-            xaxis_title=f'{metric}',
-            yaxis_title='Canton',
-            yaxis_categoryorder='total ascending',
-            xaxis=dict(showgrid=False, showticklabels=False, showline=False),
-            yaxis=dict(showgrid=False),
-            plot_bgcolor='rgba(0,0,0,0)', width=440, height=500
-        )
-        st.plotly_chart(fig_inhabitants)
+        display_figure('top_10', animal_type, 'fr', 'count_per_100_inhabitants')
     with col33:
-        if animal_type == "Bovins":
-            fig_breed = px.bar(top_5_cattle, x='Count', y='Breed', orientation='h', title='Top 5 races de Bovins')
-            bar_color = 'gray'
-        elif animal_type == "Caprins":
-            fig_breed = px.bar(top_5_goats, x='Count', y='Breed', orientation='h', title='Top 5 races de Caprins')
-            bar_color = '#219ebc'
-        else:
-            fig_breed = px.bar(top_5_sheep, x='Count', y='Breed', orientation='h', title='Top 5 races de Ovins')
-            bar_color = 'green'
-        fig_breed.update_traces(marker_color=bar_color)
-        fig_breed.update_layout(xaxis_title='Nombre absolu', yaxis_title='Race', showlegend=False, 
-                                yaxis_categoryorder='total ascending', 
-                                plot_bgcolor='rgba(0,0,0,0)', width=440, height=500)
-        if animal_type == "Bovins":
-            image_path = "https://source.unsplash.com/eine-braun-weisse-kuh-steht-auf-einem-uppigen-grunen-feld-aAi6d0PPX-Y"
-        elif animal_type == "Caprins":
-            image_path = "https://source.unsplash.com/braune-und-weisse-hirsche-die-tagsuber-auf-grauem-betonboden-stehen-kls0AxWhUOw"
-        else:
-            image_path = "https://source.unsplash.com/ein-schaf-steht-auf-einem-feldfeld-neben-einem-zaun-HnOxnKntU3E"
-        fig_breed.add_layout_image(
-            dict(
-                source=image_path,
-                xref="paper", yref="paper",
-                x=0.6, y=0.52,
-                sizex=0.5, sizey=0.5, opacity=1, layer="below", xanchor="left", yanchor="top"
-            )
-        )
-        st.plotly_chart(fig_breed)
-
-    sheep_df = pd.read_csv("sheep-map-commune.csv",delimiter=";", skiprows=1)
-    goats_df = pd.read_csv("goats-map-commune.csv", delimiter=";", skiprows=1)
-    cattle_df = pd.read_csv("cattle-map-commune.csv", delimiter=";", skiprows=1)
-
-    sheep_df.columns = ['Commune', 'Nombre de Ovins', 'Nombre de Ovins pour 100 habitants', 'Nombre de Ovins par km²', '10 races les plus populaires', '10 noms les plus populaires']
-    goats_df.columns = ['Commune',  'Nombre de Caprins', 'Nombre de Caprins pour 100 habitants', 'Nombre de Caprins par km²', '10 races les plus populaires', '10 noms les plus populaires']
-    cattle_df.columns = ['Commune',  'Nombre de Bovins', 'Nombre de Bovins pour 100 habitants', 'Nombre de Bovins par km²', '10 races les plus populaires', '10 noms les plus populaires']
+        display_figure('top_5_breeds', animal_type, 'fr')
+
+    st.markdown('<span style="color:black; font-size:1.2rem;">Recherche de races et de noms : dans quels cantons et communes une race ou un nom fait-il partie des plus populaires ?</span>', unsafe_allow_html=True)
+    breed_search('fr')
 
     col111, col222 = st.columns([1, 1])
 
-    if animal_type == "Bovins":
-        with col111:
-            st.markdown('<span style="color:black; font-size:1.2rem;">Représentation géographique de la densité des animaux vivants enregistrés par commune.</span>', unsafe_allow_html=True)
-            display_map("swiss_communes_map_cattle_fr.html")   
-    elif animal_type == "Caprins":
-        with col111:
-            st.markdown('<span style="color:black; font-size:1.2rem;">Représentation géographique de la densité des animaux vivants enregistrés par commune.</span>', unsafe_allow_html=True)
-            display_map("swiss_communes_map_goats_fr.html")       
-    else:
-        with col111:
-            st.markdown('<span style="color:black; font-size:1.2rem;">Représentation géographique de la densité des animaux vivants enregistrés par commune.</span>', unsafe_allow_html=True)
-            display_map("swiss_communes_map_sheep_fr.html")
+    with col111:
+        st.markdown('<span style="color:black; font-size:1.2rem;">Représentation géographique de la densité des animaux vivants enregistrés par commune.</span>', unsafe_allow_html=True)
+        display_choropleth("commune", animal_type, "fr")
 
     with col222:
-        if animal_type == "Bovins":
-            df = cattle_df
-        elif animal_type == "Caprins":
-            df = goats_df             
-        else:
-            df = sheep_df
-
-        st.markdown('<span style="color:black; font-size:1.2rem;">Représentation tabulaire des données par commune. Utilisez la recherche 🔍 pour filtrer les données par commune.</span>', unsafe_allow_html=True)
-        st.dataframe(df, height=500)
-
-    df_slaughterhouses = pd.read_csv("slaughterhouse_with_coordinates.csv")
+        st.markdown('<span style="color:black; font-size:1.2rem;">Représentation tabulaire des données par commune. Utilisez les filtres 🔍 pour limiter les données par commune, canton et nombre.</span>', unsafe_allow_html=True)
+        paged_table('communes', 'communes_fr', 'fr', {
+            'commune': 'Commune', 'canton': 'Canton', 'count': f'Nombre de {animal_type}',
+            'count_per_100_inhabitants': f'Nombre de {animal_type} pour 100 habitants', 'count_per_surface_km2': f'Nombre de {animal_type} par km²',
+            'top5breeds': '10 races les plus populaires', 'top5names': '10 noms les plus populaires'},
+            'commune', 'count', fixed={'species': species_keys[animal_type]}, counts=True)
 
     col1111, col2222 = st.columns([1, 1])
 
     with col1111:
         st.markdown('<span style="color:black; font-size:1.2rem;">Représentation géographique des abattoirs</span>', unsafe_allow_html=True)
-        if animal_type == "Bovins":            
-            display_map("slaughterhouses_map_cattle_fr.html")
-        elif animal_type == "Caprins":
-            display_map("slaughterhouses_map_goats_fr.html")
-        else:
-            display_map("slaughterhouses_map_sheep_fr.html")
+        display_slaughterhouses(animal_type, 'fr')
 
     with col2222:
         st.markdown('<span style="color:black; font-size:1.2rem;">Liste détaillée des abattoirs</span>', unsafe_allow_html=True)
-        st.dataframe(df_slaughterhouses, height=500)
+        paged_table('slaughterhouses', 'slaughterhouses_fr', 'fr', dict(slaughterhouse_columns, canton='Canton'),
+                    'place', 'Firmenname', codes=True)
+
+    col11111, col22222 = st.columns([1, 1])
+
+    with col11111:
+        st.markdown('<span style="color:black; font-size:1.2rem;">Distance de chaque commune à l’abattoir le plus proche qui abat cette espèce.</span>', unsafe_allow_html=True)
+        display_choropleth("commune", animal_type, "fr", "distance_km")
+
+    with col22222:
+        st.markdown('<span style="color:black; font-size:1.2rem;">Communes avec le plus de kilomètres-animaux jusqu’à l’abattoir le plus proche (nombre d’animaux × distance).</span>', unsafe_allow_html=True)
+        with timing.span('dataframe', 'underserved communes'):
+            st.dataframe(underserved_communes(animal_type, ['Commune', f'Nombre de {animal_type}', 'Distance (km)', 'Abattoir le plus proche',
+                                                            'Distance 2 (km)', 'Deuxième abattoir', 'Animaux-km']), height=500)
+
+    st.markdown('<span style="color:black; font-size:1.2rem;">Abattoirs par canton qui abattent cette espèce, comparés au nombre d’animaux.</span>', unsafe_allow_html=True)
+    with timing.span('dataframe', 'capacity'):
+        st.dataframe(capacity_by_canton(animal_type, ['Canton', f'Nombre de {animal_type}', 'Abattoirs', f'{animal_type} par abattoir']), use_container_width=True)
+
+    # the view is drawn, load the other species and language in the background
+    prefetch.start(species_keys[animal_type], 'fr')
+
+# Function to show the timings of the stages in the sidebar (opt-in with ?debug=1
+# in the url or DASHBOARD_DEBUG=1)
+def debug_panel(run):
+    if st.query_params.get('debug') != '1' and os.environ.get('DASHBOARD_DEBUG') != '1':
+        return
+    with st.sidebar.expander('Debug: timings', expanded=True):
+        warmed = warmup.status()
+        st.markdown(f"**Warm-up:** {warmed['state']} ({warmed['done']}/{warmed['total']})")
+        prefetched = prefetch.status()
+        st.markdown(f"**Prefetch:** {prefetched['done']}/{prefetched['queued']} done, "
+                    f"{prefetched['bytes'] / 1e6:.1f} of {prefetched['budget_bytes'] / 1e6:.0f} MB")
+        memory = memory_report.report()
+        st.markdown(f"**Memory:** {memory['rss_bytes'] / 1e6:.0f} MB resident, shared store "
+                    f"{memory['shared_bytes'] / 1e6:.0f} MB, {memory['sessions']} sessions with "
+                    f"{memory['per_session_bytes'] / 1e3:.1f} KB each")
+        maps = map_cache.cache_stats()
+        st.markdown(f"**Map cache:** {len(maps['assets'])} maps, {maps['bytes'] / 1e6:.1f} of "
+                    f"{maps['budget_bytes'] / 1e6:.0f} MB, {maps['evictions']} evictions")
+        st.dataframe(pd.DataFrame.from_dict(maps['assets'], orient='index').round(3))
+        st.markdown('**This run**')
+        st.dataframe(pd.DataFrame(run, columns=['stage', 'name', 'seconds']).round(4), hide_index=True)
+        st.markdown('**Session**')
+        st.dataframe(pd.DataFrame(timing.session_totals()), hide_index=True)
+        st.markdown('**Process**')
+        st.dataframe(pd.DataFrame(timing.process_totals()), hide_index=True)
 
 def main():
+    warmup.start()
+    ctx = get_script_run_ctx()
+    timing.begin_run(st.session_state.setdefault('timings', {}), ctx.session_id if ctx else '')
     language_navigation()
+    debug_panel(timing.end_run())
+    if memory_report.metrics_file:
+        memory_report.write_prometheus(memory_report.metrics_file)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,169 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+##########################################################################################
+############ Benchmark of the dashboard reruns ###########################################
+# Drives !Dashboard1.py headlessly with Streamlit's AppTest for every language x
+# species view. Each view runs in a fresh process, so the cold start (imports, data
+# loading, first maps) is measured on its own. Per view:
+#   cold_start_s  - from the first run of the app until the view is shown
+#   warm_*_s      - reruns of the same view (median / max of --repeat runs)
+#   peak_rss_mb   - peak resident memory of the process
+#   bytes         - size of the elements sent to the browser, per element type
+#                   (iframe = map html, plotly_chart = figure json, dataframe = arrow)
+# The results are written as JSON; --compare checks them against an earlier file and
+# exits with 1 when a view got slower, bigger or heavier than the tolerance allows.
+#
+# Usage: python benchmark.py [--repeat N] [--output FILE] [--compare BASELINE]
+
+app_file = '!Dashboard1.py'
+languages = ['DE - Deutsch', 'FR - Français']
+
+# allowed growth over the baseline before a metric counts as a regression
+tolerances = {'cold_start_s': 0.25, 'warm_median_s': 0.25, 'peak_rss_mb': 0.10, 'total_bytes': 0.05}
+
+
+# Function to add up the proto size of every element of the rendered page per type
+def element_bytes(at):
+    sizes = {}
+
+    def walk(node):
+        children = getattr(node, 'children', None)
+        if children:
+            for child in children.values():
+                walk(child)
+            return
+        proto = getattr(node, 'proto', None)
+        if proto is not None:
+            sizes[node.type] = sizes.get(node.type, 0) + proto.ByteSize()
+
+    for root in at._tree.children.values():
+        walk(root)
+    return sizes
+
+
+# Function to measure one view in the current process (language, species option index)
+def measure_view(language, species_index, repeat):
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(os.path.join(os.path.dirname(os.path.abspath(__file__)), app_file), default_timeout=300)
+    started = time.perf_counter()
+    at.run()
+    at.sidebar.radio[0].set_value(language).run()
+    species = at.selectbox[0].options[species_index]
+    if at.selectbox[0].value != species:
+        at.selectbox[0].set_value(species).run()
+    cold = time.perf_counter() - started
+    errors = [str(e.message) for e in at.exception]
+
+    warm = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        at.run()
+        warm.append(time.perf_counter() - started)
+    warm.sort()
+    sizes = element_bytes(at)
+    return {
+        'language': language,
+        'species': species,
+        'cold_start_s': round(cold, 3),
+        'warm_median_s': round(warm[len(warm) // 2], 3) if warm else None,
+        'warm_max_s': round(warm[-1], 3) if warm else None,
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'bytes': sizes,
+        'total_bytes': sum(sizes.values()),
+        'errors': errors,
+    }
+
+
+# Function to measure every view, each in its own process
+def run_all(repeat, n_species=3):
+    views = {}
+    for language in languages:
+        for species_index in range(n_species):
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--view', language, str(species_index), '--repeat', str(repeat)],
+                capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+            result = json.loads(output.stdout.strip().splitlines()[-1])
+            views[f"{language[:2]}/{result['species']}"] = result
+    return views
+
+
+# Function to describe the environment the benchmark ran in
+def environment():
+    import streamlit
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {'python': platform.python_version(), 'streamlit': streamlit.__version__, 'commit': commit,
+            'machine': platform.machine(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+# Function to compare results with a baseline, returns the regressions
+def compare(results, baseline, tolerance_overrides=None):
+    limits = dict(tolerances, **(tolerance_overrides or {}))
+    regressions = []
+    for view, result in results['views'].items():
+        old = baseline['views'].get(view)
+        if old is None:
+            continue
+        for metric, tolerance in limits.items():
+            if result.get(metric) is None or not old.get(metric):
+                continue
+            change = result[metric] / old[metric] - 1
+            if change > tolerance:
+                regressions.append({'view': view, 'metric': metric, 'baseline': old[metric],
+                                    'value': result[metric], 'change': round(change, 3)})
+    return regressions
+
+
+# Function to print the results as a table
+def print_table(results, baseline=None):
+    print(f"{'view':<14}{'cold s':>9}{'warm s':>9}{'rss MB':>9}{'KB sent':>10}")
+    for view, result in results['views'].items():
+        line = (f"{view:<14}{result['cold_start_s']:>9.2f}{result['warm_median_s'] or 0:>9.2f}"
+                f"{result['peak_rss_mb']:>9.0f}{result['total_bytes'] / 1024:>10.0f}")
+        old = (baseline or {}).get('views', {}).get(view)
+        if old:
+            line += f"   (baseline {old['cold_start_s']:.2f} / {old['warm_median_s'] or 0:.2f} / " \
+                    f"{old['peak_rss_mb']:.0f} / {old['total_bytes'] / 1024:.0f})"
+        if result['errors']:
+            line += f"   {len(result['errors'])} error(s)"
+        print(line)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the dashboard views')
+    parser.add_argument('--repeat', type=int, default=5, help='warm reruns per view')
+    parser.add_argument('--output', default='benchmark.json', help='JSON file of the results')
+    parser.add_argument('--compare', metavar='BASELINE', help='JSON file of an earlier run')
+    parser.add_argument('--view', nargs=2, metavar=('LANGUAGE', 'SPECIES_INDEX'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.view:
+        print(json.dumps(measure_view(args.view[0], int(args.view[1]), args.repeat), ensure_ascii=False))
+        sys.exit(0)
+
+    results = {'environment': environment(), 'views': run_all(args.repeat)}
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=1)
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_table(results, baseline)
+    print(f'-> {args.output}')
+    if baseline is not None:
+        regressions = compare(results, baseline)
+        for regression in regressions:
+            print(f"regression {regression['view']} {regression['metric']}: {regression['baseline']} -> "
+                  f"{regression['value']} (+{regression['change']:.0%})")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,159 @@
+import sys
+import timeit
+
+import numpy as np
+import pandas as pd
+
+import data_store
+
+##########################################################################################
+############ Top 5 breeds and names as a long table ######################################
+# The "top 5" columns hold strings like "Braunvieh  1195, Kreuzung  420, ...". They are
+# parsed once per data snapshot into a typed long table with one row per entry:
+# region, species, rank, breed (or name), count. Top N lists for any region or filter
+# are then a groupby on that table.
+
+species_list = ['cattle', 'goats', 'sheep']
+
+# (level, kind) -> (dataset suffix, region column, top 5 column)
+sources = {
+    ('canton', 'breeds'): ('canton', 'canton', 'top_5_breeds'),
+    ('canton', 'names'): ('canton', 'canton', 'top_5_names'),
+    ('commune', 'breeds'): ('commune', 'commune', 'top5breeds'),
+    ('commune', 'names'): ('commune', 'commune', 'top5names'),
+}
+
+# Function to parse a column of "value  count, value  count" strings into one row per
+# entry ('row' is the position of the source row). A plain loop over the strings: the
+# pandas string methods (split, explode, rsplit) are slower on these short lists, about
+# twice as slow for the communes (python breeds.py compares them).
+def parse_top5(column, value_name='breed'):
+    rows, ranks, values, counts = [], [], [], []
+    for row, text in enumerate(column.to_numpy(dtype=object)):
+        if not isinstance(text, str):
+            continue
+        rank = 0
+        for entry in text.split(','):
+            parts = entry.rsplit(None, 1)
+            if len(parts) < 2:
+                continue
+            try:
+                count = int(parts[1])
+            except ValueError:
+                continue
+            rank += 1
+            rows.append(row)
+            ranks.append(rank)
+            values.append(parts[0].strip())
+            counts.append(count)
+    return pd.DataFrame({
+        'row': np.array(rows, dtype=np.int64),
+        'rank': np.array(ranks, dtype='int8'),
+        value_name: np.array(values, dtype=object),
+        'count': np.array(counts, dtype=np.int64),
+    })
+
+
+# Function to build the long table of one level and kind for all species
+def _build_long_table(level, kind):
+    suffix, region_column, top5_column = sources[(level, kind)]
+    value_name = 'breed' if kind == 'breeds' else 'name'
+    frames = []
+    for species in species_list:
+        df = data_store.load_dataset(f'{species}_{suffix}')
+        parsed = parse_top5(df[top5_column], value_name)
+        parsed.insert(0, 'region', df[region_column].to_numpy()[parsed.pop('row').to_numpy()])
+        parsed.insert(1, 'species', species)
+        frames.append(parsed)
+    table = pd.concat(frames, ignore_index=True)
+    for column in ['region', 'species', value_name]:
+        table[column] = table[column].astype('category')
+    return table
+
+
+# Function to get the long table of a level ('canton' or 'commune') and kind
+# ('breeds' or 'names'), parsed once per data snapshot
+def long_table(level='canton', kind='breeds'):
+    suffix = sources[(level, kind)][0]
+    return data_store.derived(('top5', level, kind), [f'{species}_{suffix}' for species in species_list],
+                              lambda: _build_long_table(level, kind))
+
+
+# Function to get the top N entries of a long table, optionally filtered by
+# species and regions ('Andere' = other breeds is left out by default)
+def top_n(table, n=5, species=None, regions=None, exclude=('Andere',)):
+    value_name = 'breed' if 'breed' in table.columns else 'name'
+    values = table[value_name].cat
+    codes = values.codes.to_numpy()
+    mask = ~np.isin(codes, [values.categories.get_loc(value) for value in exclude if value in values.categories])
+    if species is not None:
+        species_codes = table['species'].cat
+        mask &= species_codes.codes.to_numpy() == species_codes.categories.get_loc(species)
+    if regions is not None:
+        mask &= table['region'].isin(regions).to_numpy()
+    totals = np.bincount(codes[mask], weights=table['count'].to_numpy()[mask], minlength=len(values.categories))
+    order = np.argsort(-totals, kind='stable')[:n]
+    order = order[totals[order] > 0]
+    return pd.DataFrame({value_name: values.categories[order], 'count': totals[order].astype('int64')})
+
+
+# Function with the parser built from the pandas string methods, kept for the benchmark
+# (it gives the same table as parse_top5)
+def _vectorized_parse_top5(column, value_name='breed'):
+    entries = column.reset_index(drop=True).dropna().str.split(',').explode()
+    parts = entries.str.rsplit(n=1, expand=True)
+    counts = pd.to_numeric(parts[1], errors='coerce')
+    valid = counts.notna().to_numpy()
+    parts = parts[valid]
+    rank = parts.groupby(level=0).cumcount() + 1
+    return pd.DataFrame({
+        'row': parts.index.to_numpy(),
+        'rank': rank.to_numpy().astype('int8'),
+        value_name: parts[0].str.strip().to_numpy(),
+        'count': counts[valid].astype('int64').to_numpy(),
+    })
+
+
+# Function with the previous row by row parser, kept for the benchmark
+def _loop_top_5(df, column='top_5_breeds'):
+    breed_counts = {}
+    for breeds in df[column].dropna():
+        breed_list = breeds.split(',')
+        for breed in breed_list:
+            breed = breed.strip()
+            if ' ' in breed:
+                breed_parts = breed.rsplit(' ', 1)
+                if len(breed_parts) == 2:
+                    name, count = breed_parts
+                    count = int(count)
+                    if name != 'Andere':
+                        if name in breed_counts:
+                            breed_counts[name] += count
+                        else:
+                            breed_counts[name] = count
+    breed_df = pd.DataFrame(list(breed_counts.items()), columns=['Breed', 'Count'])
+    breed_df = breed_df.sort_values(by='Count', ascending=False).head(5)
+    return breed_df
+
+
+# Function to compare the row by row parser and the pandas string methods with the
+# parser of the long table
+def benchmark(number=20):
+    results = {}
+    for level, column in [('canton', 'top_5_breeds'), ('commune', 'top5breeds')]:
+        df = data_store.load_dataset(f'cattle_{level}')
+        table = _build_long_table(level, 'breeds')
+        results[f'{level}: loop, top 5 of cattle'] = timeit.timeit(
+            lambda: _loop_top_5(df, column), number=number) / number
+        results[f'{level}: parse cattle into the long table'] = timeit.timeit(
+            lambda: parse_top5(df[column]), number=number) / number
+        results[f'{level}: parse cattle with the pandas string methods'] = timeit.timeit(
+            lambda: _vectorized_parse_top5(df[column]), number=number) / number
+        results[f'{level}: top 5 of cattle from the parsed table'] = timeit.timeit(
+            lambda: top_n(table, species='cattle'), number=number) / number
+    return results
+
+
+if __name__ == '__main__':
+    for label, seconds in benchmark(*[int(arg) for arg in sys.argv[1:]]).items():
+        print(f'{label}: {seconds * 1000:.2f} ms')
@@ -0,0 +1,211 @@
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import data_store
+
+##########################################################################################
+############ Classes of the choropleth maps and the pie charts ###########################
+# The pie charts used hand-picked thresholds per species, a row-by-row categorize() and
+# colour lists reshuffled until the slices came out right, while the maps computed
+# their own quantile breaks. Both now take their classes from here:
+#   - equal     equal intervals between the smallest and the largest value
+#   - quantile  the same number of values in every class
+#   - jenks     natural breaks (Fisher's exact optimisation of the Jenks method over the
+#               distinct values, weighted by how often they occur)
+# Classes include their upper break (break i, break i+1], the first one also its lower
+# break (the smallest value), and values are binned with one np.digitize call.
+# classes() computes the breaks, colours and labels of a level, species and metric once
+# per data snapshot, so the pie and the canton map of a species share the same classes.
+# After a snapshot that changed some regions the breaks are only computed again when
+# the values of those regions changed. MAP_CLASSES chooses the scheme (default jenks).
+#   python classification.py    compares the schemes and times them on the communes
+
+schemes = ['equal', 'quantile', 'jenks']
+# end points per step of the natural breaks (rows of the cost matrix)
+jenks_block = 64
+default_scheme = os.environ.get('MAP_CLASSES', 'jenks')
+
+# colors from lightest to darkest, one class per color
+palettes = {
+    'cattle': ['#f2f2f2', '#cccccc', '#9999a1', '#66666e', '#000000'],
+    'goats': ['#E9F3F5', '#caf0f8', '#90e0ef', '#00b4d8', '#0077b6', '#184e77'],
+    'sheep': ['#ccff33', '#9ef01a', '#38b000', '#007200', '#004b23', '#00331a'],
+}
+
+
+# Function to drop the missing values of an array of floats
+def _finite(values):
+    values = np.asarray(values, dtype=float)
+    return values[np.isfinite(values)]
+
+
+# Function to compute equal interval breaks
+def equal_breaks(values, n_classes):
+    values = _finite(values)
+    if len(values) == 0:
+        return np.array([])
+    return np.unique(np.linspace(values.min(), values.max(), n_classes + 1))
+
+
+# Function to compute quantile breaks
+def quantile_breaks(values, n_classes):
+    values = _finite(values)
+    if len(values) == 0:
+        return np.array([])
+    return np.unique(np.quantile(values, np.linspace(0, 1, n_classes + 1)))
+
+
+# Function to compute natural breaks: the classes with the smallest sum of squared
+# deviations from their means (dynamic programming over the sorted distinct values)
+def jenks_breaks(values, n_classes):
+    distinct, counts = np.unique(_finite(values), return_counts=True)
+    n = len(distinct)
+    if n <= n_classes:
+        return distinct
+    # prefix sums of the weights, values and squares: the cost of a class of the
+    # distinct values i..j-1 is a few array lookups
+    weights = np.concatenate([[0], np.cumsum(counts)])
+    sums = np.concatenate([[0], np.cumsum(counts * distinct)])
+    squares = np.concatenate([[0], np.cumsum(counts * distinct ** 2)])
+
+    def cost(i, j):
+        return squares[j] - squares[i] - (sums[j] - sums[i]) ** 2 / (weights[j] - weights[i])
+
+    # best[j]: smallest cost of the first j values in the classes so far
+    best = np.full(n + 1, np.inf)
+    best[1:] = cost(0, np.arange(1, n + 1))
+    starts = np.zeros((n_classes, n + 1), dtype=np.int64)
+    for c in range(1, n_classes):
+        previous = best
+        best = np.full(n + 1, np.inf)
+        # the last class of the first j values starts at one of the values c..j-1; the
+        # end points are handled in blocks to keep the cost matrices small
+        for block in range(c + 1, n + 1, jenks_block):
+            j = np.arange(block, min(block + jenks_block, n + 1))[:, None]
+            i = np.arange(c, j[-1, 0])[None, :]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                total = np.where(i < j, previous[i] + cost(i, j), np.inf)
+            k = np.argmin(total, axis=1)
+            best[j[:, 0]] = total[np.arange(len(k)), k]
+            starts[c, j[:, 0]] = i[0, k]
+    # walk back from the last class to the first, a break is the largest value of a class
+    bounds = []
+    j = n
+    for c in range(n_classes - 1, 0, -1):
+        j = starts[c, j]
+        bounds.append(distinct[j - 1])
+    return np.array([distinct[0]] + bounds[::-1] + [distinct[-1]])
+
+
+breaks_functions = {'equal': equal_breaks, 'quantile': quantile_breaks, 'jenks': jenks_breaks}
+
+
+# Function to compute the breaks of a scheme
+def compute_breaks(values, n_classes, scheme=None):
+    return breaks_functions[scheme or default_scheme](values, n_classes)
+
+
+# Function to bin values into the classes of the breaks (-1 for missing values)
+def classify(values, breaks):
+    values = np.asarray(values, dtype=float)
+    if len(breaks) < 2:
+        index = np.zeros(len(values), dtype=np.int64)
+    else:
+        # values below the first break count to the first class, above the last to the last
+        index = np.digitize(values, breaks[1:-1], right=True)
+    return np.where(np.isnan(values), -1, index)
+
+
+# Function to format a break for the labels of the classes
+def format_break(value):
+    return f'{value:.0f}' if abs(value) >= 10 or value == int(value) else f'{value:.1f}'
+
+
+# Function to name the classes of some breaks ("0 - 25000", ...)
+def class_labels(breaks):
+    if len(breaks) < 2:
+        return [format_break(value) for value in breaks]
+    return [f'{format_break(low)} - {format_break(high)}' for low, high in zip(breaks[:-1], breaks[1:])]
+
+
+# Function to get the colors of the classes: the darkest ones when there are fewer
+# classes than colors
+def class_colors(palette, n_classes):
+    return palette[-max(n_classes, 1):]
+
+
+# Function to get the values a level, species and metric are classified on, indexed
+# by the region names
+def region_series(level, species, metric='count'):
+    import map_engine
+    import slaughter_distance
+
+    if level == 'canton':
+        df = data_store.load_dataset(f'{species}_map_canton')
+        return pd.Series(df[metric].to_numpy(dtype=float), index=df['canton'].to_numpy())
+    if metric == map_engine.distance_metric:
+        df = slaughter_distance.commune_distances(species)
+        return pd.Series(df['distance_1_km'].to_numpy(dtype=float), index=df['commune'].to_numpy())
+    df = data_store.load_dataset(f'{species}_commune')
+    return pd.Series(df[metric].to_numpy(dtype=float), index=df['commune'].to_numpy())
+
+
+# Function to get the values a level, species and metric are classified on
+def region_values(level, species, metric='count'):
+    return region_series(level, species, metric).to_numpy()
+
+
+# Function to build the classes of some values: breaks, one color and label per class
+def build_classes(values, palette, scheme=None):
+    breaks = compute_breaks(values, len(palette), scheme)
+    n_classes = max(len(breaks) - 1, 1)
+    return {'scheme': scheme or default_scheme, 'breaks': breaks,
+            'colors': class_colors(palette, n_classes), 'labels': class_labels(breaks)}
+
+
+# Function to refresh the classes after a snapshot changed some regions: the breaks
+# depend on the values only, they are kept when the changed regions (before and after)
+# hold the same values, otherwise the classes are built again (None)
+def update_classes(old, changes, level, species, metric='count'):
+    names = list(set().union(*changes.values()))
+    values = region_series(level, species, metric)
+    before = old['values']
+    if not np.array_equal(np.sort(_finite(before[before.index.isin(names)])),
+                          np.sort(_finite(values[values.index.isin(names)]))):
+        return None
+    return dict(old, values=values)
+
+
+# Function to get the classes of a level, species and metric (computed once per data
+# snapshot and scheme, shared by the maps and the pie charts) with the values they
+# were computed from ('values', by region)
+def classes(level, species, metric='count', scheme=None):
+    import map_engine
+
+    scheme = scheme or default_scheme
+
+    def build():
+        values = region_series(level, species, metric)
+        return dict(build_classes(values.to_numpy(), palettes[species], scheme), values=values)
+    return data_store.derived(('classes', level, species, metric, scheme),
+                              map_engine.map_sources(level, species, metric), build,
+                              lambda old, changes: update_classes(old, changes, level, species, metric))
+
+
+if __name__ == '__main__':
+    for species in palettes:
+        values = region_values('commune', species)
+        print(f'{species}: {len(values)} communes, {len(np.unique(_finite(values)))} distinct counts')
+        for scheme in schemes:
+            started = time.perf_counter()
+            breaks = compute_breaks(values, len(palettes[species]), scheme)
+            elapsed = time.perf_counter() - started
+            index = classify(values, breaks)
+            sizes = np.bincount(index[index >= 0], minlength=len(breaks) - 1)
+            print(f'  {scheme:<9}{elapsed * 1000:8.1f} ms  {" | ".join(class_labels(breaks))}  {sizes.tolist()}')
+    if len(sys.argv) > 1:
+        print(classes(*sys.argv[1:]))
@@ -0,0 +1,312 @@
+import os
+import sqlite3
+import sys
+import threading
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+##########################################################################################
+############ Process-wide data layer #####################################################
+# Every dataset is parsed once per process and kept in memory. Entries are keyed by
+# the file path plus its mtime and size, so editing a CSV invalidates it on the next
+# access. Callers get a shallow copy, which means adding or renaming columns in a
+# section function never changes the cached frame.
+# When `python ingest.py` has written an Arrow snapshot of a dataset, that file is
+# memory-mapped instead of parsing the CSV, as long as the CSV has not changed since.
+#
+# The store is read-only and shared by all sessions of the process, sessions borrow
+# from it without copying:
+#   - frames (also inside the dicts and tuples of derived values) are handed out as
+#     shallow copies; with copy-on-write a session that adds or overwrites a column
+#     only holds that column, the other columns stay the ones of the store (copy-on-write
+#     is always on from pandas 3, requirements.txt asks for it, and is switched on below
+#     for an older pandas)
+#   - numpy arrays of derived values are made read-only when they are stored
+#   - lists and other objects (trees, figures, the SQLite database) are shared as
+#     they are and must not be changed by the caller
+# store_report() estimates the bytes every entry holds (memory_report.py adds the
+# sessions and the process).
+#
+# Derived values given an update function are refreshed incrementally: when their
+# Identitas sources were replaced by the next snapshot of snapshots.py, the regions
+# listed in its changes.json are passed to update(old value, {dataset: regions}),
+# which returns the new value (without changing the old one) or None to rebuild.
+# Any other change (a file edited by hand, GADM, the aliases) rebuilds the value.
+
+# the shallow copies handed out to the sessions are only safe with copy-on-write
+if int(pd.__version__.split('.')[0]) < 3:
+    pd.set_option('mode.copy_on_write', True)
+
+base_dir = os.path.dirname(os.path.abspath(__file__))
+arrow_dir = 'arrow'
+
+# name -> (file, read_csv arguments)
+datasets = {
+    'cattle_canton': ('cattle-cleaned-canton.csv', {}),
+    'goats_canton': ('goats-cleaned-canton.csv', {}),
+    'sheep_canton': ('sheep-cleaned-canton.csv', {}),
+    'cattle_map_canton': ('cattle-map-canton.csv', {'delimiter': ';', 'skiprows': 1}),
+    'goats_map_canton': ('goats-map-canton.csv', {'delimiter': ';', 'skiprows': 1}),
+    'sheep_map_canton': ('sheep-map-canton.csv', {'delimiter': ';', 'skiprows': 1}),
+    'cattle_commune': ('cattle-map-commune.csv', {'delimiter': ';', 'skiprows': 1}),
+    'goats_commune': ('goats-map-commune.csv', {'delimiter': ';', 'skiprows': 1}),
+    'sheep_commune': ('sheep-map-commune.csv', {'delimiter': ';', 'skiprows': 1}),
+    'slaughterhouses': ('slaughterhouse_with_coordinates.csv', {}),
+    'slaughterhouses_raw': ('slaughterhouse.csv', {'sep': ';', 'encoding': 'utf-8-sig'}),
+}
+
+_lock = threading.Lock()
+_frames = {}
+_derived = {}
+_sizes = {}  # entry -> (fingerprint, estimated bytes), computed when a report asks for it
+_stats = {'hits': 0, 'misses': 0, 'derived_hits': 0, 'derived_misses': 0, 'derived_updates': 0}
+
+
+# Function to resolve a data file relative to the project folder
+def data_path(file_name):
+    if os.path.isabs(file_name):
+        return file_name
+    return os.path.join(base_dir, file_name)
+
+
+# Function to build the cache fingerprint of a file (path, mtime, size)
+def file_fingerprint(file_name):
+    path = data_path(file_name)
+    stat = os.stat(path)
+    return (path, stat.st_mtime_ns, stat.st_size)
+
+
+# Function to load a csv once per process and hand out a shallow copy
+def load_csv(file_name, **read_kwargs):
+    fingerprint = file_fingerprint(file_name)
+    path = fingerprint[0]
+    options = tuple(sorted(read_kwargs.items()))
+    with _lock:
+        entry = _frames.get((path, options))
+        if entry is not None and entry[0] == fingerprint:
+            _stats['hits'] += 1
+            return entry[1].copy(deep=False)
+    df = pd.read_csv(path, **read_kwargs)
+    with _lock:
+        _stats['misses'] += 1
+        _frames[(path, options)] = (fingerprint, df)
+    return df.copy(deep=False)
+
+
+# Function to get the path of the Arrow snapshot of a dataset
+def arrow_path(name):
+    return data_path(os.path.join(arrow_dir, f'{name}.arrow'))
+
+
+# Function to memory-map an Arrow snapshot (table and schema metadata)
+def read_arrow(path):
+    with pa.memory_map(path, 'r') as source:
+        table = pa.ipc.open_file(source).read_all()
+    metadata = {key.decode(): value.decode() for key, value in (table.schema.metadata or {}).items()}
+    return table, metadata
+
+
+# Function to load a dataset from its Arrow snapshot if it matches the source CSV
+def _load_arrow(name):
+    path = arrow_path(name)
+    if not os.path.exists(path):
+        return None
+    fingerprint = (file_fingerprint(path), file_fingerprint(datasets[name][0]))
+    with _lock:
+        entry = _frames.get((path, ()))
+        if entry is not None and entry[0] == fingerprint:
+            _stats['hits'] += 1
+            return entry[1].copy(deep=False)
+    table, metadata = read_arrow(path)
+    source = fingerprint[1]
+    if metadata.get('source_mtime_ns') != str(source[1]) or metadata.get('source_size') != str(source[2]):
+        return None
+    df = table.to_pandas(split_blocks=True)
+    with _lock:
+        _stats['misses'] += 1
+        _frames[(path, ())] = (fingerprint, df)
+    return df.copy(deep=False)
+
+
+# Function to check if the Arrow snapshot of a dataset matches its source CSV
+def arrow_current(name):
+    path = arrow_path(name)
+    if not os.path.exists(path):
+        return False
+    source = file_fingerprint(datasets[name][0])
+    metadata = dataset_metadata(name)
+    return metadata.get('source_mtime_ns') == str(source[1]) and metadata.get('source_size') == str(source[2])
+
+
+# Function to load one of the known datasets by name
+def load_dataset(name):
+    df = _load_arrow(name)
+    if df is not None:
+        return df
+    file_name, read_kwargs = datasets[name]
+    return load_csv(file_name, **read_kwargs)
+
+
+# Function to get the metadata of a dataset's Arrow snapshot (validity date, ...)
+def dataset_metadata(name):
+    path = arrow_path(name)
+    if not os.path.exists(path):
+        return {}
+    with pa.memory_map(path, 'r') as source:
+        schema = pa.ipc.open_file(source).schema
+    return {key.decode(): value.decode() for key, value in (schema.metadata or {}).items()}
+
+
+# Function to make the numpy arrays of a stored value read-only (frames are protected
+# by copy-on-write, lists and other objects are left as they are)
+def _freeze(value):
+    if isinstance(value, np.ndarray):
+        value.setflags(write=False)
+    elif isinstance(value, dict):
+        for item in value.values():
+            _freeze(item)
+    elif isinstance(value, tuple):
+        for item in value:
+            _freeze(item)
+    return value
+
+
+# Function to hand out a stored value: frames as shallow copies, also the frames held
+# directly by a dict or tuple, so a caller never changes the columns of the store
+def _borrow(value):
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return value.copy(deep=False)
+    if isinstance(value, dict) and any(isinstance(item, (pd.DataFrame, pd.Series)) for item in value.values()):
+        return {key: _borrow(item) for key, item in value.items()}
+    if isinstance(value, tuple) and any(isinstance(item, (pd.DataFrame, pd.Series)) for item in value):
+        return tuple(_borrow(item) for item in value)
+    return value
+
+
+# Function to get the fingerprints of the sources of a value (dataset names or files)
+def sources_fingerprint(sources):
+    return tuple(file_fingerprint(datasets[name][0] if name in datasets else name) for name in sources)
+
+
+# Function to get the validity date of the snapshot a dataset is loaded from (None when
+# it is not an Identitas export or its Arrow file is outdated)
+def snapshot_version(name):
+    if name not in datasets or not arrow_current(name):
+        return None
+    return dataset_metadata(name).get('identitas.validity')
+
+
+# Function to find the regions that changed in the sources of a derived value since it
+# was built ({dataset: set of regions}), None when a change is not described by the
+# changes.json of the snapshot that replaced the dataset
+def changed_regions(sources, old_fingerprint, new_fingerprint, old_versions):
+    import snapshots
+
+    changes = {}
+    for name, before, after, version in zip(sources, old_fingerprint, new_fingerprint, old_versions):
+        if before == after:
+            continue
+        current = snapshot_version(name) if name in snapshots.identitas_datasets else None
+        if version is None or current is None:
+            return None
+        entry = snapshots.changes(current).get(name)
+        if entry is None or entry.get('previous') != version:
+            return None
+        changes[name] = set(entry['added']) | set(entry['removed']) | set(entry['changed'])
+    return changes
+
+
+# Function to cache a value computed from one or more datasets or files
+# (top 5 breeds, groupbys, parsed geometry, ...). It is rebuilt when any source file
+# changes, or refreshed by update(old value, changed regions) when a snapshot replaced
+# only Identitas datasets (see the header).
+def derived(key, sources, builder, update=None):
+    fingerprint = sources_fingerprint(sources)
+    with _lock:
+        entry = _derived.get(key)
+        if entry is not None and entry[0] == fingerprint:
+            _stats['derived_hits'] += 1
+            return _borrow(entry[1])
+    value = None
+    if update is not None and entry is not None:
+        changes = changed_regions(sources, entry[0], fingerprint, entry[2])
+        if changes is not None:
+            value = update(entry[1], changes)
+    counter = 'derived_misses' if value is None else 'derived_updates'
+    value = _freeze(builder() if value is None else value)
+    versions = tuple(snapshot_version(name) for name in sources) if update is not None else ()
+    with _lock:
+        _stats[counter] += 1
+        _derived[key] = (fingerprint, value, versions)
+    return _borrow(value)
+
+
+# Function to estimate the bytes a value holds; objects already counted (by id) are
+# skipped, so arrays shared by several frames or entries count once
+def value_bytes(value, seen=None):
+    seen = set() if seen is None else seen
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    if isinstance(value, (str, bytes)):
+        return sys.getsizeof(value)
+    if isinstance(value, np.ndarray):
+        owner = value if value.base is None else value.base
+        if owner is not value and id(owner) in seen:
+            return 0
+        seen.add(id(owner))
+        return int(value.nbytes) if value.dtype != object else sum(value_bytes(item, seen) for item in value.ravel())
+    if isinstance(value, (pd.DataFrame, pd.Series, pd.Index)):
+        return int(np.sum(value.memory_usage(deep=True)))
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(value_bytes(key, seen) + value_bytes(item, seen) for key, item in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return sys.getsizeof(value) + sum(value_bytes(item, seen) for item in value)
+    if isinstance(value, sqlite3.Connection):
+        page_count = value.execute('PRAGMA page_count').fetchone()[0]
+        return page_count * value.execute('PRAGMA page_size').fetchone()[0]
+    if hasattr(value, 'get_arrays'):
+        # BallTree / KDTree of scikit-learn
+        return sum(value_bytes(array, seen) for array in value.get_arrays())
+    if hasattr(value, 'to_plotly_json'):
+        return value_bytes(value.to_plotly_json(), seen)
+    return sys.getsizeof(value)
+
+
+# Function to list the entries of the store with their estimated bytes
+# (kind, key, bytes), largest first
+def store_report():
+    with _lock:
+        entries = [('dataset', key[0], entry) for key, entry in _frames.items()]
+        entries += [('derived', key, entry) for key, entry in _derived.items()]
+    report = []
+    for kind, key, (fingerprint, value, *_) in entries:
+        size = _sizes.get((kind, key))
+        if size is None or size[0] != fingerprint:
+            # each entry counts what it holds, shared arrays are not subtracted
+            size = (fingerprint, value_bytes(value))
+            _sizes[(kind, key)] = size
+        report.append((kind, key, size[1]))
+    return sorted(report, key=lambda row: -row[2])
+
+
+# Function to report the hit/miss counters and what is currently cached
+def cache_stats():
+    with _lock:
+        stats = dict(_stats)
+        stats['frames'] = len(_frames)
+        stats['derived'] = len(_derived)
+        stats['bytes'] = int(sum(entry[1].memory_usage(deep=True).sum() for entry in _frames.values()))
+    return stats
+
+
+# Function to drop every cached frame and reset the counters
+def clear_cache():
+    with _lock:
+        _frames.clear()
+        _derived.clear()
+        _sizes.clear()
+        for key in _stats:
+            _stats[key] = 0
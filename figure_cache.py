@@ -0,0 +1,281 @@
+import argparse
+import hashlib
+import os
+import shutil
+import threading
+
+import pandas as pd
+
+import breeds
+import classification
+import data_store
+
+##########################################################################################
+############ Precomputed Plotly figures ##################################################
+# The bar and pie charts of the dashboard only depend on the *-canton.csv files, the
+# species and the language, so there are few of them. Every figure is
+# built once per (section, species, language, metric) and data snapshot, stored as
+# Plotly JSON in figures/<snapshot>/ and kept in memory as a ready figure; a rerun
+# only hands that figure to st.plotly_chart.
+# The snapshot is a hash of the source files, this module, the class scheme of the pies
+# (classification.py) and the plotly / streamlit versions, so new data, a changed chart or an upgrade invalidates the stored figures. `python figure_cache.py` fills the
+# store ahead of time (and removes older snapshots); missing figures are built on
+# first use.
+
+figure_dir = 'figures'
+
+species_list = ['cattle', 'goats', 'sheep']
+# the pie classes are computed from the canton map files
+sources = ['cattle_canton', 'goats_canton', 'sheep_canton', 'cattle_map_canton', 'goats_map_canton', 'sheep_map_canton']
+code_files = [os.path.abspath(__file__), os.path.abspath(classification.__file__)]
+
+species_labels = {
+    'de': {'cattle': 'Rinder', 'goats': 'Ziegen', 'sheep': 'Schafe'},
+    'fr': {'cattle': 'Bovins', 'goats': 'Caprins', 'sheep': 'Ovins'},
+}
+
+# stacked canton bars: metric -> (title, axis label) per language
+canton_bar_labels = {
+    'de': {
+        'count': ('Viehbestand in Kantonen', 'Anzahl absolut'),
+        'count_per_100_inhabitants': ('Viehbestand pro 100 Einwohnerin in Kantonen', 'Anzahl pro 100 Einwohner'),
+        'count_per_surface_km2': ('Viehbestand pro km² in Kantonen', 'Anzahl pro km²'),
+    },
+    'fr': {
+        'count': ('Cheptel par canton', 'Nombre absolu'),
+        'count_per_100_inhabitants': ('Cheptel pour 100 habitants par canton', 'Nombre pour 100 habitants'),
+        'count_per_surface_km2': ('Cheptel par km² par canton', 'Nombre par km²'),
+    },
+}
+
+# top 10 bars: metric -> axis label per language
+top_10_labels = {
+    'de': {'count_per_surface_km2': 'Anzahl pro Landfläche in km²', 'count_per_100_inhabitants': 'Anzahl pro 100 Einwohner'},
+    'fr': {'count_per_surface_km2': 'Nombre par surface en km²', 'count_per_100_inhabitants': 'Nombre pour 100 habitants'},
+}
+
+text = {
+    'de': {'canton': 'Kanton', 'count': 'Anzahl absolut', 'breed': 'Rasse',
+           'pie': 'Anteil der {animal} nach Anzahl absolut pro Kanton',
+           'top_10': 'Top 10 {metric} von {animal} per Kanton', 'top_5': 'Top 5 Rassen der {animal}'},
+    'fr': {'canton': 'Canton', 'count': 'Nombre absolu', 'breed': 'Race',
+           'pie': 'Part des {animal} par nombre absolu par canton',
+           'top_10': 'Top 10 {metric} de {animal} par canton', 'top_5': 'Top 5 races de {animal}'},
+}
+
+type_colors = {'cattle': '#6c757d', 'sheep': '#8ecae6', 'goats': 'green'}
+bar_colors = {'cattle': 'gray', 'goats': '#219ebc', 'sheep': 'green'}
+
+breed_images = {
+    'cattle': 'https://source.unsplash.com/eine-braun-weisse-kuh-steht-auf-einem-uppigen-grunen-feld-aAi6d0PPX-Y',
+    'goats': 'https://source.unsplash.com/braune-und-weisse-hirsche-die-tagsuber-auf-grauem-betonboden-stehen-kls0AxWhUOw',
+    'sheep': 'https://source.unsplash.com/ein-schaf-steht-auf-einem-feldfeld-neben-einem-zaun-HnOxnKntU3E',
+}
+
+_lock = threading.Lock()
+
+
+# Function to import plotly express with the "streamlit" default template of the
+# dashboard's figures (registered by importing streamlit's plotly_chart)
+def _express():
+    import plotly.express as px
+    import streamlit.elements.plotly_chart  # noqa: F401
+
+    return px
+
+
+# Function to load the canton data of every species with the language's type label
+def canton_frames(language):
+    frames = {}
+    for species in species_list:
+        df = data_store.load_dataset(f'{species}_canton')
+        df['Type'] = species_labels[language][species]
+        frames[species] = df[['canton', 'count', 'count_per_100_inhabitants', 'count_per_surface_km2', 'Type']]
+    return frames
+
+
+# Function to group the canton data of all animals for the stacked bar charts
+def group_by_canton(frames, metric):
+    df_combined = pd.concat(list(frames.values()))
+    grouped = df_combined.groupby(['canton', 'Type'])[metric]
+    df_grouped = (grouped.sum() if metric == 'count' else grouped.mean()).reset_index()
+    return df_grouped.sort_values(by='canton', ascending=True)
+
+
+# Function to build one of the stacked canton bar charts (all species)
+def canton_bar(language, metric):
+    px = _express()
+
+    title, label = canton_bar_labels[language][metric]
+    colors = {species_labels[language][species]: color for species, color in type_colors.items()}
+    fig = px.bar(group_by_canton(canton_frames(language), metric), x='canton', y=metric, color='Type',
+                 title=title,
+                 labels={metric: label, 'canton': text[language]['canton']},
+                 barmode='stack',
+                 color_discrete_map=colors,
+                 hover_data={metric: True, 'Type': True, 'canton': False})
+    fig.update_xaxes(tickfont=dict(size=8))
+    return fig
+
+
+# Function to build the pie of the cantons per class of animal count (the classes,
+# colors and counts of the canton map, so the counts are binned on the breaks computed
+# from them)
+def pie(species, language):
+    px = _express()
+
+    classes = classification.classes('canton', species, 'count')
+    counts = classes['values']
+    df = pd.DataFrame({'count': counts.to_numpy(), 'category': classification.classify(counts, classes['breaks'])})
+    df_pie = df[df['category'] >= 0].groupby('category').agg({'count': 'sum'}).reset_index()
+    df_pie['category'] = [classes['labels'][i] for i in df_pie['category']]
+    title = text[language]['pie'].format(animal=species_labels[language][species])
+    fig = px.pie(df_pie,
+                 names='category',
+                 values='count',
+                 title=title,
+                 color='category',
+                 color_discrete_map=dict(zip(classes['labels'], classes['colors'])))
+    fig.update_traces(textposition='inside', texttemplate='%{label}<br>%{percent:.1%}')
+    fig.update_layout(title={
+        'text': title,
+        'y': 0.95,
+        'x': 0.5,
+        'xanchor': 'center',
+        'yanchor': 'top'
+        },
+        showlegend=False, width=440, height=500)
+    return fig
+
+
+# Function to build the bar chart of the 10 cantons with the highest density
+def top_10(species, language, metric):
+    px = _express()
+
+    label = top_10_labels[language][metric]
+    canton = text[language]['canton']
+    data = canton_frames(language)[species].nlargest(10, metric)
+    fig = px.bar(data, x=metric, y='canton', orientation='h',
+                 title=text[language]['top_10'].format(metric=label, animal=species_labels[language][species]),
+                 labels={metric: label, 'canton': canton}, text=metric)
+    fig.update_traces(marker_color=bar_colors[species], textfont_color='white')
+    fig.update_layout(
+        xaxis_title=label,
+        yaxis_title=canton,
+        yaxis_categoryorder='total ascending',
+        xaxis=dict(showgrid=False, showticklabels=False, showline=False),
+        yaxis=dict(showgrid=False),
+        plot_bgcolor='rgba(0,0,0,0)', width=440, height=500
+    )
+    return fig
+
+
+# Function to build the bar chart of the 5 most common breeds
+def top_5_breeds(species, language):
+    px = _express()
+
+    breed_df = breeds.top_n(breeds.long_table('canton', 'breeds'), n=5, species=species)
+    breed_df = breed_df.rename(columns={'breed': 'Breed', 'count': 'Count'})
+    fig = px.bar(breed_df, x='Count', y='Breed', orientation='h',
+                 title=text[language]['top_5'].format(animal=species_labels[language][species]))
+    fig.update_traces(marker_color=bar_colors[species])
+    fig.update_layout(xaxis_title=text[language]['count'], yaxis_title=text[language]['breed'], showlegend=False,
+                      yaxis_categoryorder='total ascending',
+                      plot_bgcolor='rgba(0,0,0,0)', width=440, height=500)
+    fig.add_layout_image(
+        dict(
+            source=breed_images[species],
+            xref="paper", yref="paper",
+            x=0.6, y=0.52,
+            sizex=0.5, sizey=0.5, opacity=1, layer="below", xanchor="left", yanchor="top"
+        )
+    )
+    return fig
+
+
+# section -> (builder(species, language, metric), species, metrics); 'all' = every species in one chart
+sections = {
+    'canton_bar': (lambda species, language, metric: canton_bar(language, metric),
+                   ['all'], ['count', 'count_per_100_inhabitants', 'count_per_surface_km2']),
+    'pie': (lambda species, language, metric: pie(species, language), species_list, ['count']),
+    'top_10': (top_10, species_list, ['count_per_surface_km2', 'count_per_100_inhabitants']),
+    'top_5_breeds': (lambda species, language, metric: top_5_breeds(species, language), species_list, ['count']),
+}
+
+
+# Function to list every figure key (section, species, language, metric)
+def figure_keys(languages=('de', 'fr')):
+    return [(section, species, language, metric)
+            for section, (_, section_species, section_metrics) in sections.items()
+            for language in languages for species in section_species for metric in section_metrics]
+
+
+# Function to hash the source files, the code, the class scheme and the plotly /
+# streamlit versions (the template) into the snapshot name
+def _hash_snapshot():
+    import plotly
+    import streamlit
+
+    digest = hashlib.sha1(f'{plotly.__version__} {streamlit.__version__} {classification.default_scheme}'.encode())
+    for path in [data_store.data_path(data_store.datasets[name][0]) for name in sources] + code_files:
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+
+# Function to get the snapshot of the current data (hashed once per file change)
+def snapshot():
+    return data_store.derived('figure_snapshot', sources + code_files, _hash_snapshot)
+
+
+# Function to get the path of a stored figure
+def figure_path(key, snapshot_name=None):
+    return data_store.data_path(os.path.join(figure_dir, snapshot_name or snapshot(), '_'.join(key) + '.json'))
+
+
+# Function to get the Plotly JSON of a figure (from the store, built and stored if missing)
+def spec(section, species, language, metric):
+    key = (section, species, language, metric)
+    path = figure_path(key)
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read()
+    figure_json = sections[section][0](species, language, metric).to_json()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with _lock:
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(figure_json)
+        os.replace(path + '.tmp', path)
+    return figure_json
+
+
+# Function to get a figure ready for st.plotly_chart, parsed once per process and snapshot
+# (shared by all sessions, must not be changed by the caller)
+def get_figure(section, species, language, metric):
+    import plotly.io
+
+    return data_store.derived(
+        ('figure', section, species, language, metric), sources + code_files,
+        lambda: plotly.io.from_json(spec(section, species, language, metric)))
+
+
+# Function to store every figure of the current snapshot and remove older snapshots
+def build(languages=('de', 'fr')):
+    keys = figure_keys(languages)
+    for key in keys:
+        spec(*key)
+    current = snapshot()
+    root = data_store.data_path(figure_dir)
+    for name in os.listdir(root):
+        if name != current and os.path.isdir(os.path.join(root, name)):
+            shutil.rmtree(os.path.join(root, name))
+    return current, len(keys)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Precompute the Plotly figures of the dashboard')
+    parser.add_argument('--languages', nargs='+', default=['de', 'fr'], help='languages to build')
+    args = parser.parse_args()
+
+    current, n_figures = build(args.languages)
+    print(f'{n_figures} figures -> {os.path.join(figure_dir, current)}')
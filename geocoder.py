@@ -0,0 +1,348 @@
+import argparse
+import json
+import os
+import re
+import socket
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+import data_store
+import geodata
+
+##########################################################################################
+############ Geocoding of the slaughterhouse addresses ###################################
+# Replaces the serial loop of !Slaughterhouse_html.ipynb (one request + sleep(1) per
+# row on every run). Every resolved address is appended to a persistent cache
+# (geocode_cache.jsonl, one JSON object per line, flushed right away), so a run that
+# fails half way resumes where it stopped and later runs only look up new or changed
+# addresses. Lookups run on a few threads behind a shared rate limiter.
+#
+# Addresses the API can't resolve (or all addresses with --offline) fall back to
+# local data: the centroid of the already geocoded addresses with the same PLZ, the
+# representative point of the GADM commune named in "Ort/Region", or the centroid of
+# the PLZ area (first three digits). The swissBOUNDARIES3D folder of this repository
+# only has the attribute tables of the communes, so GADM provides the geometry.
+#
+# The API is OpenCage; GEOCODER_URL points it to another server with the same
+# response format, e.g. the local stand-in server of this file:
+#   python geocoder.py --serve 8765
+#   GEOCODER_URL=http://127.0.0.1:8765/geocode/v1/json python geocoder.py
+#
+# The CLI writes slaughterhouse_geocoded.csv (or --output); --in-place overwrites the
+# tracked slaughterhouse_with_coordinates.csv the dashboard reads.
+#
+# Usage: python geocoder.py [--offline] [--workers N] [--rate R] [--serve PORT]
+#                           [--output FILE | --in-place]
+
+api_url = os.environ.get('GEOCODER_URL', 'https://api.opencagedata.com/geocode/v1/json')
+api_key = os.environ.get('OPENCAGE_API_KEY', '')
+
+cache_file = 'geocode_cache.jsonl'
+output_file = 'slaughterhouse_with_coordinates.csv'
+geocoded_file = 'slaughterhouse_geocoded.csv'
+
+# free OpenCage plan: 1 request per second
+requests_per_second = 1.0
+workers = 4
+retries = 3
+# seconds before the first retry, doubled on every further one
+backoff = 1.0
+timeout = 10
+
+_whitespace = re.compile(r'\s+')
+# "Echallens VD" / "Gossau ZH ZH" -> commune "Echallens" / "Gossau", canton "VD" / "ZH"
+_locality_pattern = re.compile(r'^(.*?)(?:\s+([A-Z]{2}))+$')
+
+
+# Function to format a PLZ (read as float when the column has missing values)
+def plz_of(value):
+    try:
+        return str(int(float(value)))
+    except (TypeError, ValueError):
+        return str(value).strip()
+
+
+# Function to build the address string sent to the geocoder
+def address_of(row):
+    return f"{row['Adresse']}, {plz_of(row['PLZ'])} {row['Ort/Region']}, Switzerland"
+
+
+# Function to normalize an address into its cache key
+def cache_key(address):
+    return _whitespace.sub(' ', str(address)).strip().lower()
+
+
+# Class that spaces the requests of all threads at least 1 / rate seconds apart
+class RateLimiter:
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+# Class for the persistent address -> coordinates cache (append only, thread safe)
+class GeocodeCache:
+    def __init__(self, file_name=cache_file):
+        self.path = data_store.data_path(file_name)
+        self._lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # last line of an interrupted run
+                    self.entries[entry['key']] = entry
+
+    def get(self, address):
+        return self.entries.get(cache_key(address))
+
+    def put(self, address, lat, lon, source):
+        entry = {'key': cache_key(address), 'address': address, 'lat': lat, 'lon': lon, 'source': source}
+        with self._lock:
+            self.entries[entry['key']] = entry
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+                f.flush()
+        return entry
+
+    # Function to rewrite the file with one line per address (drops superseded lines)
+    def compact(self):
+        with self._lock:
+            with open(self.path + '.tmp', 'w', encoding='utf-8') as f:
+                for entry in self.entries.values():
+                    f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            os.replace(self.path + '.tmp', self.path)
+
+
+# Function to query the geocoding API for one address, returns (lat, lon) or None
+def lookup(address, limiter=None, url=None, key=None):
+    query = urllib.parse.urlencode({'q': address, 'key': key or api_key, 'countrycode': 'ch', 'limit': 1})
+    for attempt in range(retries):
+        if limiter is not None:
+            limiter.wait()
+        try:
+            with urllib.request.urlopen(f'{url or api_url}?{query}', timeout=timeout) as response:
+                data = json.load(response)
+            if data.get('results'):
+                geometry = data['results'][0]['geometry']
+                return geometry['lat'], geometry['lng']
+            return None
+        except urllib.error.HTTPError as e:
+            if e.code != 429 and e.code < 500:
+                raise
+        except (urllib.error.URLError, TimeoutError, socket.timeout):
+            # connection errors and timeouts (also while reading the response)
+            if attempt == retries - 1:
+                raise
+        time.sleep(backoff * 2 ** attempt)
+    raise RuntimeError(f'geocoding failed after {retries} attempts: {address}')
+
+
+# Function to get the centroids of the addresses resolved by the API per PLZ and
+# per PLZ area (first three digits, the post office region)
+def plz_centroids(df, cache):
+    points = {}
+    for _, row in df.iterrows():
+        entry = cache.get(address_of(row))
+        if entry and entry['source'] == 'api' and entry['lat'] is not None:
+            plz = plz_of(row['PLZ'])
+            for key in (plz, plz[:3] + '*'):
+                points.setdefault(key, []).append((entry['lat'], entry['lon']))
+    return {plz: tuple(np.mean(coords, axis=0)) for plz, coords in points.items()}
+
+
+# Function to resolve "Ort/Region" to the representative point of a GADM commune
+def locality_point(locality):
+    locality = str(locality).strip()
+    match = _locality_pattern.match(locality)
+    names = [f'{match.group(1)} ({match.group(2)})', match.group(1)] if match else [locality]
+    positions = geodata.match_communes(pd.Series(names))
+    for position in positions:
+        if position >= 0:
+            lat, lon = geodata.commune_centroids()[position]
+            return float(lat), float(lon)
+    return None
+
+
+# Function to resolve an address from local data only, returns (lat, lon, source)
+def offline_lookup(row, plz_points):
+    plz = plz_of(row['PLZ'])
+    point = plz_points.get(plz)
+    if point is not None:
+        return float(point[0]), float(point[1]), 'plz'
+    point = locality_point(row['Ort/Region'])
+    if point is not None:
+        return point[0], point[1], 'commune'
+    point = plz_points.get(plz[:3] + '*')
+    if point is not None:
+        return float(point[0]), float(point[1]), 'plz_area'
+    return None, None, 'none'
+
+
+# Function to import the coordinates of an earlier run (e.g. the existing output file)
+def seed_cache(cache, file_name=output_file):
+    if not os.path.exists(data_store.data_path(file_name)):
+        return 0
+    df = pd.read_csv(data_store.data_path(file_name))
+    added = 0
+    for _, row in df.iterrows():
+        address = address_of(row)
+        if cache.get(address) is None and pd.notna(row['Latitude']):
+            cache.put(address, float(row['Latitude']), float(row['Longitude']), 'api')
+            added += 1
+    return added
+
+
+# Function to store the result of one lookup in the cache right away (a None point is
+# left for the offline fallback)
+def add_point(cache, address, point, unresolved, stats):
+    if point is None:
+        unresolved.append(address)
+    else:
+        cache.put(address, point[0], point[1], 'api')
+        stats['api'] = stats.get('api', 0) + 1
+
+
+# Function to geocode all rows of a data frame, returns it with Latitude / Longitude
+# and a dict with the number of addresses per source
+def geocode_frame(df, cache=None, offline=False, n_workers=workers, rate=requests_per_second, url=None):
+    cache = cache or GeocodeCache()
+    addresses = [address_of(row) for _, row in df.iterrows()]
+    missing = list(dict.fromkeys(a for a in addresses if cache.get(a) is None))
+
+    stats = {'cached': len(addresses) - sum(cache.get(a) is None for a in addresses)}
+    unresolved = []
+    if missing and not offline:
+        limiter = RateLimiter(rate)
+        executor = ThreadPoolExecutor(max_workers=n_workers)
+        futures = {executor.submit(lookup, address, limiter, url): address for address in missing}
+        error = None
+        try:
+            for future in as_completed(futures):
+                try:
+                    point = future.result()
+                except Exception as e:
+                    # a fatal error (bad key, quota, server down): cancel the lookups that
+                    # have not started and keep what the running ones still resolve
+                    error = e
+                    executor.shutdown(wait=True, cancel_futures=True)
+                    break
+                add_point(cache, futures[future], point, unresolved, stats)
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+        if error is not None:
+            for future, address in futures.items():
+                if future.done() and not future.cancelled() and future.exception() is None \
+                        and cache.get(address) is None and address not in unresolved:
+                    add_point(cache, address, future.result(), unresolved, stats)
+            raise error
+    else:
+        unresolved = missing
+
+    if unresolved:
+        plz_points = plz_centroids(df, cache)
+        rows = {address: row for address, (_, row) in zip(addresses, df.iterrows())}
+        for address in unresolved:
+            lat, lon, source = offline_lookup(rows[address], plz_points)
+            cache.put(address, lat, lon, source)
+            stats[source] = stats.get(source, 0) + 1
+
+    entries = [cache.get(address) for address in addresses]
+    df = df.copy()
+    df['Latitude'] = [entry['lat'] for entry in entries]
+    df['Longitude'] = [entry['lon'] for entry in entries]
+    return df, stats
+
+
+# Handler of the local stand-in server: answers like OpenCage from the offline data.
+# failures maps the number of a request (1, 2, ...) to an HTTP status to answer with
+# instead, or to 'slow' to answer after the client timeout (for the tests)
+class StandInHandler(BaseHTTPRequestHandler):
+    points = {}
+    failures = {}
+    requests = []
+    _lock = threading.Lock()
+
+    def do_GET(self):
+        with self._lock:
+            self.requests.append(time.monotonic())
+            failure = self.failures.get(len(self.requests))
+        if failure == 'slow':
+            time.sleep(timeout + 0.5)
+        elif failure is not None:
+            self.send_error(failure)
+            return
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        point = self.points.get(cache_key(query.get('q', [''])[0]))
+        results = [{'geometry': {'lat': point[0], 'lng': point[1]}}] if point else []
+        body = json.dumps({'results': results, 'status': {'code': 200, 'message': 'OK'}}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Function to start the local stand-in server (returns the server, call shutdown() to stop)
+def serve(port=0, df=None, failures=None):
+    df = df if df is not None else data_store.load_dataset('slaughterhouses_raw')
+    plz_points = plz_centroids(df, GeocodeCache())
+    points = {}
+    for _, row in df.iterrows():
+        lat, lon, _ = offline_lookup(row, plz_points)
+        if lat is not None:
+            points[cache_key(address_of(row))] = (lat, lon)
+    StandInHandler.points = points
+    StandInHandler.failures = dict(failures or {})
+    StandInHandler.requests = []
+    server = ThreadingHTTPServer(('127.0.0.1', port), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Geocode the slaughterhouse addresses')
+    parser.add_argument('--offline', action='store_true', help='use only the local fallback')
+    parser.add_argument('--workers', type=int, default=workers)
+    parser.add_argument('--rate', type=float, default=requests_per_second, help='requests per second')
+    parser.add_argument('--serve', type=int, metavar='PORT', help='run the local stand-in server')
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--output', default=geocoded_file, help=f'output file (default {geocoded_file})')
+    target.add_argument('--in-place', action='store_true', help=f'overwrite {output_file}')
+    args = parser.parse_args()
+
+    if args.serve is not None:
+        server = serve(args.serve)
+        print(f'stand-in geocoder on http://127.0.0.1:{server.server_port}/geocode/v1/json')
+        threading.Event().wait()
+
+    cache = GeocodeCache()
+    seeded = seed_cache(cache)
+    df = data_store.load_dataset('slaughterhouses_raw')
+    started = time.perf_counter()
+    df, stats = geocode_frame(df, cache, offline=args.offline, n_workers=args.workers, rate=args.rate)
+    cache.compact()
+    target = output_file if args.in_place else args.output
+    df.to_csv(data_store.data_path(target), index=False)
+    print(f'{len(df)} rows in {time.perf_counter() - started:.1f} s, seeded {seeded}: {stats} -> {target}')
@@ -0,0 +1,142 @@
+import json
+import re
+
+import numpy as np
+import pandas as pd
+import shapely
+from shapely import union_all
+from shapely.geometry import mapping, shape
+
+import data_store
+
+##########################################################################################
+############ Boundary geometry shared by all maps ########################################
+# The GADM level 3 file is parsed once per process (see data_store.derived) and shared
+# read-only by every map, species and language. Only the value columns joined onto it
+# change between maps.
+
+gadm_file = 'gadm41_CHE_3.json'
+
+# GADM canton names that are written differently in the Identitas exports
+gadm_canton_names = {
+    'AppenzellAusserrhoden': 'Appenzell Ausserrhoden',
+    'AppenzellInnerrhoden': 'Appenzell Innerrhoden',
+    'Lucerne': 'Luzern',
+    'SanktGallen': 'St. Gallen',
+}
+
+canton_abbreviations = {
+    'Aargau': 'AG',
+    'Appenzell Ausserrhoden': 'AR',
+    'Appenzell Innerrhoden': 'AI',
+    'Basel-Landschaft': 'BL',
+    'Basel-Stadt': 'BS',
+    'Bern': 'BE',
+    'Fribourg': 'FR',
+    'Genève': 'GE',
+    'Glarus': 'GL',
+    'Graubünden': 'GR',
+    'Jura': 'JU',
+    'Luzern': 'LU',
+    'Neuchâtel': 'NE',
+    'Nidwalden': 'NW',
+    'Obwalden': 'OW',
+    'Schaffhausen': 'SH',
+    'Schwyz': 'SZ',
+    'Solothurn': 'SO',
+    'St. Gallen': 'SG',
+    'Thurgau': 'TG',
+    'Ticino': 'TI',
+    'Uri': 'UR',
+    'Valais': 'VS',
+    'Vaud': 'VD',
+    'Zug': 'ZG',
+    'Zürich': 'ZH',
+}
+
+# Identitas names of communes that exist more than once, e.g. "Wald (ZH)"
+_suffix_pattern = re.compile(r'^(.*) \(([A-Z]{2})\)$')
+
+
+# Function to read the GADM communes into attributes and geometry
+def _load_communes():
+    with open(data_store.data_path(gadm_file), 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    rows = []
+    geometries = []
+    for feature in data['features']:
+        props = feature['properties']
+        canton = gadm_canton_names.get(props['NAME_1'], props['NAME_1'])
+        rows.append({
+            'gid': props['GID_3'],
+            'commune': props['NAME_3'],
+            'district': props['NAME_2'],
+            'canton': canton,
+            'canton_abbr': canton_abbreviations[canton],
+        })
+        geometries.append(feature['geometry'])
+    return {'attributes': pd.DataFrame(rows), 'geometries': geometries}
+
+
+# Function to get the commune geometry (parsed once per process)
+def commune_geometry():
+    return data_store.derived('gadm_communes', [gadm_file], _load_communes)
+
+
+# Function to compute a representative point of every GADM commune (lat, lon)
+def _centroids():
+    geometries = commune_geometry()['geometries']
+    points = shapely.point_on_surface(np.array([shape(geometry) for geometry in geometries]))
+    return np.column_stack([shapely.get_y(points), shapely.get_x(points)])
+
+
+# Function to get the commune centroids (computed once per process)
+def commune_centroids():
+    return data_store.derived('commune_centroids', [gadm_file], _centroids)
+
+
+# Function to dissolve the communes into one outline per group (district or canton)
+def dissolve(columns, shapes=None):
+    communes = commune_geometry()
+    attributes = communes['attributes']
+    if shapes is None:
+        shapes = [shape(geometry) for geometry in communes['geometries']]
+    rows = []
+    outlines = []
+    for key, positions in attributes.groupby(columns).indices.items():
+        rows.append(attributes.iloc[positions[0]][columns].to_dict())
+        outlines.append(union_all([shapes[i] for i in positions]))
+    return pd.DataFrame(rows), outlines
+
+
+# Function to dissolve the GADM communes and return them as GeoJSON geometry
+def _dissolve(columns):
+    attributes, outlines = dissolve(columns)
+    return {'attributes': attributes, 'geometries': [mapping(outline) for outline in outlines]}
+
+
+# Function to get the district geometry (dissolved once per process)
+def district_geometry():
+    return data_store.derived('gadm_districts', [gadm_file], lambda: _dissolve(['canton', 'district', 'canton_abbr']))
+
+
+# Function to get the canton geometry (dissolved once per process)
+def canton_geometry():
+    return data_store.derived('gadm_cantons', [gadm_file], lambda: _dissolve(['canton', 'canton_abbr']))
+
+
+# Function to find the GADM feature of every Identitas commune name (-1 if none)
+def match_communes(names):
+    attributes = commune_geometry()['attributes']
+    by_name = attributes.groupby('commune').indices
+    by_name_canton = attributes.groupby(['commune', 'canton_abbr']).indices
+    positions = []
+    for name in names:
+        candidates = by_name.get(name, [])
+        if len(candidates) == 1:
+            positions.append(int(candidates[0]))
+            continue
+        match = _suffix_pattern.match(name)
+        candidates = by_name_canton.get(match.groups(), []) if match else []
+        positions.append(int(candidates[0]) if len(candidates) == 1 else -1)
+    return pd.Series(positions, index=names.index if isinstance(names, pd.Series) else None)
@@ -0,0 +1,90 @@
+import os
+import re
+import sys
+
+import pandas as pd
+import pyarrow as pa
+
+import data_store
+
+##########################################################################################
+############ Build step: CSV files -> typed Arrow snapshots ##############################
+# Converts every dataset of data_store into an uncompressed Arrow IPC file in arrow/.
+# Text columns with repeating values are dictionary encoded, and the Identitas
+# "Validity" / "Evaluated" dates of the export are kept in the schema metadata
+# together with the size and mtime of the source CSV. data_store memory-maps these
+# files instead of parsing the CSV, as long as the source CSV has not changed.
+#
+# Usage: python ingest.py [dataset ...]
+
+_header_pattern = re.compile(r'Validity:\s*(\d{4}-\d{2}-\d{2})\.?\s*Evaluated:\s*(\d{4}-\d{2}-\d{2})')
+
+# text columns are dictionary encoded when they have fewer distinct values than this
+# share of rows (names of regions are unique and stay plain strings)
+dictionary_ratio = 0.5
+
+
+# Function to read the "# Identitas AG. Validity: ... Evaluated: ..." header of a file
+def read_header(file_name):
+    with open(data_store.data_path(file_name), 'r', encoding='utf-8-sig') as f:
+        first_line = f.readline().lstrip('﻿')
+    match = _header_pattern.search(first_line)
+    if not match:
+        return {}
+    return {'validity': match.group(1), 'evaluated': match.group(2)}
+
+
+# Function to convert a data frame into an Arrow table with dictionary encoded text
+def to_arrow(df):
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    for i, field in enumerate(table.schema):
+        if not pa.types.is_string(field.type) and not pa.types.is_large_string(field.type):
+            continue
+        column = table.column(i)
+        if len(column) and pa.compute.count_distinct(column).as_py() < dictionary_ratio * len(column):
+            table = table.set_column(i, field.name, pa.compute.dictionary_encode(column))
+    return table
+
+
+# Function to read one dataset of data_store into an Arrow table with its metadata
+def read_table(name):
+    file_name, read_kwargs = data_store.datasets[name]
+    source_path, mtime_ns, size = data_store.file_fingerprint(file_name)
+    df = pd.read_csv(source_path, **read_kwargs)
+    table = to_arrow(df)
+    metadata = dict(table.schema.metadata or {})
+    metadata.update({
+        b'source': os.path.basename(source_path).encode(),
+        b'source_mtime_ns': str(mtime_ns).encode(),
+        b'source_size': str(size).encode(),
+    })
+    for key, value in read_header(file_name).items():
+        metadata[f'identitas.{key}'.encode()] = value.encode()
+    return table.replace_schema_metadata(metadata)
+
+
+# Function to write an Arrow table to an IPC file (through a temporary file)
+def write_table(table, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with pa.OSFile(path + '.tmp', 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(path + '.tmp', path)
+    return path
+
+
+# Function to ingest one dataset of data_store into its Arrow file
+def ingest(name):
+    return write_table(read_table(name), data_store.arrow_path(name))
+
+
+# Function to ingest several (default: all) datasets
+def ingest_all(names=None):
+    return {name: ingest(name) for name in (names or data_store.datasets)}
+
+
+if __name__ == '__main__':
+    for name, path in ingest_all(sys.argv[1:]).items():
+        meta = data_store.dataset_metadata(name)
+        dates = f" (validity {meta['identitas.validity']})" if 'identitas.validity' in meta else ''
+        print(f'{name}: {os.path.relpath(path)}, {os.path.getsize(path) / 1024:.0f} KB{dates}')
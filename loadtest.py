@@ -0,0 +1,332 @@
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+import numpy as np
+
+##########################################################################################
+############ Load test of concurrent dashboard sessions ##################################
+# benchmark.py measures one view at a time; this script measures how many sessions one
+# dashboard process sustains. It starts !Dashboard1.py with `streamlit run` on a local
+# port (or uses a running server, --url) and connects virtual users over the websocket
+# of the browser: every user sends the same rerun messages as the frontend with the
+# widget values of its interactions and waits until the script has finished. A user
+# replays one of the session scripts below in a loop with an exponential think time
+# between the steps:
+#   open      - first run of a new session
+#   language  - switch the language in the sidebar
+#   species   - switch the species
+#   table     - next page of one of the paginated tables
+# For every number of concurrent users (--users 1 5 10 20) it reports the rerun latency
+# (p50 / p95 / p99), the reruns per second, the bytes sent to the browsers and the
+# resident memory of the server process over time; the results go to loadtest.json.
+#   python loadtest.py --users 1 5 10 --duration 60 --think 2
+
+app_file = '!Dashboard1.py'
+
+# session scripts (replayed in a loop after the first step) and how often users pick them
+scripts = {
+    'browse': ['open', 'species', 'table', 'species', 'table', 'language', 'species', 'table'],
+    'switch': ['open', 'language', 'species', 'language', 'species'],
+    'tables': ['open', 'table', 'table', 'table', 'table', 'species'],
+}
+script_weights = {'browse': 3, 'switch': 1, 'tables': 1}
+
+
+class Session:
+    # One virtual user: a websocket connection and the widget values it has set
+
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self.page_script_hash = ''
+        self.widgets = []  # (type, delta path, proto) of the widgets of the last run
+        self.states = {}  # widget id -> WidgetState sent with every rerun
+        self.cached = set()  # hashes of the messages the "browser" has cached
+
+    # Function to rerun the script with the current widget values; returns the
+    # seconds until the script finished, the bytes received and the exceptions shown
+    def rerun(self):
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        message = BackMsg()
+        client_state = message.rerun_script
+        client_state.page_script_hash = self.page_script_hash
+        client_state.widget_states.widgets.extend(self.states.values())
+        client_state.cached_message_hashes.extend(self.cached)
+        started = time.perf_counter()
+        self.websocket.send(message.SerializeToString())
+        received = 0
+        errors = 0
+        widgets = []
+        while True:
+            raw = self.websocket.recv()
+            received += len(raw)
+            forward = ForwardMsg()
+            forward.ParseFromString(raw)
+            kind = forward.WhichOneof('type')
+            if forward.metadata.cacheable:
+                self.cached.add(forward.hash)
+            if kind == 'new_session':
+                self.page_script_hash = forward.new_session.main_script_hash
+            elif kind == 'delta' and forward.delta.WhichOneof('type') == 'new_element':
+                element_type = forward.delta.new_element.WhichOneof('type')
+                if element_type == 'exception':
+                    errors += 1
+                elif element_type in ('radio', 'selectbox', 'number_input'):
+                    widgets.append((element_type, tuple(forward.metadata.delta_path),
+                                    getattr(forward.delta.new_element, element_type)))
+            elif kind == 'script_finished' and \
+                    forward.script_finished != ForwardMsg.ScriptFinishedStatus.Value('FINISHED_EARLY_FOR_RERUN'):
+                break
+        self.widgets = widgets
+        # like the frontend, only the widgets of the page are sent with the next rerun
+        ids = {proto.id for _, _, proto in widgets}
+        self.states = {widget_id: state for widget_id, state in self.states.items() if widget_id in ids}
+        return time.perf_counter() - started, received, errors
+
+    # Function to find the widgets of a type, in the sidebar (path 1) or the main area (0)
+    def find(self, element_type, container=None, key_suffix=None):
+        return [proto for kind, path, proto in self.widgets
+                if kind == element_type and (container is None or path[0] == container)
+                and (key_suffix is None or proto.id.endswith(key_suffix))]
+
+    # Function to select the next option of a radio or selectbox
+    def _next_option(self, proto):
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        current = self.states.get(proto.id)
+        options = list(proto.options)
+        index = options.index(current.string_value) if current is not None else proto.default
+        state = WidgetState(id=proto.id)
+        state.string_value = options[(index + 1) % len(options)]
+        self.states[proto.id] = state
+
+    # Function to go to the next page of a table (back to the first after the last)
+    def _next_page(self, proto):
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        current = self.states.get(proto.id)
+        page = (current.int_value if current is not None else int(proto.default)) + 1
+        if proto.has_max and page > proto.max:
+            page = 1
+        state = WidgetState(id=proto.id)
+        state.int_value = page
+        self.states[proto.id] = state
+
+    # Function to run one step of a session script
+    def step(self, name, rng):
+        if name == 'language':
+            self._next_option(self.find('radio', container=1)[0])
+        elif name == 'species':
+            self._next_option(self.find('selectbox', container=0)[0])
+        elif name == 'table':
+            self._next_page(rng.choice(self.find('number_input', key_suffix='_page')))
+        return self.rerun()
+
+
+# Function to open the websocket of a new session (a context manager)
+def connect(url):
+    from websockets.sync.client import connect
+
+    websocket_url = 'ws' + url.rstrip('/')[len('http'):] if url.startswith('http') else url.rstrip('/')
+    return connect(websocket_url + '/_stcore/stream', subprotocols=['streamlit'], max_size=None)
+
+
+# Function to start the dashboard on a local port and wait until it answers
+def start_server(port, timeout=120):
+    command = [sys.executable, '-m', 'streamlit', 'run', app_file, '--server.headless=true', f'--server.port={port}',
+               '--browser.gatherUsageStats=false', '--server.fileWatcherType=none']
+    server = subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'http://localhost:{port}'
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(url + '/_stcore/health', timeout=1) as response:
+                if response.status == 200:
+                    return server, url
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError(f'the dashboard did not start on port {port}')
+
+
+# Function to read the resident memory of a process in bytes (None if unknown)
+def process_rss(pid):
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+# Function to sample the memory of the server until stopped (t, rss MB, active users, reruns)
+def sample_memory(pid, interval, state, timeline, stop):
+    started = time.perf_counter()
+    while not stop.wait(interval):
+        rss = process_rss(pid)
+        if rss is not None:
+            timeline.append({'t': round(time.perf_counter() - started, 2), 'rss_mb': round(rss / 1e6, 1),
+                             'users': state['users'], 'reruns': state['reruns']})
+
+
+# Function to replay a session script until the deadline (one virtual user)
+def run_user(url, script, deadline, think, seed, records, state, lock):
+    rng = random.Random(seed)
+    # the users of a level do not all start at the same moment
+    time.sleep(rng.uniform(0, think))
+    try:
+        websocket = connect(url)
+    except OSError as e:
+        with lock:
+            records.append({'step': 'connect', 'seconds': None, 'bytes': 0, 'errors': 1, 'error': repr(e)})
+        return
+    with lock:
+        state['users'] += 1
+    steps = scripts[script]
+    i = 0
+    with websocket:
+        session = Session(websocket)
+        while time.perf_counter() < deadline:
+            # the first step only once, then the rest of the script in a loop
+            name = steps[0] if i == 0 else steps[1 + (i - 1) % (len(steps) - 1)]
+            try:
+                seconds, received, errors = session.step(name, rng)
+                record = {'step': name, 'seconds': seconds, 'bytes': received, 'errors': errors}
+            except Exception as e:
+                record = {'step': name, 'seconds': None, 'bytes': 0, 'errors': 1, 'error': repr(e)}
+            with lock:
+                records.append(record)
+                state['reruns'] += 1
+            if record['seconds'] is None:
+                break
+            i += 1
+            if think > 0:
+                time.sleep(min(rng.expovariate(1 / think), max(deadline - time.perf_counter(), 0)))
+    with lock:
+        state['users'] -= 1
+
+
+# Function to summarize the latencies of some reruns
+def latency(seconds):
+    if not seconds:
+        return {'count': 0}
+    p50, p95, p99 = np.percentile(seconds, [50, 95, 99])
+    return {'count': len(seconds), 'p50_s': round(float(p50), 3), 'p95_s': round(float(p95), 3),
+            'p99_s': round(float(p99), 3), 'max_s': round(max(seconds), 3)}
+
+
+# Function to run one level of concurrency and summarize it
+def run_level(url, users, duration, think, seed, state, timeline):
+    records = []
+    lock = threading.Lock()
+    rng = random.Random(seed)
+    names = list(script_weights)
+    chosen = rng.choices(names, weights=[script_weights[name] for name in names], k=users)
+    started = time.perf_counter()
+    first_sample = len(timeline)
+    threads = [threading.Thread(target=run_user, args=(url, script, started + duration, think, seed * 1000 + i,
+                                                        records, state, lock), daemon=True)
+               for i, script in enumerate(chosen)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        # a rerun that started before the deadline is waited for
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    finished = [record for record in records if record['seconds'] is not None]
+    rss = [sample['rss_mb'] for sample in timeline[first_sample:]]
+    return {
+        'users': users,
+        'scripts': {name: chosen.count(name) for name in names},
+        'seconds': round(elapsed, 2),
+        'reruns': len(finished),
+        'reruns_per_s': round(len(finished) / elapsed, 2),
+        'latency': latency([record['seconds'] for record in finished]),
+        'steps': {name: latency([record['seconds'] for record in finished if record['step'] == name])
+                  for name in ['open', 'language', 'species', 'table']},
+        'bytes': sum(record['bytes'] for record in records),
+        'bytes_per_rerun': round(sum(record['bytes'] for record in finished) / len(finished)) if finished else 0,
+        'failed': [record['error'] for record in records if record['seconds'] is None],
+        'exceptions': sum(record['errors'] for record in finished),
+        'rss_mb': {'start': rss[0], 'peak': max(rss), 'end': rss[-1]} if rss else None,
+    }
+
+
+# Function to print the levels as a table
+def print_table(levels):
+    print(f"{'users':>5}{'reruns/s':>10}{'p50 s':>8}{'p95 s':>8}{'p99 s':>8}{'KB/rerun':>10}{'rss MB':>8}{'errors':>8}")
+    for level in levels:
+        stats = level['latency']
+        rss = level['rss_mb']['peak'] if level['rss_mb'] else 0
+        print(f"{level['users']:>5}{level['reruns_per_s']:>10.2f}{stats.get('p50_s', 0):>8.2f}"
+              f"{stats.get('p95_s', 0):>8.2f}{stats.get('p99_s', 0):>8.2f}{level['bytes_per_rerun'] / 1024:>10.0f}"
+              f"{rss:>8.0f}{len(level['failed']) + level['exceptions']:>8}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test the dashboard with concurrent sessions')
+    parser.add_argument('--users', type=int, nargs='+', default=[1, 5, 10], help='concurrent users, one run per number')
+    parser.add_argument('--duration', type=float, default=60, help='seconds per number of users')
+    parser.add_argument('--think', type=float, default=2, help='mean think time between the steps in seconds')
+    parser.add_argument('--url', help='use a running dashboard instead of starting one')
+    parser.add_argument('--pid', type=int, help='process id of the server given by --url (for its memory)')
+    parser.add_argument('--port', type=int, default=8599, help='port of the dashboard started here')
+    parser.add_argument('--sample', type=float, default=1, help='seconds between the memory samples')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--no-warmup', action='store_true', help='do not open one session before the first level')
+    parser.add_argument('--output', default='loadtest.json', help='JSON file of the results')
+    args = parser.parse_args()
+
+    server = None
+    if args.url:
+        url, pid = args.url, args.pid
+    else:
+        server, url = start_server(args.port)
+        pid = server.pid
+    state = {'users': 0, 'reruns': 0}
+    timeline = []
+    stop = threading.Event()
+    sampler = None
+    if pid is not None:
+        sampler = threading.Thread(target=sample_memory, args=(pid, args.sample, state, timeline, stop), daemon=True)
+        sampler.start()
+    try:
+        warm = None
+        if not args.no_warmup:
+            # the first session starts the warm-up of the server, it is not part of a level
+            with connect(url) as websocket:
+                warm = round(Session(websocket).rerun()[0], 3)
+            print(f'first session in {warm:.2f} s')
+        rss_before = process_rss(pid) if pid is not None else None
+        levels = []
+        for users in args.users:
+            levels.append(run_level(url, users, args.duration, args.think, args.seed, state, timeline))
+            print(f"{users} users: {levels[-1]['reruns']} reruns, p95 {levels[-1]['latency'].get('p95_s', 0):.2f} s")
+    finally:
+        stop.set()
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+
+    results = {
+        'settings': {'users': args.users, 'duration_s': args.duration, 'think_s': args.think, 'url': args.url,
+                     'scripts': scripts, 'script_weights': script_weights},
+        'first_session_s': warm,
+        'rss_before_mb': round(rss_before / 1e6, 1) if rss_before else None,
+        'levels': levels,
+        'timeline': timeline,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=1)
+    print()
+    print_table(levels)
+    print(f'-> {args.output}')
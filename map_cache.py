@@ -0,0 +1,97 @@
+import os
+import threading
+from collections import OrderedDict
+
+import data_store
+
+##########################################################################################
+############ In-memory cache for the rendered map html ###################################
+# The html of each map (map_engine.render_map / render_slaughterhouse_map,
+# vector_tiles.render_map) is rendered once and kept in memory until one of the files
+# it is built from changes or the cache runs over its byte budget (MAP_CACHE_MB, least
+# recently used maps are dropped first). cache_stats() reports the size and hit rate
+# of every map.
+
+budget_bytes = int(os.environ.get('MAP_CACHE_MB', '64')) * 1024 * 1024
+
+_lock = threading.Lock()
+_entries = OrderedDict()  # key -> entry dict, most recently used last
+_asset_stats = {}  # key -> hit/miss counters, kept after eviction
+_totals = {'bytes': 0, 'evictions': 0}
+
+
+# Function to compute the memory an entry holds
+def _entry_size(entry):
+    return entry['size']
+
+
+# Function to drop least recently used maps until the cache fits its budget
+def _evict(keep):
+    while _totals['bytes'] > budget_bytes and len(_entries) > 1:
+        key, entry = next(iter(_entries.items()))
+        if key == keep:
+            break
+        del _entries[key]
+        _totals['bytes'] -= _entry_size(entry)
+        _totals['evictions'] += 1
+
+
+# Function to get the html of a map, rendering it on a miss (render is called with no
+# arguments, sources are the data_store names or files the map is built from)
+def get_html(key, sources, render):
+    fingerprint = data_store.sources_fingerprint(sources)
+    with _lock:
+        counters = _asset_stats.setdefault(key, {'hits': 0, 'misses': 0})
+        entry = _entries.get(key)
+        if entry is not None and entry['fingerprint'] == fingerprint:
+            counters['hits'] += 1
+            _entries.move_to_end(key)
+            return entry['html']
+    html = render()
+    entry = {'fingerprint': fingerprint, 'html': html, 'size': len(html.encode('utf-8'))}
+    with _lock:
+        counters['misses'] += 1
+        old = _entries.pop(key, None)
+        if old is not None:
+            _totals['bytes'] -= _entry_size(old)
+        _entries[key] = entry
+        _totals['bytes'] += entry['size']
+        _evict(key)
+    return html
+
+
+# Function to list the cached maps with their bytes, like data_store.store_report()
+def store_report():
+    with _lock:
+        return sorted((('map', key, entry['size']) for key, entry in _entries.items()), key=lambda row: -row[2])
+
+
+# Function to report the size and hit rate of every map asset
+def cache_stats():
+    with _lock:
+        assets = {}
+        for key, counters in _asset_stats.items():
+            entry = _entries.get(key)
+            requests = counters['hits'] + counters['misses']
+            assets['/'.join(str(part) for part in key)] = {
+                'cached': entry is not None,
+                'bytes': entry['size'] if entry else 0,
+                'hits': counters['hits'],
+                'misses': counters['misses'],
+                'hit_rate': counters['hits'] / requests if requests else 0.0,
+            }
+        return {
+            'assets': assets,
+            'bytes': _totals['bytes'],
+            'budget_bytes': budget_bytes,
+            'evictions': _totals['evictions'],
+        }
+
+
+# Function to empty the map cache and reset the counters
+def clear_cache():
+    with _lock:
+        _entries.clear()
+        _asset_stats.clear()
+        _totals['bytes'] = 0
+        _totals['evictions'] = 0
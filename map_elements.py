@@ -0,0 +1,123 @@
+import folium
+from branca.element import MacroElement
+from jinja2 import Environment
+
+##########################################################################################
+############ Folium elements of the maps #################################################
+# The layers map_engine.py adds to its folium maps. folium, branca and jinja2 take about
+# 0.3 s to import, so map_engine imports this module (and folium) only when it builds a
+# map, not when the dashboard starts.
+
+_compact_json = Environment()
+_compact_json.policies['json.dumps_kwargs'] = {'sort_keys': False, 'separators': (',', ':')}
+
+
+# TopoJson layer that writes its data without whitespace and sends the shared
+# style once instead of repeating it for every region. levels lists the levels of
+# detail from the coarsest to the finest ({name, tolerance, url}, the level of the
+# data without url); on zoomend the layer is redrawn from the arcs of the coarsest
+# level whose tolerance stays below half a screen pixel, loaded from its url the first
+# time. A level that can't be loaded is skipped, the map keeps the arcs it has.
+class CompactTopoJson(folium.TopoJson):
+    _template = _compact_json.from_string(
+        """
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }}_data = {{ this.data|tojson }};
+            var {{ this.get_name() }} = L.geoJson(
+                topojson.feature(
+                    {{ this.get_name() }}_data,
+                    {{ this.get_name() }}_data{{ this._safe_object_path }}
+                )
+            ).addTo({{ this._parent.get_name() }});
+            function {{ this.get_name() }}_style() {
+                {{ this.get_name() }}.setStyle(function(feature) {
+                    return Object.assign({{ this.base_style|tojson }}, feature.properties.style);
+                });
+            }
+            {{ this.get_name() }}_style();
+            (function() {
+                var map = {{ this._parent.get_name() }};
+                var data = {{ this.get_name() }}_data;
+                var levels = {{ this.levels|tojson }};
+                var current = {{ this.level|tojson }};
+                if (levels.length < 2) return;
+                levels.forEach(function(level) {
+                    if (level.name === current) {
+                        level.transform = data.transform;
+                        level.arcs = data.arcs;
+                    }
+                });
+                function wanted() {
+                    var half_pixel = 180 / (256 * Math.pow(2, map.getZoom()));
+                    return levels.find(function(level) { return level.tolerance <= half_pixel && !level.failed; })
+                        || levels.filter(function(level) { return !level.failed; }).pop();
+                }
+                function draw() {
+                    var level = wanted();
+                    if (level.name === current) return;
+                    if (!level.arcs) {
+                        if (!level.loading) {
+                            level.loading = fetch(level.url)
+                                .then(function(response) {
+                                    if (!response.ok) throw new Error(response.status);
+                                    return response.json();
+                                })
+                                .then(function(file) {
+                                    level.transform = file.transform;
+                                    level.arcs = file.arcs;
+                                })
+                                .catch(function() { level.failed = true; })
+                                .then(draw);
+                        }
+                        return;
+                    }
+                    current = level.name;
+                    data.transform = level.transform;
+                    data.arcs = level.arcs;
+                    {{ this.get_name() }}.clearLayers();
+                    {{ this.get_name() }}.addData(topojson.feature(data, data{{ this._safe_object_path }}));
+                    {{ this.get_name() }}_style();
+                }
+                map.on('zoomend', draw);
+            })();
+        {% endmacro %}
+        """
+    )
+
+    def __init__(self, data, object_path, base_style, level=None, levels=(), **kwargs):
+        super().__init__(data, object_path, **kwargs)
+        self.base_style = base_style
+        self.level = level
+        self.levels = list(levels)
+
+
+# Markers of the slaughterhouse layer added to a marker cluster in one go: the points
+# are sent once as a compact array with their Tierart mask, the icon and the labels
+# of the codes once per map, the popups are put together in the browser
+class SlaughterhouseMarkers(MacroElement):
+    _template = _compact_json.from_string(
+        """
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = (function() {
+                var icon = L.icon({iconUrl: {{ this.icon_url|tojson }}, iconSize: {{ this.icon_size|tojson }}});
+                var labels = {{ this.labels|tojson }};
+                var markers = {{ this.points|tojson }}.map(function(p) {
+                    var services = labels.filter(function(label, i) { return label && (p[4] >> i & 1); });
+                    var popup = '<b>' + p[2] + '</b><br>' + p[3] + '<br>' + {{ this.services_label|tojson }} + ': ' + services.join(', ');
+                    return L.marker([p[0], p[1]], {icon: icon}).bindPopup(popup, {maxWidth: 300});
+                });
+                {{ this._parent.get_name() }}.addLayers(markers);
+                return markers;
+            })();
+        {% endmacro %}
+        """
+    )
+
+    def __init__(self, points, labels, services_label, icon_url, icon_size):
+        super().__init__()
+        self._name = 'SlaughterhouseMarkers'
+        self.points = points
+        self.labels = labels
+        self.services_label = services_label
+        self.icon_url = icon_url
+        self.icon_size = list(icon_size)
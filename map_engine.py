@@ -0,0 +1,309 @@
+import base64
+import io
+import math
+import os
+from html import escape
+
+import numpy as np
+import pandas as pd
+
+import classification
+import data_store
+import geodata
+import map_cache
+import reconcile
+import slaughter_distance
+import slaughterhouse_layer
+import topology
+
+##########################################################################################
+############ Choropleth maps built from the data at runtime ##############################
+# Replaces the hand-built swiss_canton_map_* / swiss_communes_map_* html files. The
+# geometry is the simplified TopoJSON of topology.py (built once per process): the
+# map embeds the level of detail of the initial zoom and loads the arcs of the finer
+# levels from the static files of topology.level_arcs_file when it is zoomed in
+# (LOD_URL, relative to the page of the app), the values come from the *-map-canton.csv /
+# *-map-commune.csv files. Rendered maps are kept per (level, species, language, metric)
+# by map_cache until one of the source files changes or the cache runs over its budget,
+# or read from the files of prerender.py when they were rendered from the same inputs.
+# The slaughterhouse maps (from !Slaughterhouse_html.ipynb) show the slaughterhouse
+# layer filtered by species, with the popups in the language of the map.
+
+species_list = ['cattle', 'goats', 'sheep']
+
+species_labels = {
+    'de': {'cattle': 'Rinder', 'goats': 'Ziegen', 'sheep': 'Schafe'},
+    'fr': {'cattle': 'Bovins', 'goats': 'Caprins', 'sheep': 'Ovins'},
+}
+
+# regions without a value (the class colors come from classification.py)
+missing_color = '#d9d9d9'
+
+zoom_start = 7.5
+# folder the browser loads the arcs of the finer levels of detail from
+lod_url = os.environ.get('LOD_URL', 'app/static/geometry/')
+
+# marker of the slaughterhouse maps per species
+marker_icons = {'cattle': 'cowhead.png', 'goats': 'goathead.png', 'sheep': 'sheephead.png'}
+marker_size = (30, 30)
+services_labels = {'de': 'Services', 'fr': 'Services'}
+
+# style shared by all regions, only the fill color is stored per region
+base_style = {'color': 'black', 'weight': 0.8, 'dashArray': '5, 5', 'fillOpacity': 0.7}
+
+metrics = ['count', 'countPerSurfacekm2', 'countPer100Inhabitants']
+
+# commune layer: distance to the nearest slaughterhouse that accepts the species
+distance_metric = 'distance_km'
+
+
+# Function to build the tooltip labels of a map
+def tooltip_labels(level, species, language, metric='count'):
+    animal = species_labels[language][species]
+    if language == 'de':
+        region = 'Kanton' if level == 'canton' else 'Gemeinde'
+        labels = [region, f'Anzahl {animal} absolut', f'Anzahl {animal} pro km²',
+                  f'Anzahl {animal} pro 100 Einwohner', '5 beliebtesten Rassen', '5 beliebtesten Namen']
+        distance_labels = ['Distanz zum nächsten Schlachthof (km)', 'Nächster Schlachthof']
+    else:
+        region = 'Canton' if level == 'canton' else 'Commune'
+        labels = [region, f'Nombre de {animal} absolu', f'Nombre de {animal} par km²',
+                  f'Nombre de {animal} pour 100 habitants', '5 races les plus populaires', '5 noms les plus populaires']
+        distance_labels = ['Distance à l’abattoir le plus proche (km)', 'Abattoir le plus proche']
+    if metric == distance_metric:
+        labels = labels[:2] + distance_labels + labels[2:]
+    return labels
+
+
+# Function to build the legend caption of a map
+def legend_caption(species, language, metric):
+    labels = tooltip_labels('commune', species, language, metric)
+    if metric == distance_metric:
+        return labels[2]
+    return labels[1 + metrics.index(metric)]
+
+
+# Function to get the topology of a level and the data rows joined onto its regions
+def joined_values(level, species, metric='count'):
+    layer = 'cantons' if level == 'canton' else 'communes'
+    topojson = topology.layer_topology(layer, topology.level_for_zoom(zoom_start))
+    regions = [geometry['properties'] for geometry in topojson['objects'][layer]['geometries']]
+    if level == 'canton':
+        df = data_store.load_dataset(f'{species}_map_canton')
+        positions = df['canton'].map({region['canton']: i for i, region in enumerate(regions)})
+        positions = positions.fillna(-1).astype(int)
+        df = df[positions.to_numpy() >= 0]
+        df.index = positions[positions >= 0].to_numpy()
+    else:
+        df = data_store.load_dataset(f'{species}_commune')
+        if metric == distance_metric:
+            distances = slaughter_distance.commune_distances(species)
+            df = df.assign(distance_km=distances['distance_1_km'].to_numpy(),
+                           slaughterhouse=distances['slaughterhouse_1'].to_numpy())
+        # a merged commune is drawn on all of its former communes
+        positions = reconcile.commune_positions(df['commune'], shared=False).explode().dropna()
+        df = df.loc[positions.index]
+        df.index = positions.astype(int).to_numpy()
+    df = df[~df.index.duplicated()]
+    return topojson, df
+
+
+# Function to make a cell value safe for the tooltip
+def _tooltip_value(value):
+    if isinstance(value, float):
+        return '' if math.isnan(value) else value
+    return '' if value is None else value
+
+
+# Function to create the empty map of Switzerland all maps start from
+def _base_map():
+    import folium
+
+    return folium.Map(
+        location=[46.8182, 8.2275],
+        zoom_start=zoom_start,
+        min_zoom=7.5,
+        max_bounds=True,
+        max_lat=47.8085, min_lat=45.8179,
+        max_lon=10.4923, min_lon=5.9561
+    )
+
+
+# Function to list the tooltip fields of a level and metric
+def layer_fields(level, metric='count'):
+    name_column = 'canton' if level == 'canton' else 'commune'
+    fields = [name_column] + metrics + ['top5breeds', 'top5names']
+    if metric == distance_metric:
+        fields = fields[:2] + [distance_metric, 'slaughterhouse'] + fields[2:]
+    return fields
+
+
+# Function to build the geometries of the regions at some positions of a layer, with
+# their tooltip values and fill color (regions without a row keep only their name)
+def _layer_geometries(topojson, df, positions, level, metric, classes):
+    layer = 'cantons' if level == 'canton' else 'communes'
+    fields = layer_fields(level, metric)
+    shapes = topojson['objects'][layer]['geometries']
+    rows = df[df.index.isin(positions)]
+    records = rows[fields].to_dict('index')
+    # the class of every row at once, class -1 (no value) picks the missing color
+    colors = np.array(classes['colors'] + [missing_color])[classification.classify(rows[metric], classes['breaks'])]
+    fill_colors = dict(zip(rows.index, colors.tolist()))
+    geometries = {}
+    for i in positions:
+        row = records.get(i)
+        if row is not None:
+            properties = {field: _tooltip_value(row[field]) for field in fields}
+        else:
+            properties = {field: '' for field in fields}
+            properties[fields[0]] = shapes[i]['properties'][fields[0]]
+        properties['style'] = {'fillColor': fill_colors.get(i, missing_color)}
+        geometries[i] = {'type': shapes[i]['type'], 'arcs': shapes[i]['arcs'], 'id': i, 'properties': properties}
+    return geometries
+
+
+# Function to get the regions of a layer (position -> data region) of a level
+def _layer_regions(df, level):
+    return df['canton' if level == 'canton' else 'commune'].to_dict()
+
+
+# Function to refresh a layer after a snapshot changed some regions: as long as the
+# classes keep their breaks only the geometries of the changed regions (where they
+# were drawn before and where they are drawn now) are built again
+def update_layer(old, changes, level, species, metric='count'):
+    classes = classification.classes(level, species, metric)
+    if not np.array_equal(classes['breaks'], old['breaks']):
+        return None
+    names = set().union(*changes.values())
+    topojson, df = joined_values(level, species, metric)
+    regions = _layer_regions(df, level)
+    positions = sorted({i for i, name in old['regions'].items() if name in names}
+                       | {i for i, name in regions.items() if name in names})
+    geometries = list(old['geometries'])
+    for i, geometry in _layer_geometries(topojson, df, positions, level, metric, classes).items():
+        geometries[i] = geometry
+    return {'breaks': classes['breaks'], 'regions': regions, 'geometries': geometries}
+
+
+# Function to get the layer of a level, species and metric: the geometries of the
+# regions with their tooltip values and fill colors, built once per data snapshot
+def map_layer(level, species, metric='count'):
+    def build():
+        classes = classification.classes(level, species, metric)
+        topojson, df = joined_values(level, species, metric)
+        positions = range(len(topojson['objects']['cantons' if level == 'canton' else 'communes']['geometries']))
+        geometries = _layer_geometries(topojson, df, positions, level, metric, classes)
+        return {'breaks': classes['breaks'], 'regions': _layer_regions(df, level),
+                'geometries': [geometries[i] for i in positions]}
+    return data_store.derived(('map_layer', level, species, metric), map_sources(level, species, metric), build,
+                              lambda old, changes: update_layer(old, changes, level, species, metric))
+
+
+# Function to build the folium map of one level, species and language
+def build_map(level, species, language, metric='count'):
+    import folium
+    from branca.colormap import StepColormap
+
+    import map_elements
+
+    layer = 'cantons' if level == 'canton' else 'communes'
+    topojson = topology.layer_topology(layer, topology.level_for_zoom(zoom_start))
+    fields = layer_fields(level, metric)
+    classes = classification.classes(level, species, metric)
+    breaks, colors = classes['breaks'], classes['colors']
+    data = {
+        'type': 'Topology',
+        'transform': topojson['transform'],
+        'arcs': topojson['arcs'],
+        'objects': {layer: {'type': 'GeometryCollection', 'geometries': map_layer(level, species, metric)['geometries']}},
+    }
+
+    # the other levels of detail are loaded by the browser (the geometries refer to the
+    # same arcs); levels coarser than the embedded one are never needed
+    lod = topology.level_for_zoom(zoom_start)
+    levels = []
+    for name in topology.levels_by_detail()[topology.levels_by_detail().index(lod):]:
+        entry = {'name': name, 'tolerance': topology.levels[name][0]}
+        if name != lod:
+            entry['url'] = lod_url + topology.level_arcs_file(layer, name)
+        levels.append(entry)
+
+    m = _base_map()
+    map_elements.CompactTopoJson(
+        data,
+        f'objects.{layer}',
+        base_style,
+        level=lod,
+        levels=levels,
+        tooltip=folium.GeoJsonTooltip(fields=fields, aliases=tooltip_labels(level, species, language, metric), sticky=True),
+    ).add_to(m)
+    if len(breaks) > 1:
+        StepColormap(colors, index=list(breaks), vmin=float(breaks[0]), vmax=float(breaks[-1]),
+                     caption=legend_caption(species, language, metric)).add_to(m)
+    return m
+
+
+# Function to get the marker icon of a species as data url, scaled down to twice its
+# display size (the icons are embedded once per marker)
+def marker_icon_url(species):
+    from PIL import Image
+
+    image = Image.open(data_store.data_path(marker_icons[species])).convert('RGBA')
+    image.thumbnail((2 * marker_size[0], 2 * marker_size[1]), Image.LANCZOS)
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG', optimize=True)
+    return 'data:image/png;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+# Function to build the map of the slaughterhouses that accept a species
+def build_slaughterhouse_map(species, language):
+    import folium
+    from folium.plugins import MarkerCluster
+
+    import map_elements
+
+    df = slaughterhouse_layer.select(species)
+    address = df['Adresse'].astype(object).fillna('').map(lambda text: f'{escape(str(text))}<br>' if text else '')
+    place = df['PLZ'].map(lambda plz: '' if pd.isna(plz) else f'{int(plz)} ') + df['Ort/Region'].astype(object).fillna('').map(escape)
+    points = [[round(lat, 5), round(lon, 5), escape(name), f'{address_lines}{place_line}', int(mask)]
+              for lat, lon, name, address_lines, place_line, mask
+              in zip(df['Latitude'], df['Longitude'], df['Firmenname'].astype(str), address, place, df['mask'])]
+    labels = [slaughterhouse_layer.tierart_labels[language][code] for code in slaughterhouse_layer.tierart_codes]
+
+    m = _base_map()
+    m.fit_bounds(slaughterhouse_layer.switzerland_bounds)
+    m.add_child(folium.LatLngPopup())
+    marker_cluster = MarkerCluster().add_to(m)
+    map_elements.SlaughterhouseMarkers(points, labels, services_labels[language], marker_icon_url(species), marker_size).add_to(marker_cluster)
+    return m
+
+
+# Function to list the files a map of a level, species and metric is built from
+def map_sources(level, species, metric='count'):
+    sources = [geodata.gadm_file, f'{species}_map_canton' if level == 'canton' else f'{species}_commune']
+    if level == 'commune':
+        sources += reconcile.alias_sources()
+    if metric == distance_metric:
+        sources.append('slaughterhouses')
+    return sources
+
+
+# Function to get the html of a map, rendered once per data snapshot (kept by map_cache)
+def render_map(level, species, language, metric='count'):
+    import prerender  # prerender.py builds its maps with this module
+
+    variant = prerender.variant(level, species, language, metric)
+    return map_cache.get_html(
+        ('map', level, species, language, metric), map_sources(level, species, metric),
+        lambda: prerender.stored_html(variant) or build_map(level, species, language, metric).get_root().render())
+
+
+# Function to get the html of the slaughterhouse map of a species, rendered once per
+# data snapshot (kept by map_cache)
+def render_slaughterhouse_map(species, language):
+    import prerender
+
+    variant = prerender.variant('slaughterhouses', species, language)
+    return map_cache.get_html(
+        ('slaughterhouse_map', species, language), ['slaughterhouses', marker_icons[species]],
+        lambda: prerender.stored_html(variant) or build_slaughterhouse_map(species, language).get_root().render())
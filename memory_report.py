@@ -0,0 +1,120 @@
+import os
+import resource
+import sys
+import time
+
+import data_store
+import map_cache
+import timing
+
+##########################################################################################
+############ Memory per session and capacity estimate ####################################
+# The datasets, aggregates and figures live once per process in data_store, the map
+# html in map_cache, and every session borrows them (see data_store), so a pod needs
+#   base (interpreter, libraries) + shared store + sessions x memory of one session
+# This module measures the three parts of a running server:
+#   - rss: resident memory of the process (/proc/self/statm, the peak on other systems)
+#   - shared: the estimated bytes of every entry of data_store and map_cache
+#   - sessions: the estimated bytes of the session_state of every active session
+#     (widget values, table pages, timings); the html of a map is sent on every rerun
+#     and released afterwards, it is not held per session
+# and estimates the memory of the process for a number of sessions. The dashboard shows
+# the report in its debug panel, MEMORY_METRICS writes it as a Prometheus text file.
+#   python memory_report.py            warm everything and print the store
+#   python memory_report.py 50 200     also estimate the memory for 50 and 200 sessions
+
+metrics_file = os.environ.get('MEMORY_METRICS')
+
+
+# Function to get the resident memory of the process in bytes
+def rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # peak resident memory (kilobytes on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+# Function to list the active sessions of the Streamlit server (session id, bytes);
+# empty outside of a running server (also under AppTest, which mocks the runtime)
+def session_bytes():
+    from streamlit.runtime import Runtime
+
+    session_mgr = getattr(Runtime.instance(), '_session_mgr', None) if Runtime.exists() else None
+    if session_mgr is None:
+        return []
+    sessions = []
+    for info in session_mgr.list_active_sessions():
+        try:
+            state = info.session.session_state.filtered_state
+        except Exception:
+            # a session that is shutting down has no state any more
+            continue
+        sessions.append((info.session.id, data_store.value_bytes(state)))
+    return sessions
+
+
+# Function to measure the process: rss, shared store, sessions and the base memory
+def report():
+    store = data_store.store_report() + map_cache.store_report()
+    sessions = session_bytes()
+    rss = rss_bytes()
+    shared = sum(size for _, _, size in store)
+    held = sum(size for _, size in sessions)
+    return {
+        'rss_bytes': rss,
+        'shared_bytes': shared,
+        'shared_entries': len(store),
+        'sessions': len(sessions),
+        'session_bytes': held,
+        'per_session_bytes': held / len(sessions) if sessions else 0.0,
+        'max_session_bytes': max((size for _, size in sessions), default=0),
+        'base_bytes': max(rss - shared - held, 0),
+    }
+
+
+# Function to estimate the resident memory of the process for a number of sessions
+def capacity(n_sessions, measured=None):
+    measured = report() if measured is None else measured
+    return measured['base_bytes'] + measured['shared_bytes'] + n_sessions * measured['per_session_bytes']
+
+
+# Function to format the report as Prometheus text
+def prometheus_text(measured=None):
+    measured = report() if measured is None else measured
+    gauges = [
+        ('dashboard_memory_rss_bytes', 'Resident memory of the process.', 'rss_bytes'),
+        ('dashboard_memory_shared_bytes', 'Estimated bytes of the shared dataset store.', 'shared_bytes'),
+        ('dashboard_memory_base_bytes', 'Resident memory not held by the store or the sessions.', 'base_bytes'),
+        ('dashboard_sessions', 'Active sessions of the process.', 'sessions'),
+        ('dashboard_memory_session_bytes', 'Estimated bytes held by the state of all sessions.', 'session_bytes'),
+        ('dashboard_memory_per_session_bytes', 'Estimated bytes held by the state of one session (mean).', 'per_session_bytes'),
+    ]
+    lines = []
+    for name, help_text, key in gauges:
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge', f'{name} {measured[key]:.0f}']
+    return '\n'.join(lines) + '\n'
+
+
+# Function to write the Prometheus text file (every session writes it at the end of a run)
+def write_prometheus(path):
+    timing.write_text_file(path, prometheus_text())
+
+
+if __name__ == '__main__':
+    import warmup
+
+    started = time.perf_counter()
+    base = rss_bytes()
+    warmup.run()
+    print(f'warmed in {time.perf_counter() - started:.1f} s, rss {base / 1e6:.0f} MB before, {rss_bytes() / 1e6:.0f} MB after')
+    for kind, key, size in sorted(data_store.store_report() + map_cache.store_report(), key=lambda row: -row[2])[:15]:
+        print(f'{size / 1e6:8.2f} MB  {kind:8} {key}')
+    measured = report()
+    print(f"store: {measured['shared_bytes'] / 1e6:.0f} MB in {measured['shared_entries']} entries, "
+          f"base: {measured['base_bytes'] / 1e6:.0f} MB")
+    for n_sessions in [int(arg) for arg in sys.argv[1:]]:
+        print(f'{n_sessions} sessions: about {capacity(n_sessions, measured) / 1e6:.0f} MB '
+              f'(session state not measured outside of a server)')
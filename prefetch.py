@@ -0,0 +1,136 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import data_store
+import warmup
+
+##########################################################################################
+############ Background prefetch of the other views ######################################
+# Switching the selectbox from Rinder to Ziegen reruns the whole script, and the first
+# visit of a view had to build its maps, figures and tables before anything was drawn.
+# After a view has rendered, start() queues the assets of the other views (the other
+# species in the same language first, then the other language) on a small thread pool
+# that is shared by all sessions of the process:
+#   - a task is identified by its name and runs at most once per process and data
+#     version (the fingerprints of the data files), however many sessions ask for it;
+#     the results live in the caches of data_store and map_cache
+#   - steps the warm-up has run count as done, and nothing is queued while the warm-up
+#     is still running, so prefetching matters once the data changed after it
+#   - nothing new is queued once the values prefetched for the current data version add
+#     up to the memory budget (PREFETCH_MB, default 256)
+# PREFETCH_WORKERS sets the size of the pool (default 2).
+
+budget_bytes = int(os.environ.get('PREFETCH_MB', '256')) * 1024 * 1024
+max_workers = int(os.environ.get('PREFETCH_WORKERS', '2'))
+
+species_list = ['cattle', 'goats', 'sheep']
+languages = ['de', 'fr']
+
+_lock = threading.Lock()
+_executor = None
+_tasks = {}  # name -> (data version, future), kept after they finish
+_done = {}  # name -> data version its value was loaded for (by the warm-up or here)
+_version = None
+_stats = {'queued': 0, 'done': 0, 'errors': 0, 'bytes': 0, 'over_budget': 0}
+
+
+# Function to get the version of the data: the fingerprints of all dataset files
+def data_version():
+    return tuple(data_store.file_fingerprint(file_name) for file_name, _ in data_store.datasets.values())
+
+
+# Function to record that a task has loaded its value for a data version
+def record(name, version=None):
+    version = data_version() if version is None else version
+    with _lock:
+        _done[name] = version
+
+
+# Function to list the assets of one view (name, function), in the order the view draws them
+def view_tasks(species, language):
+    import figure_cache
+    import map_engine
+    import slaughter_distance
+    import spatial_join
+
+    tasks = [(f'dataset {name}', lambda name=name: data_store.load_dataset(name))
+             for name in [f'{species}_map_canton', f'{species}_commune', 'slaughterhouses']]
+    tasks += [(f"figure {' '.join(key)}", lambda key=key: figure_cache.get_figure(*key))
+              for key in figure_cache.figure_keys() if key[1] in (species, 'all') and key[2] == language]
+    for level, metric in [('canton', 'count'), ('commune', 'count'), ('commune', map_engine.distance_metric)]:
+        tasks.append((f'map {level} {species} {language} {metric}',
+                      lambda args=(level, species, language, metric): map_engine.render_map(*args)))
+    tasks.append((f'map slaughterhouses {species} {language}',
+                  lambda: map_engine.render_slaughterhouse_map(species, language)))
+    tasks.append((f'distances {species}', lambda: slaughter_distance.underserved(species, n=50)))
+    tasks.append((f'capacity {species}', lambda: spatial_join.capacity(species, 'canton')))
+    return tasks
+
+
+# Function to list the views to prefetch from a view: the other species first, then
+# every species in the other languages
+def neighbours(species, language):
+    views = [(other, language) for other in species_list if other != species]
+    views += [(other, other_language) for other_language in languages if other_language != language
+              for other in [species] + [other for other in species_list if other != species]]
+    return views
+
+
+# Function to run one task in the pool and account for its result
+def _run(name, version, function):
+    with _lock:
+        # tasks are queued in bulk, the budget is checked again before each one
+        if _stats['bytes'] >= budget_bytes:
+            _stats['over_budget'] += 1
+            _tasks.pop(name, None)
+            return
+    try:
+        size = data_store.value_bytes(function())
+    except Exception:
+        with _lock:
+            _stats['errors'] += 1
+        raise
+    with _lock:
+        _done[name] = version
+        _stats['done'] += 1
+        if version == _version:
+            _stats['bytes'] += size
+
+
+# Function to queue the assets of the views next to the one just rendered
+# (returns the number of newly queued tasks)
+def start(species, language):
+    global _executor, _version
+    if warmup.status()['state'] in ('starting', 'warming'):
+        return 0
+    version = data_version()
+    queued = 0
+    with _lock:
+        if version != _version:
+            # the values of the old version are replaced in the caches as they are rebuilt
+            _version = version
+            _stats['bytes'] = 0
+        for view in neighbours(species, language):
+            for name, function in view_tasks(*view):
+                task = _tasks.get(name)
+                if _done.get(name) == version or (task is not None and task[0] == version):
+                    continue
+                if _stats['bytes'] >= budget_bytes:
+                    _stats['over_budget'] += 1
+                    return queued
+                if _executor is None:
+                    _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='prefetch')
+                _tasks[name] = (version, _executor.submit(_run, name, version, function))
+                _stats['queued'] += 1
+                queued += 1
+    return queued
+
+
+# Function to get a copy of the prefetch counters (pending = queued, not finished yet)
+def status():
+    with _lock:
+        stats = dict(_stats)
+        stats['pending'] = sum(not future.done() for _, future in _tasks.values())
+    stats['budget_bytes'] = budget_bytes
+    return stats
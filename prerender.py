@@ -0,0 +1,224 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import branca
+import folium
+
+import classification
+import data_store
+import map_engine
+import topology
+
+##########################################################################################
+############ Pre-rendering of every map variant ##########################################
+# The folium maps used to come from notebook cells run by hand, one species and language
+# at a time, which left stray files (output_b_de.html, swiss_communes_map_sheep_de_o.html)
+# next to the expected ones while others were missing. This script renders the full
+# matrix into maps/ with a process pool:
+#   canton, commune, commune distance and slaughterhouse maps x cattle/goats/sheep x de/fr
+# Every variant has a hash of its inputs (source files, the code of the map modules,
+# class scheme, folium version); maps/manifest.json keeps the hash each file was
+# rendered from, so unchanged maps are skipped and map_engine serves the stored files
+# instead of rendering them. The run fails if a map of the matrix is still missing or outdated.
+#   python prerender.py            render what changed (--force renders everything)
+#   python prerender.py --check    only check that the matrix is complete
+#   python prerender.py --prune    also delete the stray html files of the notebooks
+
+output_dir = 'maps'
+manifest_file = os.path.join(output_dir, 'manifest.json')
+
+languages = ['de', 'fr']
+
+# (level, metric) of the maps, 'slaughterhouses' has no metric
+kinds = [('canton', 'count'), ('commune', 'count'), ('commune', map_engine.distance_metric), ('slaughterhouses', None)]
+
+# code that decides what a map looks like, part of the hash of every variant
+renderer_files = ['map_engine.py', 'classification.py', 'topology.py', 'geodata.py', 'reconcile.py',
+                  'slaughter_distance.py', 'slaughterhouse_layer.py']
+
+_file_hashes = {}  # file fingerprint -> sha256 of the content
+
+
+# Function to describe one map variant (and the file it is rendered to)
+def variant(level, species, language, metric=None):
+    if level == 'slaughterhouses' or metric in (None, 'count'):
+        name = f'{level}_map_{species}_{language}.html'
+    else:
+        name = f'{level}_{metric}_map_{species}_{language}.html'
+    return {'level': level, 'species': species, 'language': language, 'metric': metric,
+            'file': os.path.join(output_dir, name)}
+
+
+# Function to list the variants of the matrix (optionally only some levels)
+def variants(levels=None):
+    return [variant(level, species, language, metric)
+            for level, metric in kinds if levels is None or level in levels
+            for species in map_engine.species_list
+            for language in languages]
+
+
+# Function to list the source files of a variant
+def variant_sources(variant):
+    if variant['level'] == 'slaughterhouses':
+        return ['slaughterhouses', map_engine.marker_icons[variant['species']]]
+    return map_engine.map_sources(variant['level'], variant['species'], variant['metric'])
+
+
+# Function to hash the content of a file (once per file version)
+def file_hash(file_name):
+    fingerprint = data_store.file_fingerprint(file_name)
+    digest = _file_hashes.get(fingerprint)
+    if digest is None:
+        with open(fingerprint[0], 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        _file_hashes[fingerprint] = digest
+    return digest
+
+
+# Function to hash everything a variant is rendered from
+def input_hash(variant):
+    digest = hashlib.sha256()
+    digest.update(json.dumps([variant, classification.default_scheme, folium.__version__, branca.__version__], sort_keys=True).encode())
+    files = [data_store.datasets[name][0] if name in data_store.datasets else name for name in variant_sources(variant)]
+    for file_name in sorted(set(files)) + renderer_files:
+        digest.update(f'{file_name}:{file_hash(file_name)}\n'.encode())
+    return digest.hexdigest()
+
+
+# Function to read the manifest (file -> input hash)
+def load_manifest():
+    path = data_store.data_path(manifest_file)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+# Function to write the manifest atomically
+def save_manifest(manifest):
+    path = data_store.data_path(manifest_file)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+# Function to check if the file of a variant was rendered from the current inputs
+def is_current(variant, manifest=None):
+    if manifest is None:
+        manifest = load_manifest()
+    return (os.path.exists(data_store.data_path(variant['file']))
+            and manifest.get(variant['file']) == input_hash(variant))
+
+
+# Function to get the stored html of a variant, None if it is missing or outdated
+def stored_html(variant):
+    if not is_current(variant):
+        return None
+    with open(data_store.data_path(variant['file']), encoding='utf-8') as f:
+        return f.read()
+
+
+# Function to render one variant to its file (runs in a worker process)
+def render_variant(variant):
+    started = time.perf_counter()
+    if variant['level'] == 'slaughterhouses':
+        m = map_engine.build_slaughterhouse_map(variant['species'], variant['language'])
+    else:
+        m = map_engine.build_map(variant['level'], variant['species'], variant['language'], variant['metric'])
+    html = m.get_root().render()
+    path = data_store.data_path(variant['file'])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        f.write(html)
+    os.replace(path + '.tmp', path)
+    return len(html.encode('utf-8')), time.perf_counter() - started
+
+
+# Function to render the variants whose inputs changed; returns the rendered,
+# skipped and failed (file -> error) variants
+def render(variants, jobs=None, force=False, log=print):
+    manifest = load_manifest()
+    hashes = {v['file']: input_hash(v) for v in variants}
+    todo = [v for v in variants if force or not is_current(v, manifest)]
+    skipped = [v for v in variants if v not in todo]
+    rendered = []
+    failed = {}
+
+    def done(v, result=None, error=None):
+        if error is not None:
+            failed[v['file']] = error
+            log(f"failed   {v['file']}: {error}")
+            return
+        manifest[v['file']] = hashes[v['file']]
+        save_manifest(manifest)
+        rendered.append(v)
+        log(f"rendered {v['file']} ({result[0] / 1e6:.1f} MB in {result[1]:.1f} s)")
+
+    if jobs == 1 or len(todo) <= 1:
+        for v in todo:
+            try:
+                done(v, render_variant(v))
+            except Exception as e:
+                done(v, error=repr(e))
+    elif todo:
+        # the topology is built once here, forked workers inherit it
+        if any(v['level'] != 'slaughterhouses' for v in todo):
+            for layer in ('cantons', 'communes'):
+                topology.layer_topology(layer, topology.level_for_zoom(map_engine.zoom_start))
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = {pool.submit(render_variant, v): v for v in todo}
+            for future in as_completed(futures):
+                try:
+                    done(futures[future], future.result())
+                except Exception as e:
+                    done(futures[future], error=repr(e))
+    return rendered, skipped, failed
+
+
+# Function to list the files of the matrix that are missing or outdated
+def missing_files(levels=None):
+    manifest = load_manifest()
+    return [v['file'] for v in variants(levels) if not is_current(v, manifest)]
+
+
+# Function to list the html files of the project folder (left over from the notebooks,
+# every map of the dashboard is built by map_engine or read from maps/)
+def stray_files():
+    return sorted(os.path.basename(path) for path in glob.glob(data_store.data_path('*.html')))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Render every map variant of the dashboard into maps/')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='worker processes')
+    parser.add_argument('--levels', nargs='+', choices=sorted({level for level, _ in kinds}),
+                        help='only render these map levels')
+    parser.add_argument('--force', action='store_true', help='render even when the inputs did not change')
+    parser.add_argument('--check', action='store_true', help='only check that every map of the matrix is rendered and current')
+    parser.add_argument('--prune', action='store_true', help='delete the stray html files of the project folder')
+    args = parser.parse_args()
+
+    if not args.check:
+        started = time.perf_counter()
+        rendered, skipped, failed = render(variants(args.levels), jobs=args.jobs, force=args.force)
+        print(f'{len(rendered)} rendered, {len(skipped)} unchanged, {len(failed)} failed '
+              f'in {time.perf_counter() - started:.1f} s')
+        if failed:
+            sys.exit(1)
+    for file_name in stray_files():
+        if args.prune:
+            os.remove(data_store.data_path(file_name))
+            print(f'removed stray {file_name}')
+        else:
+            print(f'stray    {file_name} (not rendered here, --prune deletes it)')
+    missing = missing_files(args.levels)
+    for file_name in missing:
+        print(f'missing  {file_name} (not rendered or outdated)')
+    if missing:
+        sys.exit(1)
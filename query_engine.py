@@ -0,0 +1,230 @@
+import sqlite3
+import threading
+
+import numpy as np
+import pandas as pd
+
+import data_store
+import geodata
+import reconcile
+import slaughter_distance
+import slaughterhouse_layer
+import spatial_join
+
+##########################################################################################
+############ Server-side queries of the commune and slaughterhouse tables ################
+# The dashboard used to send the whole commune table (about 2,160 rows per species with
+# the long breed / name strings) and the whole slaughterhouse table to the browser on
+# every rerun and filter them there. The tables are now loaded once per process (and
+# data snapshot) into an in-memory SQLite database with indexes on the filters, and
+# query() returns one sorted page plus the number of matching rows.
+#
+# Tables:
+#   communes         - species, commune, canton, count, densities, top 5 breeds / names
+#   slaughterhouses  - the slaughterhouse list with the canton of its coordinates and
+#                      the Tierart bitmask of slaughterhouse_layer.py (species filter)
+# Text filters are prefix matches (case-insensitive for ASCII), so they use the indexes.
+
+species_list = ['cattle', 'goats', 'sheep']
+
+schema = '''
+CREATE TABLE communes (
+    species TEXT NOT NULL,
+    commune TEXT COLLATE NOCASE,
+    canton TEXT,
+    count REAL,
+    count_per_100_inhabitants REAL,
+    count_per_surface_km2 REAL,
+    top5breeds TEXT,
+    top5names TEXT
+);
+CREATE INDEX communes_commune ON communes (species, commune COLLATE NOCASE);
+CREATE INDEX communes_canton ON communes (species, canton);
+CREATE INDEX communes_count ON communes (species, count);
+
+CREATE TABLE slaughterhouses (
+    "Bew.-Nr." TEXT,
+    "Firmenname" TEXT COLLATE NOCASE,
+    "Adresse" TEXT,
+    "PLZ" REAL,
+    "Ort/Region" TEXT COLLATE NOCASE,
+    "Kategorie" TEXT,
+    "Weitere Aktivitäten" TEXT,
+    "Tierart" TEXT,
+    "Latitude" REAL,
+    "Longitude" REAL,
+    canton TEXT,
+    tierart_mask INTEGER
+);
+CREATE INDEX slaughterhouses_name ON slaughterhouses ("Firmenname" COLLATE NOCASE);
+CREATE INDEX slaughterhouses_place ON slaughterhouses ("Ort/Region" COLLATE NOCASE);
+CREATE INDEX slaughterhouses_canton ON slaughterhouses (canton);
+'''
+
+# table -> columns handed out (in order), sortable columns and filter -> SQL condition
+tables = {
+    'communes': {
+        'columns': ['commune', 'canton', 'count', 'count_per_100_inhabitants', 'count_per_surface_km2',
+                    'top5breeds', 'top5names'],
+        'sort': ['commune', 'canton', 'count', 'count_per_100_inhabitants', 'count_per_surface_km2'],
+        'filters': {
+            'species': 'species = ?',
+            'commune': "commune LIKE ? ESCAPE '\\'",
+            'canton': 'canton = ?',
+            'count_min': 'count >= ?',
+            'count_max': 'count <= ?',
+        },
+    },
+    'slaughterhouses': {
+        'columns': ['Bew.-Nr.', 'Firmenname', 'Adresse', 'PLZ', 'Ort/Region', 'canton', 'Kategorie',
+                    'Weitere Aktivitäten', 'Tierart', 'Latitude', 'Longitude'],
+        'sort': ['Firmenname', 'Ort/Region', 'PLZ', 'canton'],
+        'filters': {
+            'name': "\"Firmenname\" LIKE ? ESCAPE '\\'",
+            'place': "\"Ort/Region\" LIKE ? ESCAPE '\\'",
+            'canton': 'canton = ?',
+            'code': 'tierart_mask & ? != 0',
+        },
+    },
+}
+
+# filters matched as prefix
+prefix_filters = {'commune', 'name', 'place'}
+
+# filters whose value is converted before it is passed to SQL
+filter_values = {'code': slaughterhouse_layer.code_bit}
+
+page_sizes = [25, 50, 100, 200]
+
+_lock = threading.Lock()
+
+
+# Function to get the commune rows of a species with the canton of the commune
+def _commune_rows(species):
+    df = data_store.load_dataset(f'{species}_commune')
+    # a merged commune spanning two cantons is listed in the canton of its first feature
+    positions = reconcile.commune_positions(df['commune'], shared=False).map(lambda p: p[0] if p else -1).to_numpy()
+    cantons = np.full(len(df), None, dtype=object)
+    located = positions >= 0
+    cantons[located] = geodata.commune_geometry()['attributes']['canton'].to_numpy()[positions[located]]
+    return pd.DataFrame({
+        'species': species,
+        'commune': df['commune'].astype(object),
+        'canton': cantons,
+        'count': df['count'],
+        'count_per_100_inhabitants': df['countPer100Inhabitants'],
+        'count_per_surface_km2': df['countPerSurfacekm2'],
+        'top5breeds': df['top5breeds'].astype(object),
+        'top5names': df['top5names'].astype(object),
+    })
+
+
+# Function to get the slaughterhouse rows with the canton of their coordinates
+def _slaughterhouse_rows():
+    columns = [column for column in tables['slaughterhouses']['columns'] if column != 'canton']
+    df = data_store.load_dataset('slaughterhouses')[columns]
+    df = df.astype({column: object for column in columns if df[column].dtype.kind != 'f'})
+    has_point = df[['Latitude', 'Longitude']].notna().all(axis=1).to_numpy()
+    positions = np.full(len(df), -1)
+    positions[has_point] = spatial_join.locate(df.loc[has_point, ['Latitude', 'Longitude']].to_numpy())
+    cantons = np.full(len(df), None, dtype=object)
+    located = positions >= 0
+    cantons[located] = geodata.commune_geometry()['attributes']['canton'].to_numpy()[positions[located]]
+    df['canton'] = cantons
+    df['tierart_mask'] = slaughterhouse_layer.encode(df['Tierart'])
+    return df
+
+
+# Function to build the in-memory database of both tables
+def _build_database():
+    connection = sqlite3.connect(':memory:', check_same_thread=False)
+    connection.executescript(schema)
+    communes = pd.concat([_commune_rows(species) for species in species_list], ignore_index=True)
+    communes.to_sql('communes', connection, if_exists='append', index=False)
+    _slaughterhouse_rows().to_sql('slaughterhouses', connection, if_exists='append', index=False)
+    connection.execute('ANALYZE')
+    connection.commit()
+    return connection
+
+
+# Function to get the database (built once per process and data snapshot)
+def database():
+    sources = [f'{species}_commune' for species in species_list] + ['slaughterhouses', geodata.gadm_file]
+    return data_store.derived('query_database', sources + reconcile.alias_sources(), _build_database)
+
+
+# Function to escape the wildcards of a LIKE pattern
+def _like_prefix(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+# Function to build the WHERE clause and its parameters of the given filters
+def _where(table, filters):
+    conditions = []
+    parameters = []
+    for name, value in (filters or {}).items():
+        if value is None or value == '':
+            continue
+        if name not in tables[table]['filters']:
+            raise ValueError(f'unknown filter {name!r} of table {table!r}')
+        conditions.append(tables[table]['filters'][name])
+        if name in prefix_filters:
+            value = _like_prefix(str(value).strip())
+        elif name in filter_values:
+            value = filter_values[name](value)
+        parameters.append(value)
+    return (' WHERE ' + ' AND '.join(conditions)) if conditions else '', parameters
+
+
+# Function to get one sorted page of a table and the number of matching rows
+# (page starts at 1)
+def query(table, filters=None, sort=None, descending=False, page=1, page_size=50):
+    columns = tables[table]['columns']
+    where, parameters = _where(table, filters)
+    order = ''
+    if sort is not None:
+        if sort not in tables[table]['sort']:
+            raise ValueError(f'cannot sort table {table!r} by {sort!r}')
+        # rows without a value last, rowid keeps pages of equal values stable
+        order = f' ORDER BY "{sort}" IS NULL, "{sort}" {"DESC" if descending else "ASC"}, rowid'
+    select = ', '.join(f'"{column}"' for column in columns)
+    connection = database()
+    with _lock:
+        total = connection.execute(f'SELECT COUNT(*) FROM {table}{where}', parameters).fetchone()[0]
+        rows = connection.execute(f'SELECT {select} FROM {table}{where}{order} LIMIT ? OFFSET ?',
+                                  parameters + [page_size, (max(page, 1) - 1) * page_size]).fetchall()
+    return pd.DataFrame(rows, columns=columns), total
+
+
+# Function to list the distinct values of a column (filter options)
+def distinct(table, column, filters=None):
+    if column not in tables[table]['columns']:
+        raise ValueError(f'unknown column {column!r} of table {table!r}')
+    where, parameters = _where(table, filters)
+    connection = database()
+    with _lock:
+        rows = connection.execute(f'SELECT DISTINCT "{column}" FROM {table}{where} ORDER BY "{column}"', parameters).fetchall()
+    return [row[0] for row in rows if row[0] is not None]
+
+
+# Function to get the Tierart codes of the slaughterhouses
+def slaughterhouse_codes():
+    connection = database()
+    with _lock:
+        masks = [row[0] for row in connection.execute('SELECT DISTINCT tierart_mask FROM slaughterhouses')]
+    return sorted(slaughterhouse_layer.decode(np.bitwise_or.reduce(masks, initial=0)))
+
+
+if __name__ == '__main__':
+    import time
+
+    started = time.perf_counter()
+    database()
+    print(f'database built in {time.perf_counter() - started:.2f} s')
+    for table, filters, sort in [('communes', {'species': 'cattle', 'commune': 'sc'}, 'count'),
+                                 ('communes', {'species': 'goats', 'canton': 'Bern', 'count_min': 100}, 'count'),
+                                 ('slaughterhouses', {'code': 'C', 'canton': 'Zürich'}, 'Firmenname')]:
+        started = time.perf_counter()
+        page, total = query(table, filters, sort, descending=True, page_size=5)
+        print(f'{table} {filters}: {total} rows, page in {(time.perf_counter() - started) * 1000:.2f} ms')
+        print(page.iloc[:, :4].to_string(index=False))
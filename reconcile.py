@@ -0,0 +1,307 @@
+import os
+import re
+import sys
+import time
+from difflib import SequenceMatcher
+
+import pandas as pd
+from unidecode import unidecode
+
+import data_store
+import geodata
+
+##########################################################################################
+############ Identitas commune names -> GADM commune features ############################
+# The Identitas exports use today's communes, the GADM file is older and writes names
+# without spaces ("LaChaux-de-Fonds", "St.Gallen"), with a few typos ("Samen") and
+# without the communes created by mergers since (Glarus Süd, Val-de-Travers, ...).
+# The names are reconciled once in steps, every step only sees the GADM features not
+# taken by an earlier step:
+#   merger     - commune_mergers.csv: communes formed by a merger and all their former
+#                communes, checked first so it also corrects the steps below
+#   exact      - same name (unique in GADM) or "Name (XX)" with the canton
+#   normalized - same name after unidecode, lower case, without spaces/punctuation
+#   fuzzy      - most similar normalized name (trigram index, blocked by canton when
+#                the canton is known)
+#   parts      - names built from former communes ("Gampel-Bratsch", "Val de Bagnes")
+#   shared     - commune_mergers.csv: communes without an outline of their own in GADM,
+#                joined to the feature they lie in (also used by another commune)
+#   outside    - communes outside Switzerland (Liechtenstein, Büsingen, Campione),
+#                no geometry in the GADM file of Switzerland
+# The result is written to commune_aliases.csv (python reconcile.py), one row per
+# commune and GADM feature, and the joins of the maps are a dict lookup on it.
+
+mergers_file = 'commune_mergers.csv'
+aliases_file = 'commune_aliases.csv'
+
+species_list = ['cattle', 'goats', 'sheep']
+
+# communes in the Identitas exports that are not part of GADM Switzerland
+outside_gadm = {
+    'Balzers', 'Eschen', 'Gamprin', 'Mauren', 'Planken', 'Ruggell', 'Schaan', 'Schellenberg',
+    'Triesen', 'Triesenberg', 'Vaduz',
+    'Büsingen am Hochrhein', "Campione d'Italia",
+}
+
+# minimum similarity of the fuzzy step
+fuzzy_threshold = 0.85
+
+# parts of names that are not former communes
+_stopwords = {'al', 'am', 'bei', 'da', 'de', 'del', 'des', 'di', 'du', 'en', 'im', 'la', 'le', 'les',
+              'sur', 'val', 'st', 'ste'}
+
+_suffix_pattern = re.compile(r'^(.*) \(([A-Z]{2})\)$')
+_part_separators = re.compile(r"[\s\-/()'’]+")
+
+
+# Function to normalize a commune name for comparisons
+def normalize(name):
+    return re.sub(r'[^a-z0-9]', '', unidecode(str(name)).lower())
+
+
+# Function to split an Identitas name into its name and canton ("Wald (ZH)")
+def split_canton(name):
+    match = _suffix_pattern.match(name)
+    return (match.group(1), match.group(2)) if match else (name, None)
+
+
+# Function to get the trigrams of a normalized name
+def trigrams(key):
+    key = f'  {key} '
+    return {key[i:i + 3] for i in range(len(key) - 2)}
+
+
+# Class for the GADM features not taken yet, indexed by name, canton and trigram
+class FeaturePool:
+    def __init__(self, attributes):
+        self.attributes = attributes
+        self.keys = attributes['commune'].map(normalize).to_numpy()
+        self.free = set(range(len(attributes)))
+        self.by_name = attributes.groupby('commune').indices
+        self.by_key = pd.Series(range(len(attributes))).groupby(self.keys).indices
+        self.by_gid = dict(zip(attributes['gid'], range(len(attributes))))
+        # GADM names split at - / ( ), e.g. "Klosters-Serneus" -> klosters, serneus
+        self.by_part = {}
+        for position, name in enumerate(attributes['commune']):
+            for part in _part_separators.split(name):
+                if part:
+                    self.by_part.setdefault(normalize(part), []).append(position)
+        self.by_trigram = {}
+        for position, key in enumerate(self.keys):
+            for trigram in trigrams(key):
+                self.by_trigram.setdefault(trigram, set()).add(position)
+
+    def take(self, positions):
+        self.free.difference_update(positions)
+        return positions
+
+    def available(self, positions, canton=None):
+        return [int(p) for p in positions if p in self.free and
+                (canton is None or self.attributes['canton_abbr'].iat[p] == canton)]
+
+    # Function to find the features of a name (or GID) in a canton, taken or not
+    def lookup(self, name, canton):
+        if name in self.by_gid:
+            return [self.by_gid[name]]
+        return [int(p) for p in self.by_key.get(normalize(name), [])
+                if self.attributes['canton_abbr'].iat[p] == canton]
+
+    # Function to find the free features with the most similar name
+    def similar(self, key, canton=None):
+        candidates = set()
+        for trigram in trigrams(key):
+            candidates |= self.by_trigram.get(trigram, set())
+        scored = sorted(((SequenceMatcher(None, key, self.keys[p]).ratio(), p)
+                         for p in self.available(candidates, canton)), reverse=True)
+        return scored
+
+
+# Function to read the curated mergers (commune;canton;former;relation)
+def read_mergers():
+    path = data_store.data_path(mergers_file)
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=['commune', 'canton', 'former', 'relation'])
+    return pd.read_csv(path, sep=';', comment='#', dtype=str)
+
+
+# Function to reconcile Identitas commune names with the GADM features, returns the
+# alias table (commune, canton_abbr, gid, gadm_name, method, score). Features in
+# taken (GIDs) already belong to other communes.
+def reconcile(names, taken=()):
+    attributes = geodata.commune_geometry()['attributes']
+    pool = FeaturePool(attributes)
+    pool.take([pool.by_gid[gid] for gid in taken if gid in pool.by_gid])
+    mergers = read_mergers()
+    matched = {}
+
+    def add(name, positions, method, score=1.0):
+        matched[name] = (pool.take(positions), method, score)
+
+    names = list(dict.fromkeys(names))
+    curated = mergers[mergers['commune'].isin(names)]
+    for name, rows in curated[curated['relation'] == 'merger'].groupby('commune', sort=False):
+        positions = []
+        for canton, former in zip(rows['canton'], rows['former']):
+            positions += [p for p in pool.available(pool.lookup(former, canton)) if p not in positions]
+        if positions:
+            add(name, positions, 'merger')
+
+    for name in names:
+        if name in matched:
+            continue
+        if name in outside_gadm:
+            matched[name] = ([], 'outside', 1.0)
+            continue
+        base, canton = split_canton(name)
+        positions = pool.available(pool.by_name.get(name, []))
+        if len(positions) != 1:
+            positions = pool.available(pool.by_name.get(base, []), canton) if canton else []
+        if len(positions) == 1:
+            add(name, positions, 'exact')
+
+    for name in names:
+        if name in matched:
+            continue
+        base, canton = split_canton(name)
+        positions = pool.available(pool.by_key.get(normalize(base), []), canton)
+        if len(positions) == 1:
+            add(name, positions, 'normalized')
+
+    for name in names:
+        if name in matched:
+            continue
+        base, canton = split_canton(name)
+        scored = pool.similar(normalize(base), canton)
+        if scored and scored[0][0] >= fuzzy_threshold and (len(scored) == 1 or scored[1][0] < scored[0][0]):
+            add(name, [scored[0][1]], 'fuzzy', round(scored[0][0], 3))
+
+    for name in names:
+        if name in matched:
+            continue
+        base, canton = split_canton(name)
+        parts = [normalize(part) for part in _part_separators.split(base)]
+        positions = []
+        for part in parts:
+            if len(part) >= 3 and part not in _stopwords:
+                positions += [p for p in pool.available(pool.by_part.get(part, []), canton) if p not in positions]
+        cantons = attributes['canton_abbr'].to_numpy()[positions] if positions else []
+        if len(set(cantons)) == 1:
+            add(name, positions, 'parts', 0.5)
+
+    for name, rows in curated[curated['relation'] == 'shared'].groupby('commune', sort=False):
+        if name not in matched:
+            positions = []
+            for canton, former in zip(rows['canton'], rows['former']):
+                positions += pool.lookup(former, canton)
+            if positions:
+                matched[name] = (positions, 'shared', 1.0)
+
+    rows = []
+    for name in names:
+        positions, method, score = matched.get(name, ([], 'unmatched', 0.0))
+        for position in positions or [None]:
+            row = attributes.iloc[position] if position is not None else None
+            rows.append({
+                'commune': name,
+                'canton_abbr': row['canton_abbr'] if row is not None else split_canton(name)[1],
+                'gid': row['gid'] if row is not None else None,
+                'gadm_name': row['commune'] if row is not None else None,
+                'method': method,
+                'score': score,
+            })
+    return pd.DataFrame(rows)
+
+
+# Function to reconcile the communes of all species
+def build_aliases():
+    names = []
+    for species in species_list:
+        names += data_store.load_dataset(f'{species}_commune')['commune'].tolist()
+    return reconcile(names)
+
+
+# Function to update the persisted alias table to a new export: drops the communes
+# that no longer exist and reconciles only the new names, against the features the
+# remaining communes don't use. Returns the table and the added / removed names.
+def update_aliases():
+    names = []
+    for species in species_list:
+        names += data_store.load_dataset(f'{species}_commune')['commune'].tolist()
+    names = list(dict.fromkeys(names))
+    path = data_store.data_path(aliases_file)
+    if not os.path.exists(path):
+        aliases = build_aliases()
+        aliases.to_csv(path, index=False)
+        return aliases, names, []
+    aliases = pd.read_csv(path, dtype={'gid': str})
+    known = set(aliases['commune'])
+    added = [name for name in names if name not in known]
+    removed = sorted(known - set(names))
+    if not added and not removed:
+        return aliases, added, removed
+    aliases = aliases[aliases['commune'].isin(names)]
+    taken = aliases.loc[aliases['method'] != 'shared', 'gid'].dropna()
+    if added:
+        aliases = pd.concat([aliases, reconcile(added, taken)], ignore_index=True)
+    aliases.to_csv(path, index=False)
+    return aliases, added, removed
+
+
+# Function to list the files the alias table comes from
+def alias_sources():
+    if os.path.exists(data_store.data_path(aliases_file)):
+        return [aliases_file]
+    return [geodata.gadm_file, mergers_file] + [f'{species}_commune' for species in species_list]
+
+
+# Function to get the alias table (the persisted file, or built when there is none)
+def alias_table():
+    if os.path.exists(data_store.data_path(aliases_file)):
+        return data_store.derived('commune_aliases', [aliases_file],
+                                  lambda: pd.read_csv(data_store.data_path(aliases_file), dtype={'gid': str}))
+    return data_store.derived('commune_aliases', alias_sources(), build_aliases)
+
+
+# Function to get the lookups commune name -> GADM feature positions (with and
+# without the features shared with another commune)
+def _position_lookup():
+    attributes = geodata.commune_geometry()['attributes']
+    gid_positions = dict(zip(attributes['gid'], range(len(attributes))))
+    aliases = alias_table()
+    lookup = {}
+    own = {}
+    for name, gid, method in zip(aliases['commune'], aliases['gid'], aliases['method']):
+        positions = lookup.setdefault(name, [])
+        own_positions = own.setdefault(name, [])
+        if isinstance(gid, str) and gid in gid_positions:
+            positions.append(gid_positions[gid])
+            if method != 'shared':
+                own_positions.append(gid_positions[gid])
+    return {True: lookup, False: own}
+
+
+# Function to get the GADM feature positions of every commune name (list per name,
+# empty for communes without geometry). Maps leave out the shared features, they are
+# drawn with the values of the commune they are named after.
+def commune_positions(names, shared=True):
+    lookup = data_store.derived('commune_positions', alias_sources() + [geodata.gadm_file], _position_lookup)[shared]
+    return pd.Series([lookup.get(name, []) for name in names],
+                     index=names.index if isinstance(names, pd.Series) else None, dtype=object)
+
+
+if __name__ == '__main__':
+    started = time.perf_counter()
+    aliases = build_aliases()
+    path = data_store.data_path(aliases_file)
+    aliases.to_csv(path, index=False)
+    communes = aliases.drop_duplicates('commune')
+    print(f'{len(communes)} communes, {len(aliases)} rows in {time.perf_counter() - started:.2f} s -> {aliases_file}')
+    print(communes['method'].value_counts().to_string())
+    unmatched = communes.loc[communes['method'] == 'unmatched', 'commune'].tolist()
+    if unmatched:
+        print('unmatched:', ', '.join(unmatched), file=sys.stderr)
+    taken = set(aliases['gid'].dropna())
+    pool = FeaturePool(geodata.commune_geometry()['attributes'])
+    for commune, canton, former in read_mergers()[['commune', 'canton', 'former']].itertuples(index=False):
+        if not any(pool.attributes['gid'].iat[p] in taken for p in pool.lookup(former, canton)):
+            print(f'{mergers_file}: {former} ({canton}) of {commune} not found or taken earlier', file=sys.stderr)
@@ -0,0 +1,217 @@
+import time
+
+import numpy as np
+import pandas as pd
+
+import data_store
+import geodata
+import reconcile
+
+##########################################################################################
+############ Rollup cube from the communes to districts, cantons and Switzerland #########
+# The canton figures come from the separately prepared *-canton.csv files and nothing
+# existed at district level. The cube is built once per data snapshot from the commune
+# files only (all species at once):
+#   commune -> district -> canton -> Switzerland
+# with the count, surface and inhabitants summed per region and the ratios recomputed
+# from those sums, so a canton is exactly the sum of its districts. Surface and
+# inhabitants of a commune are not in the files, they follow from the count and the
+# rounded ratios (taken from the species with the largest count, the least rounding).
+# Communes without a GADM commune (Liechtenstein, a few renamed ones) stay at commune
+# level and are not rolled up; coverage() compares the cube with the canton files.
+#
+# Every lookup is an index lookup on the cube:
+#   lookup('goats', 'district')              all districts
+#   drill_down('goats', 'canton', 'Bern')    the districts of Bern
+#   compare('canton', 'count_per_surface_km2')  cantons x species
+
+species_list = ['cattle', 'goats', 'sheep']
+levels = ['commune', 'district', 'canton', 'country']
+country = 'Schweiz'
+
+measures = ['count', 'surface_km2', 'inhabitants']
+ratios = ['count_per_surface_km2', 'count_per_100_inhabitants']
+
+
+# Function to read the communes of all species (only the given communes when names is
+# set) with their estimated surface and inhabitants and their district and canton
+def _commune_table(names=None):
+    frames = []
+    for species in species_list:
+        df = data_store.load_dataset(f'{species}_commune')
+        if names is not None:
+            df = df[df['commune'].isin(names).to_numpy()]
+        count = df['count'].to_numpy(dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            surface = count / df['countPerSurfacekm2'].to_numpy(dtype=float)
+            inhabitants = count * 100 / df['countPer100Inhabitants'].to_numpy(dtype=float)
+        frames.append(pd.DataFrame({'species': species, 'commune': df['commune'].astype(object).to_numpy(),
+                                    'count': count, 'surface_km2': surface, 'inhabitants': inhabitants}))
+    table = pd.concat(frames, ignore_index=True)
+    # a zero count or ratio gives no estimate
+    for column in ['surface_km2', 'inhabitants']:
+        table.loc[~np.isfinite(table[column]) | (table[column] <= 0) | (table['count'] <= 0), column] = np.nan
+        # one value per commune, from the species with the largest count
+        best = table.dropna(subset=[column]).sort_values('count', ascending=False).drop_duplicates('commune')
+        table[column] = table['commune'].map(best.set_index('commune')[column]).to_numpy()
+
+    communes = table['commune'].drop_duplicates()
+    # a merged commune spanning two districts counts in the district of its first feature
+    positions = reconcile.commune_positions(communes, shared=False).map(lambda p: p[0] if p else -1).to_numpy()
+    attributes = geodata.commune_geometry()['attributes']
+    located = positions >= 0
+    regions = pd.DataFrame({'commune': communes.to_numpy(), 'district': None, 'canton': None})
+    regions.loc[located, 'district'] = attributes['district'].to_numpy()[positions[located]]
+    regions.loc[located, 'canton'] = attributes['canton'].to_numpy()[positions[located]]
+    # a district name used in two cantons gets the canton, like "Wald (ZH)" for communes
+    pairs = attributes.drop_duplicates(['district', 'canton'])
+    shared = set(pairs.loc[pairs['district'].duplicated(), 'district'])
+    regions['district_key'] = regions['district']
+    suffixed = regions['district'].isin(shared).to_numpy()
+    regions.loc[suffixed, 'district_key'] = [f'{district} ({geodata.canton_abbreviations[canton]})' for district, canton
+                                             in regions.loc[suffixed, ['district', 'canton']].itertuples(index=False)]
+    return table.merge(regions, on='commune', how='left')
+
+
+# Function to sum the measures of a table per region of a level
+def _aggregate(table, level, region, parent, district, canton):
+    table = table.assign(region=region, parent=parent, district=district, canton=canton)
+    # the ratios only count the animals of communes whose surface / inhabitants are known
+    table['_count_surface'] = table['count'].where(table['surface_km2'].notna())
+    table['_count_inhabitants'] = table['count'].where(table['inhabitants'].notna())
+    keys = ['species', 'region', 'parent', 'district', 'canton']
+    sums = table.groupby(keys, sort=False, dropna=False).agg(
+        count=('count', 'sum'), surface_km2=('surface_km2', 'sum'), inhabitants=('inhabitants', 'sum'),
+        _count_surface=('_count_surface', 'sum'), _count_inhabitants=('_count_inhabitants', 'sum'),
+        communes=('commune', 'size'))
+    return sums.reset_index().assign(level=level)
+
+
+# Function to get the rows of the commune level of the cube from the commune table
+def _commune_rows(table):
+    return table.assign(region=table['commune'], parent=table['district_key'], communes=1, level='commune',
+                        _count_surface=table['count'].where(table['surface_km2'].notna()),
+                        _count_inhabitants=table['count'].where(table['inhabitants'].notna()))
+
+
+# Function to aggregate commune rows of the cube (back to the columns of the commune
+# table) into the rows of the districts, cantons and Switzerland
+def _upper_rows(table, districts=None, cantons=None):
+    located = table[table['canton'].notna()]
+    in_districts = located if districts is None else located[located['district_key'].isin(districts)]
+    in_cantons = located if cantons is None else located[located['canton'].isin(cantons)]
+    return [
+        _aggregate(in_districts, 'district', in_districts['district_key'], in_districts['canton'],
+                   in_districts['district'], in_districts['canton']),
+        _aggregate(in_cantons, 'canton', in_cantons['canton'], country, None, in_cantons['canton']),
+        _aggregate(located, 'country', country, None, None, None),
+    ]
+
+
+# Function to compute the ratios of rows from their sums
+def _ratios(part):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return part.assign(
+            count_per_surface_km2=part['_count_surface'] / part['surface_km2'].replace(0, np.nan),
+            count_per_100_inhabitants=part['_count_inhabitants'] * 100 / part['inhabitants'].replace(0, np.nan))
+
+
+# Function to put the rows of the cube (with their ratios) together and index them
+def _index_cube(parts):
+    columns = ['species', 'level', 'region', 'parent', 'district', 'canton', 'communes'] + measures + ratios
+    cube = pd.concat([part[columns] for part in parts], ignore_index=True)
+    cube['level'] = pd.Categorical(cube['level'], categories=levels)
+    by_region = cube.set_index(['species', 'level', 'region']).sort_index()
+    # only rows with a parent are ever children (not Switzerland and the unplaced communes)
+    by_parent = cube[cube['parent'].notna()].set_index(['species', 'level', 'parent', 'region']).sort_index()
+    return {'by_region': by_region, 'by_parent': by_parent}
+
+
+# Function to build the cube: one row per species, level and region
+def _build_cube():
+    table = _commune_table()
+    return _index_cube([_ratios(part) for part in [_commune_rows(table)] + _upper_rows(table)])
+
+
+# Function to update the cube after a snapshot changed some communes: only these
+# communes are read again and only their districts and cantons aggregated again
+# (Switzerland is summed from the commune rows)
+def _update_cube(old, changes):
+    names = set().union(*changes.values())
+    if not names:
+        return old
+    rows = old['by_region'].reset_index()
+    rows['level'] = rows['level'].astype(object)
+    communes = rows[rows['level'] == 'commune']
+    changed = communes['region'].isin(names).to_numpy()
+    before = communes[changed]
+    kept = communes[~changed]
+    table = _commune_rows(_commune_table(names))
+    communes = pd.concat([
+        kept.assign(commune=kept['region'], district_key=kept['parent'],
+                    _count_surface=kept['count'].where(kept['surface_km2'].notna()),
+                    _count_inhabitants=kept['count'].where(kept['inhabitants'].notna())),
+        table,
+    ], ignore_index=True)
+    # districts and cantons the changed communes belonged to before or belong to now
+    districts = set(before['parent'].dropna()) | set(table['district_key'].dropna())
+    cantons = set(before['canton'].dropna()) | set(table['canton'].dropna())
+    untouched = rows[((rows['level'] == 'district') & ~rows['region'].isin(districts))
+                     | ((rows['level'] == 'canton') & ~rows['region'].isin(cantons))]
+    fresh = [_ratios(part) for part in [table] + _upper_rows(communes, districts, cantons)]
+    return _index_cube([kept, untouched] + fresh)
+
+
+# Function to get the cube (built once per process and data snapshot)
+def _cubes():
+    sources = [f'{species}_commune' for species in species_list] + [geodata.gadm_file] + reconcile.alias_sources()
+    return data_store.derived('rollup_cube', sources, _build_cube, _update_cube)
+
+
+# Function to get the whole cube, indexed by species, level and region
+def cube():
+    return _cubes()['by_region']
+
+
+# Function to get the regions of a level (all or the given ones) of a species
+def lookup(species, level, regions=None):
+    by_region = _cubes()['by_region']
+    rows = by_region.loc[(species, level)]
+    return rows if regions is None else rows.loc[regions]
+
+
+# Function to get the regions of the next level inside a region (e.g. the districts
+# of a canton)
+def drill_down(species, level, region):
+    if level == 'commune':
+        raise ValueError('communes are the lowest level of the cube')
+    child_level = levels[levels.index(level) - 1]
+    return _cubes()['by_parent'].loc[(species, child_level, region)]
+
+
+# Function to compare the species side by side: one row per region of a level
+def compare(level, metric='count', regions=None):
+    by_region = _cubes()['by_region']
+    rows = by_region.xs(level, level='level')[metric].unstack('species')
+    return rows if regions is None else rows.loc[regions]
+
+
+# Function to compare the canton totals of the cube with the canton files: share of
+# the animals that the commune files place in a canton
+def coverage():
+    totals = compare('canton', 'count').sum()
+    files = pd.Series({species: data_store.load_dataset(f'{species}_map_canton')['count'].sum() for species in species_list})
+    return pd.DataFrame({'cube': totals, 'canton_files': files, 'share': totals / files})
+
+
+if __name__ == '__main__':
+    started = time.perf_counter()
+    by_region = cube()
+    print(f'cube of {len(by_region)} rows built in {time.perf_counter() - started:.2f} s')
+    print(by_region.groupby(level=['species', 'level'], observed=True).size().unstack().to_string())
+    print(coverage().to_string())
+    started = time.perf_counter()
+    districts = drill_down('goats', 'canton', 'Bern')
+    print(f"districts of Bern in {(time.perf_counter() - started) * 1000:.2f} ms")
+    print(districts[['count', 'count_per_surface_km2', 'count_per_100_inhabitants']].round(1).to_string())
+    print(compare('canton', 'count_per_surface_km2').round(1).to_string())
@@ -0,0 +1,165 @@
+import bisect
+import re
+import sys
+import time
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+import breeds
+import data_store
+
+##########################################################################################
+############ Inverted index over the top 5 breeds and names ##############################
+# "Which communes have Appenzellerziege in their top 5?" or "where is Bella most
+# popular?" used to be a substring scan of every top 5 string. The long tables of
+# breeds.py (canton and commune level, breeds and names, all species) are turned once
+# per data snapshot into an inverted index:
+#   token  -> values (a breed or name whose words start with the token)
+#   value  -> postings (level, species, region, rank, count), sorted by rank and count
+# Tokens are lower case without accents, so "jurassienne" finds "Jurassienne" and
+# "leonie" finds "Léonie". Every word of a
+# query has to match a word of the value as a prefix, so "appenz" already finds
+# "Appenzellerziege" and "original braun" finds "Original Braunvieh".
+
+levels = ['canton', 'commune']
+kinds = ['breeds', 'names']
+
+_word_separators = re.compile(r"[\s\-_/()'’.,]+")
+
+
+# Function to split a text into normalized tokens (lower case, no accents)
+def tokenize(text):
+    text = unicodedata.normalize('NFKD', str(text).lower())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return [token for token in _word_separators.split(text) if token]
+
+
+# Function to build the index from the long tables of breeds.py
+def _build_index():
+    value_ids = {}
+    columns = {'value': [], 'level': [], 'species': [], 'region': [], 'rank': [], 'count': []}
+    for level_code, level in enumerate(levels):
+        for kind in kinds:
+            table = breeds.long_table(level, kind)
+            value_column = table['breed' if kind == 'breeds' else 'name']
+            ids = np.array([value_ids.setdefault((kind, value), len(value_ids)) for value in value_column.cat.categories],
+                           dtype=np.int32)
+            columns['value'].append(ids[value_column.cat.codes.to_numpy()])
+            columns['level'].append(np.full(len(table), level_code, dtype=np.int8))
+            columns['species'].append(table['species'].astype(object).to_numpy())
+            columns['region'].append(table['region'].astype(object).to_numpy())
+            columns['rank'].append(table['rank'].to_numpy().astype(np.int8))
+            columns['count'].append(table['count'].to_numpy().astype(np.int32))
+    postings = {column: np.concatenate(parts) for column, parts in columns.items()}
+    species_codes, species_names = pd.factorize(postings['species'])
+    region_codes, region_names = pd.factorize(postings['region'])
+    postings['species'] = species_codes.astype(np.int8)
+    postings['region'] = region_codes.astype(np.int32)
+
+    # postings grouped by value, best entries (rank 1, highest count) first
+    order = np.lexsort((-postings['count'], postings['rank'], postings['value']))
+    postings = {column: values[order] for column, values in postings.items()}
+    offsets = np.searchsorted(postings['value'], np.arange(len(value_ids) + 1))
+
+    token_values = {}
+    for (kind, value), value_id in value_ids.items():
+        for token in tokenize(value):
+            token_values.setdefault(token, set()).add(value_id)
+    tokens = sorted(token_values)
+    values = [value for value, _ in sorted(value_ids.items(), key=lambda item: item[1])]
+    # a name can also be a breed, the result column has every text once
+    value_codes, value_names = pd.factorize(pd.Index([value for _, value in values], dtype=object))
+    return {
+        'values': values,
+        'value_kinds': np.array([kinds.index(kind) for kind, _ in values], dtype=np.int8),
+        'value_codes': value_codes.astype(np.int32),
+        'postings': postings,
+        'offsets': offsets,
+        'tokens': tokens,
+        'token_values': [np.array(sorted(token_values[token]), dtype=np.int32) for token in tokens],
+        'species': np.asarray(species_names, dtype=object),
+        'regions': np.asarray(region_names, dtype=object),
+        # result columns are categoricals of these, cheaper than building strings
+        'dtypes': {
+            'kind': pd.CategoricalDtype(kinds),
+            'value': pd.CategoricalDtype(value_names),
+            'level': pd.CategoricalDtype(levels),
+            'species': pd.CategoricalDtype(species_names),
+            'region': pd.CategoricalDtype(region_names),
+        },
+    }
+
+
+# Function to get the index (built once per process and data snapshot)
+def search_index():
+    suffixes = {breeds.sources[(level, kind)][0] for level in levels for kind in kinds}
+    sources = [f'{species}_{suffix}' for suffix in sorted(suffixes) for species in breeds.species_list]
+    return data_store.derived('search_index', sources, _build_index)
+
+
+# Function to find the values (ids) with a word starting with every token of the query
+def match_values(text, kind=None, index=None):
+    if index is None:
+        index = search_index()
+    matched = None
+    for token in tokenize(text):
+        start = bisect.bisect_left(index['tokens'], token)
+        end = bisect.bisect_left(index['tokens'], token + '￿', start)
+        if start == end:
+            return np.array([], dtype=np.int32)
+        ids = np.unique(np.concatenate(index['token_values'][start:end]))
+        matched = ids if matched is None else np.intersect1d(matched, ids, assume_unique=True)
+    if matched is None:
+        return np.array([], dtype=np.int32)
+    if kind is not None:
+        matched = matched[index['value_kinds'][matched] == kinds.index(kind)]
+    return matched
+
+
+# Function to search the breeds and names: one row per region where a matching value
+# is in the top 5, best ranks (then highest counts) first
+def search(text, kind=None, level=None, species=None, limit=50):
+    index = search_index()
+    value_ids = match_values(text, kind, index)
+    postings = index['postings']
+    offsets = index['offsets']
+    starts = offsets[value_ids]
+    lengths = offsets[value_ids + 1] - starts
+    # positions of the postings of all matched values
+    positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+    if level is not None:
+        positions = positions[postings['level'][positions] == levels.index(level)]
+    if species is not None:
+        species_codes = list(index['species'])
+        positions = positions[postings['species'][positions] == (species_codes.index(species) if species in species_codes else -1)]
+    total = len(positions)
+    # the postings of one value are already in order
+    if len(value_ids) > 1:
+        positions = positions[np.lexsort((-postings['count'][positions], postings['rank'][positions]))]
+    positions = positions[:limit]
+    value_ids = postings['value'][positions]
+    dtypes = index['dtypes']
+    result = pd.DataFrame({
+        'kind': pd.Categorical.from_codes(index['value_kinds'][value_ids], dtype=dtypes['kind']),
+        'value': pd.Categorical.from_codes(index['value_codes'][value_ids], dtype=dtypes['value']),
+        'level': pd.Categorical.from_codes(postings['level'][positions], dtype=dtypes['level']),
+        'species': pd.Categorical.from_codes(postings['species'][positions], dtype=dtypes['species']),
+        'region': pd.Categorical.from_codes(postings['region'][positions], dtype=dtypes['region']),
+        'rank': postings['rank'][positions],
+        'count': postings['count'][positions],
+    })
+    return result, total
+
+
+if __name__ == '__main__':
+    started = time.perf_counter()
+    index = search_index()
+    print(f"index of {len(index['values'])} values, {len(index['tokens'])} tokens and "
+          f"{len(index['postings']['value'])} postings built in {time.perf_counter() - started:.2f} s")
+    for query in sys.argv[1:] or ['Appenzellerziege', 'Bella', 'original braun', 'zurich']:
+        started = time.perf_counter()
+        result, total = search(query, limit=5)
+        print(f'{query!r}: {total} postings in {(time.perf_counter() - started) * 1000:.3f} ms')
+        print(result.to_string(index=False))
@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+
+import data_store
+import geodata
+import reconcile
+import slaughterhouse_layer
+
+##########################################################################################
+############ Distance from every commune to the nearest slaughterhouses ##################
+# A BallTree with the haversine metric is built once per species code over the
+# slaughterhouses that accept that species (Tierart). All commune centroids are then
+# queried in one batch for their k nearest slaughterhouses.
+
+earth_radius_km = 6371.0088
+
+
+# Function to get the BallTree of the slaughterhouses accepting a Tierart code
+def slaughterhouse_index(code):
+    def build():
+        from sklearn.neighbors import BallTree  # takes about 1 s to import, only needed here
+        eligible = slaughterhouse_layer.select(codes=[code])
+        tree = BallTree(np.radians(eligible[['Latitude', 'Longitude']].to_numpy()), metric='haversine')
+        return tree, eligible
+    return data_store.derived(('slaughterhouse_index', code), ['slaughterhouses'], build)
+
+
+# Function to find the k nearest slaughterhouses of many points (lat, lon in degrees)
+def nearest(points, code, k=3):
+    tree, eligible = slaughterhouse_index(code)
+    k = min(k, len(eligible))
+    distances, indices = tree.query(np.radians(points), k=k)
+    return distances * earth_radius_km, indices, eligible
+
+
+# Function to build the distance table of one species: for every commune the
+# k nearest slaughterhouses that accept it and their distance in km. A merged
+# commune is placed at the mean of the points of its former communes.
+def _commune_distances(species, k):
+    communes = data_store.load_dataset(f'{species}_commune')
+    positions = reconcile.commune_positions(communes['commune'])
+    located = positions.map(len).to_numpy() > 0
+    centroids = geodata.commune_centroids()
+    points = np.array([centroids[p].mean(axis=0) for p in positions[located]]).reshape(-1, 2)
+    distances, indices, eligible = nearest(points, slaughterhouse_layer.species_codes[species], k)
+
+    result = pd.DataFrame({
+        'commune': communes['commune'],
+        'count': communes['count'],
+        'latitude': np.nan,
+        'longitude': np.nan,
+    })
+    result.loc[located, 'latitude'] = points[:, 0]
+    result.loc[located, 'longitude'] = points[:, 1]
+    names = eligible['Firmenname'].to_numpy()
+    places = eligible['Ort/Region'].to_numpy()
+    for rank in range(distances.shape[1]):
+        distance = np.full(len(result), np.nan)
+        distance[located] = distances[:, rank].round(1)
+        name = np.full(len(result), None, dtype=object)
+        name[located] = [f'{n} ({p})' for n, p in zip(names[indices[:, rank]], places[indices[:, rank]])]
+        result[f'distance_{rank + 1}_km'] = distance
+        result[f'slaughterhouse_{rank + 1}'] = name
+    return result
+
+
+# Function to get the distance table of a species (cached per data snapshot)
+def commune_distances(species, k=3):
+    sources = ['slaughterhouses', f'{species}_commune', geodata.gadm_file] + reconcile.alias_sources()
+    return data_store.derived(('commune_distances', species, k), sources,
+                              lambda: _commune_distances(species, k))
+
+
+# Function to list the communes furthest away from a slaughterhouse, weighted by the
+# number of animals that have to travel (count x distance)
+def underserved(species, n=20, min_count=1):
+    df = commune_distances(species)
+    df = df[(df['count'] >= min_count) & df['distance_1_km'].notna()]
+    df = df.assign(animal_km=df['count'] * df['distance_1_km'])
+    df = df.nlargest(n, 'animal_km')
+    return df.assign(animal_km=df['animal_km'].round(0))
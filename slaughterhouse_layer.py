@@ -0,0 +1,110 @@
+import time
+
+import numpy as np
+import pandas as pd
+
+import data_store
+
+##########################################################################################
+############ Slaughterhouse layer with a Tierart bitmask #################################
+# One dataset of the slaughterhouses shared by every species and language. The comma
+# separated Tierart codes of every slaughterhouse ("A, B, C, O, P, S, wU") are encoded
+# once per data snapshot as a bitmask (bit i = tierart_codes[i]), so "accepts goats"
+# is a vectorized (mask & bit) != 0 instead of parsing the strings again, and the
+# labels of the popups come from the code tables below in the language of the map.
+# Only slaughterhouses with coordinates inside Switzerland are in the layer (a few
+# addresses were geocoded abroad).
+
+# Tierart codes in bit order
+tierart_codes = ['A', 'B', 'C', 'L', 'O', 'P', 'S', 'fG', 'R', 'wA', 'wL', 'wU', 'wG']
+
+tierart_labels = {
+    'de': {
+        'A': 'Hausgeflügel', 'B': 'Rindergattung', 'C': 'Ziegenartige', 'L': 'Hasenartige (domestiziert)',
+        'O': 'Schafe', 'P': 'Schweine', 'S': 'Einhufer', 'fG': 'Im Gehege gehaltene Landsäuger',
+        'R': 'Laufvögel', 'wA': 'Wildvögel', 'wL': 'Wilde Hasenartige', 'wU': 'Wilde Huftiere',
+        'wG': 'Wilde Landsäuger',
+    },
+    'fr': {
+        'A': 'Volaille domestique', 'B': 'Bovins', 'C': 'Caprins', 'L': 'Léporidés (domestiques)',
+        'O': 'Moutons', 'P': 'Porcs', 'S': 'Équidés', 'fG': 'Mammifères terrestres en enclos',
+        'R': 'Oiseaux coureurs', 'wA': 'Oiseaux sauvages', 'wL': 'Léporidés sauvages', 'wU': 'Ongulés sauvages',
+        'wG': 'Mammifères terrestres sauvages',
+    },
+}
+
+# species of the dashboard -> Tierart code
+species_codes = {'cattle': 'B', 'goats': 'C', 'sheep': 'O'}
+
+# Define the bounding box for Switzerland
+switzerland_bounds = [[45.8179, 5.9561], [47.8085, 10.4923]]
+
+
+# Function to get the bit of a Tierart code (or of a species of the dashboard)
+def code_bit(code):
+    return 1 << tierart_codes.index(species_codes.get(code, code))
+
+
+# Function to encode Tierart strings as bitmasks (unknown codes are ignored)
+def encode(tierart):
+    tierart = pd.Series(tierart).astype(object).fillna('')
+    codes = tierart.str.split(r'\s*,\s*', regex=True).explode()
+    bits = codes.map({code: 1 << i for i, code in enumerate(tierart_codes)}).fillna(0).astype(np.int64)
+    # every code is listed once per slaughterhouse, so the sum is the bitwise or
+    masks = bits.groupby(level=0).sum().reindex(tierart.index, fill_value=0)
+    return masks.to_numpy().astype(np.uint16)
+
+
+# Function to decode a bitmask into its Tierart codes
+def decode(mask):
+    return [code for i, code in enumerate(tierart_codes) if int(mask) >> i & 1]
+
+
+# Function to get one boolean column per Tierart code (codes that occur only)
+def code_columns(masks):
+    masks = np.asarray(masks)
+    columns = {code: (masks & (1 << i)) != 0 for i, code in enumerate(tierart_codes)}
+    return pd.DataFrame({code: column for code, column in columns.items() if column.any()})
+
+
+# Function to build the layer: the slaughterhouses inside Switzerland with their mask
+def _build_layer():
+    df = data_store.load_dataset('slaughterhouses')
+    df = df.dropna(subset=['Latitude', 'Longitude'])
+    (min_lat, min_lon), (max_lat, max_lon) = switzerland_bounds
+    inside = df['Latitude'].between(min_lat, max_lat) & df['Longitude'].between(min_lon, max_lon)
+    df = df[inside].reset_index(drop=True)
+    df['mask'] = encode(df['Tierart'])
+    return df
+
+
+# Function to get the layer (built once per process and data snapshot)
+def layer():
+    return data_store.derived('slaughterhouse_layer', ['slaughterhouses'], _build_layer)
+
+
+# Function to get the slaughterhouses accepting a species or any of some Tierart codes
+def select(species=None, codes=None):
+    df = layer()
+    wanted = [species_codes[species]] if species is not None else list(codes or tierart_codes)
+    bits = sum(code_bit(code) for code in wanted)
+    return df[(df['mask'].to_numpy() & bits) != 0].reset_index(drop=True)
+
+
+# Function to get the labels of the services of every mask in a language
+def services(masks, language):
+    labels = tierart_labels[language]
+    masks = pd.Series(np.asarray(masks))
+    # there are few distinct masks, each is decoded once
+    return masks.map({mask: ', '.join(labels[code] for code in decode(mask)) for mask in masks.unique()}).to_numpy()
+
+
+if __name__ == '__main__':
+    started = time.perf_counter()
+    df = layer()
+    print(f'{len(df)} slaughterhouses, {df["mask"].nunique()} distinct masks in {time.perf_counter() - started:.3f} s')
+    print(code_columns(df['mask']).sum().to_string())
+    for species in species_codes:
+        started = time.perf_counter()
+        selected = select(species)
+        print(f'{species}: {len(selected)} slaughterhouses in {(time.perf_counter() - started) * 1000:.2f} ms')
@@ -0,0 +1,180 @@
+import json
+import os
+import sys
+
+import pandas as pd
+import pyarrow as pa
+
+import data_store
+import ingest
+import reconcile
+
+##########################################################################################
+############ Identitas exports kept per validity date ####################################
+# Every Identitas export (the *-map-canton.csv / *-map-commune.csv files) is stored in
+# snapshots/<validity>/<dataset>.arrow, keyed by the "Validity" date of its header.
+# Adding a snapshot compares it with the previous one region by region (hash of every
+# row). The change list is written next to the snapshot (changes.json) and drives the
+# recomputation:
+#   - only the Arrow file of data_store (arrow/) of a changed dataset is rewritten
+#   - the commune alias table is updated only when commune names appeared / disappeared
+#   - the values derived at runtime from the exports get the changed regions from
+#     data_store.derived: the rollup cube reads and aggregates again only the changed
+#     communes and their districts and cantons, the class breaks are kept when the
+#     values of the changed regions stayed the same, and the map layers then build only
+#     the geometries of the changed regions again (the others are rebuilt whole)
+#   - the prerendered maps (python prerender.py) are keyed by the content of their input
+#     files, only the maps of a species and level whose export changed are rendered again
+# history() reads one region across all snapshots for a time series.
+#
+# Usage: python snapshots.py [add]               store the current export
+#        python snapshots.py list                validity dates and changes
+#        python snapshots.py history NAME REGION counts of a region over time
+
+snapshot_dir = 'snapshots'
+
+# datasets that come from the Identitas exports -> column with the region name
+identitas_datasets = {
+    f'{species}_{level}': 'canton' if level == 'map_canton' else 'commune'
+    for species in ['cattle', 'goats', 'sheep'] for level in ['map_canton', 'commune']
+}
+
+
+# Function to get the path of a dataset in the snapshot of a validity date
+def snapshot_path(validity, name):
+    return data_store.data_path(os.path.join(snapshot_dir, validity, f'{name}.arrow'))
+
+
+# Function to list the validity dates of the stored snapshots of a dataset (oldest first)
+def validity_dates(name=None):
+    root = data_store.data_path(snapshot_dir)
+    if not os.path.isdir(root):
+        return []
+    dates = sorted(entry for entry in os.listdir(root) if os.path.isdir(os.path.join(root, entry)))
+    return [date for date in dates if name is None or os.path.exists(snapshot_path(date, name))]
+
+
+# Function to read a dataset of a snapshot as a data frame (plain, not categorical)
+def read_snapshot(validity, name, columns=None):
+    with pa.memory_map(snapshot_path(validity, name), 'r') as source:
+        table = pa.ipc.open_file(source).read_all()
+    if columns is not None:
+        table = table.select(columns)
+    return _plain(table.to_pandas())
+
+
+# Function to turn the dictionary encoded columns back into plain values
+def _plain(df):
+    for column in df.columns:
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype(object)
+    return df
+
+
+# Function to hash every row of a data frame, indexed by its region name
+def row_hashes(df, key):
+    hashes = pd.util.hash_pandas_object(_plain(df.copy()).drop(columns=key), index=False)
+    hashes.index = df[key].to_numpy()
+    return hashes
+
+
+# Function to compare two versions of a dataset region by region
+def diff(old, new, key):
+    old_hashes = row_hashes(old, key)
+    new_hashes = row_hashes(new, key)
+    common = old_hashes.index.intersection(new_hashes.index)
+    changed = common[old_hashes[common].to_numpy() != new_hashes[common].to_numpy()]
+    return {
+        'added': sorted(new_hashes.index.difference(old_hashes.index)),
+        'removed': sorted(old_hashes.index.difference(new_hashes.index)),
+        'changed': sorted(changed),
+    }
+
+
+# Function to store the current export of one dataset, returns its validity and changes
+# (None when the file has no Identitas header or the snapshot is already stored)
+def add_dataset(name):
+    table = ingest.read_table(name)
+    validity = (table.schema.metadata or {}).get(b'identitas.validity', b'').decode()
+    if not validity:
+        return None
+    key = identitas_datasets[name]
+    new = _plain(table.to_pandas())
+    path = snapshot_path(validity, name)
+    if os.path.exists(path):
+        if not any(diff(read_snapshot(validity, name), new, key).values()):
+            return None
+    previous = [date for date in validity_dates(name) if date < validity]
+    if previous:
+        changes = diff(read_snapshot(previous[-1], name), new, key)
+    else:
+        changes = {'added': sorted(new[key]), 'removed': [], 'changed': []}
+    ingest.write_table(table, path)
+    return validity, previous[-1] if previous else None, changes
+
+
+# Function to store the current export and refresh only what depends on changed data
+def add_snapshot(names=None):
+    summary = {}
+    for name in names or identitas_datasets:
+        result = add_dataset(name)
+        if result is None:
+            continue
+        validity, previous, dataset_changes = result
+        if not data_store.arrow_current(name):
+            ingest.ingest(name)
+        summary.setdefault(validity, {})[name] = {'previous': previous, **dataset_changes}
+
+    communes_changed = any(entry['added'] or entry['removed'] for datasets in summary.values()
+                           for name, entry in datasets.items() if identitas_datasets[name] == 'commune')
+    if communes_changed:
+        _, added, removed = reconcile.update_aliases()
+        for datasets in summary.values():
+            datasets['commune_aliases'] = {'added': added, 'removed': removed}
+
+    for validity, datasets in summary.items():
+        datasets = {**changes(validity), **datasets}
+        path = data_store.data_path(os.path.join(snapshot_dir, validity, 'changes.json'))
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(datasets, f, ensure_ascii=False, indent=1)
+    return summary
+
+
+# Function to read the changes stored with a snapshot
+def changes(validity):
+    path = data_store.data_path(os.path.join(snapshot_dir, validity, 'changes.json'))
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+# Function to get the values of one region in every snapshot of a dataset (time series)
+def history(name, region, columns=('count',)):
+    key = identitas_datasets[name]
+    rows = []
+    for validity in validity_dates(name):
+        df = read_snapshot(validity, name, [key] + list(columns))
+        row = df[df[key] == region]
+        if len(row):
+            rows.append({'validity': validity, **row.iloc[0][list(columns)].to_dict()})
+    return pd.DataFrame(rows, columns=['validity'] + list(columns))
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'add'
+    if command == 'add':
+        summary = add_snapshot()
+        if not summary:
+            print('no new or changed export')
+        for validity, datasets in summary.items():
+            for name, entry in datasets.items():
+                counts = ', '.join(f'{len(entry[kind])} {kind}' for kind in ['added', 'removed', 'changed'] if kind in entry)
+                print(f"{validity} {name}: {counts}")
+    elif command == 'list':
+        for validity in validity_dates():
+            datasets = changes(validity)
+            print(validity, ', '.join(f"{name} ({sum(len(v) for k, v in entry.items() if k != 'previous')})"
+                                      for name, entry in datasets.items()))
+    elif command == 'history':
+        print(history(sys.argv[2], sys.argv[3]).to_string(index=False))
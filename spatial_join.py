@@ -0,0 +1,135 @@
+import numpy as np
+import pandas as pd
+import shapely
+from shapely.geometry import shape
+
+import data_store
+import geodata
+import reconcile
+import rollup
+import slaughterhouse_layer
+
+##########################################################################################
+############ Slaughterhouses joined to communes, districts and cantons ###################
+# The slaughterhouses only carry a free text "Ort/Region" ("Echallens VD"). Their
+# coordinates are joined to the commune polygons in one batch with an STRtree (built
+# once per process), districts and cantons follow from the commune. Points that fall
+# just outside every polygon (lakes, border) take the nearest commune within
+# max_distance. The swissBOUNDARIES3D folder of this repository only has the attribute
+# tables (no .shp), so the polygons are the GADM communes used by the maps.
+#
+# The per-region counts are split by Tierart code (slaughterhouses_B, _C, _O, ...) and
+# are put next to the livestock counts of a species by capacity().
+
+levels = {
+    'commune': ['commune', 'district', 'canton', 'canton_abbr'],
+    'district': ['district', 'canton', 'canton_abbr'],
+    'canton': ['canton', 'canton_abbr'],
+}
+
+# nearest commune for points outside all polygons, in degrees (about 1 km)
+max_distance = 0.01
+
+
+# Function to build the STRtree over the GADM communes
+def _commune_tree():
+    geometries = np.array([shape(geometry) for geometry in geodata.commune_geometry()['geometries']])
+    return shapely.STRtree(geometries)
+
+
+# Function to get the STRtree of the communes (built once per process)
+def commune_tree():
+    return data_store.derived('commune_tree', [geodata.gadm_file], _commune_tree)
+
+
+# Function to keep the first match of every point (a point on a border is in two communes)
+def _first_match(point_indices, tree_indices, positions):
+    _, first = np.unique(point_indices, return_index=True)
+    positions[point_indices[first]] = tree_indices[first]
+
+
+# Function to find the GADM commune of many points (lat, lon in degrees), -1 if none
+def locate(points):
+    tree = commune_tree()
+    geometries = shapely.points(points[:, 1], points[:, 0])
+    positions = np.full(len(points), -1)
+    _first_match(*tree.query(geometries, predicate='intersects'), positions)
+    missing = np.flatnonzero(positions < 0)
+    if len(missing):
+        point_indices, tree_indices = tree.query_nearest(geometries[missing], max_distance=max_distance)
+        _first_match(missing[point_indices], tree_indices, positions)
+    return positions
+
+
+# Function to get the Identitas name of every GADM feature (GADM name if none)
+def _feature_communes():
+    attributes = geodata.commune_geometry()['attributes']
+    aliases = reconcile.alias_table()
+    aliases = aliases[aliases['method'] != 'shared'].dropna(subset=['gid']).drop_duplicates('gid')
+    names = dict(zip(aliases['gid'], aliases['commune']))
+    return np.array([names.get(gid, name) for gid, name in zip(attributes['gid'], attributes['commune'])], dtype=object)
+
+
+# Function to join the slaughterhouses to their commune, district and canton
+def _slaughterhouse_regions():
+    df = slaughterhouse_layer.layer()
+    attributes = geodata.commune_geometry()['attributes']
+    positions = locate(df[['Latitude', 'Longitude']].to_numpy())
+    located = positions >= 0
+    columns = {
+        'gid': attributes['gid'].to_numpy(),
+        'commune': _feature_communes(),
+        'district': attributes['district'].to_numpy(),
+        'canton': attributes['canton'].to_numpy(),
+        'canton_abbr': attributes['canton_abbr'].to_numpy(),
+    }
+    for column, values in columns.items():
+        joined = np.full(len(df), None, dtype=object)
+        joined[located] = values[positions[located]]
+        df[column] = joined
+    return df
+
+
+# Function to get the slaughterhouses with their regions (cached per data snapshot)
+def slaughterhouse_regions():
+    sources = ['slaughterhouses', geodata.gadm_file] + reconcile.alias_sources()
+    return data_store.derived('slaughterhouse_regions', sources, _slaughterhouse_regions)
+
+
+# Function to count the slaughterhouses of every region, in total and per Tierart code
+def _region_counts(level):
+    df = slaughterhouse_regions().dropna(subset=['canton'])
+    keys = levels[level]
+    totals = df.groupby(keys).size().rename('slaughterhouses')
+    codes = slaughterhouse_layer.code_columns(df['mask']).set_index(df.index)
+    by_code = codes.groupby([df[key] for key in keys]).sum().add_prefix('slaughterhouses_')
+    return pd.concat([totals, by_code], axis=1).fillna(0).astype(int).reset_index()
+
+
+# Function to get the slaughterhouse counts of a level (cached per data snapshot)
+def region_counts(level):
+    sources = ['slaughterhouses', geodata.gadm_file] + reconcile.alias_sources()
+    return data_store.derived(('slaughterhouse_region_counts', level), sources, lambda: _region_counts(level))
+
+
+# Function to get the livestock counts of a species per region
+def _livestock_counts(species, level):
+    if level == 'canton':
+        return data_store.load_dataset(f'{species}_map_canton')[['canton', 'count']]
+    if level == 'district':
+        return rollup.lookup(species, 'district')[['district', 'canton', 'count']].reset_index(drop=True)
+    return data_store.load_dataset(f'{species}_commune')[['commune', 'count']]
+
+
+# Function to put the slaughterhouses accepting a species next to its livestock
+# counts: region, count, slaughterhouses, animals_per_slaughterhouse
+def capacity(species, level='canton'):
+    livestock = _livestock_counts(species, level)
+    counts = region_counts(level)
+    column = f'slaughterhouses_{slaughterhouse_layer.species_codes[species]}'
+    keys = [key for key in levels[level] if key in livestock.columns]
+    df = livestock.merge(counts[levels[level] + [column]], on=keys, how='left')
+    df = df.rename(columns={column: 'slaughterhouses'})
+    df['slaughterhouses'] = df['slaughterhouses'].fillna(0).astype(int)
+    df['animals_per_slaughterhouse'] = (df['count'] / df['slaughterhouses'].replace(0, np.nan)).round(0)
+    return df.sort_values('count', ascending=False).reset_index(drop=True)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the modules of the dashboard live in the project folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import breeds
+import data_store
+
+
+def test_parse_top5():
+    column = pd.Series([
+        'Braunvieh  1195, Kreuzung  420',
+        np.nan,
+        'Red Holstein  300, Swiss Fleckvieh  12, Andere  7',
+        '',
+        # an entry without a count is skipped, the ranks go on
+        'Simmental, Original Braunvieh  5',
+    ], index=[10, 11, 12, 13, 14])
+    parsed = breeds.parse_top5(column)
+    assert parsed.to_dict('list') == {
+        'row': [0, 0, 2, 2, 2, 4],
+        'rank': [1, 2, 1, 2, 3, 1],
+        'breed': ['Braunvieh', 'Kreuzung', 'Red Holstein', 'Swiss Fleckvieh', 'Andere', 'Original Braunvieh'],
+        'count': [1195, 420, 300, 12, 7, 5],
+    }
+    assert parsed[['row', 'rank', 'count']].dtypes.astype(str).tolist() == ['int64', 'int8', 'int64']
+
+
+def test_parse_top5_empty():
+    parsed = breeds.parse_top5(pd.Series([np.nan, ''], dtype=object), 'name')
+    assert parsed.columns.tolist() == ['row', 'rank', 'name', 'count']
+    assert len(parsed) == 0
+
+
+@pytest.mark.parametrize('level, kind', list(breeds.sources))
+def test_parse_top5_like_the_string_methods(level, kind):
+    suffix, _, column = breeds.sources[(level, kind)]
+    for species in breeds.species_list:
+        df = data_store.load_dataset(f'{species}_{suffix}')
+        pd.testing.assert_frame_equal(breeds.parse_top5(df[column]), breeds._vectorized_parse_top5(df[column]),
+                                      check_dtype=False)
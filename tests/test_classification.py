@@ -0,0 +1,68 @@
+import itertools
+
+import numpy as np
+import pytest
+
+import classification
+
+
+# Function to get the sum of squared deviations of classes split after the given
+# positions of the sorted values
+def split_cost(values, ends):
+    groups = np.split(np.sort(values), ends)
+    return sum(((group - group.mean()) ** 2).sum() for group in groups)
+
+
+# Function to find the smallest cost of n classes by trying every split between
+# distinct values
+def brute_force_cost(values, n_classes):
+    values = np.sort(values)
+    cuts = [i for i in range(1, len(values)) if values[i] != values[i - 1]]
+    return min(split_cost(values, ends) for ends in itertools.combinations(cuts, n_classes - 1))
+
+
+# Function to get the cost of the classes of some breaks (a value belongs to the
+# first class whose break is not below it)
+def breaks_cost(values, breaks):
+    values = np.sort(values)
+    return split_cost(values, [np.searchsorted(values, high, side='right') for high in breaks[1:-1]])
+
+
+@pytest.mark.parametrize('seed', range(20))
+@pytest.mark.parametrize('n_classes', [2, 3, 4])
+@pytest.mark.parametrize('block', [2, 256])
+def test_jenks_against_brute_force(monkeypatch, seed, n_classes, block):
+    monkeypatch.setattr(classification, 'jenks_block', block)
+    rng = np.random.default_rng(seed)
+    # repeated values weigh their distinct value
+    values = rng.choice(rng.integers(0, 50, 8), 10).astype(float)
+    breaks = classification.jenks_breaks(values, n_classes)
+    if len(np.unique(values)) <= n_classes:
+        assert np.array_equal(breaks, np.unique(values))
+        return
+    assert len(breaks) == n_classes + 1
+    assert breaks[0] == values.min() and breaks[-1] == values.max()
+    assert breaks_cost(values, breaks) == pytest.approx(brute_force_cost(values, n_classes))
+
+
+def test_jenks_skips_missing_values():
+    values = np.array([1, 2, 3, np.nan, 10, 11, 12, np.nan])
+    assert classification.jenks_breaks(values, 2).tolist() == [1, 3, 12]
+    assert classification.jenks_breaks([np.nan, np.nan], 3).tolist() == []
+
+
+def test_single_value():
+    assert classification.jenks_breaks([5, 5, 5], 3).tolist() == [5]
+    classes = classification.build_classes(np.array([5.0, 5.0, np.nan]), classification.palettes['cattle'])
+    assert classes['breaks'].tolist() == [5]
+    assert classes['labels'] == ['5']
+    assert len(classes['colors']) == 1
+    assert classification.classify([5, np.nan], classes['breaks']).tolist() == [0, -1]
+
+
+def test_classify():
+    breaks = np.array([0, 10, 20, 30])
+    values = [-5, 0, 5, 10, 10.5, 20, 30, 40, np.nan]
+    # a break belongs to the class below it, values out of range to the first / last class
+    assert classification.classify(values, breaks).tolist() == [0, 0, 0, 0, 1, 1, 2, 2, -1]
+    assert classification.classify([], breaks).tolist() == []
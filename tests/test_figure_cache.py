@@ -0,0 +1,16 @@
+import numpy as np
+import pytest
+
+import classification
+import data_store
+import figure_cache
+
+
+@pytest.mark.parametrize('species', figure_cache.species_list)
+def test_pie_counts_of_the_canton_map(species):
+    fig = figure_cache.pie(species, 'de')
+    classes = classification.classes('canton', species, 'count')
+    counts = data_store.load_dataset(f'{species}_map_canton')['count'].to_numpy(dtype=float)
+    category = classification.classify(counts, classes['breaks'])
+    expected = {classes['labels'][i]: counts[category == i].sum() for i in np.unique(category[category >= 0])}
+    assert dict(zip(fig.data[0].labels, fig.data[0].values)) == expected
@@ -0,0 +1,92 @@
+import urllib.error
+
+import pytest
+
+import data_store
+import geocoder
+
+
+# Fixture: a few slaughterhouses, a stand-in server and an empty cache per test
+@pytest.fixture
+def rows():
+    df = data_store.load_dataset('slaughterhouses_raw').head(8)
+    return df.drop_duplicates(subset=['Adresse', 'PLZ', 'Ort/Region']).reset_index(drop=True)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return geocoder.GeocodeCache(str(tmp_path / 'geocode_cache.jsonl'))
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(geocoder, 'backoff', 0.01)
+
+
+# Function to start the stand-in server and return its url
+def start(request, rows, failures=None):
+    server = geocoder.serve(df=rows, failures=failures)
+    request.addfinalizer(server.shutdown)
+    return f'http://127.0.0.1:{server.server_port}/geocode/v1/json'
+
+
+def test_geocode_frame(request, rows, cache):
+    url = start(request, rows)
+    df, stats = geocoder.geocode_frame(rows, cache, n_workers=2, rate=0, url=url)
+    assert stats['api'] == len(rows)
+    assert df['Latitude'].notna().all()
+    # a second run is answered from the cache file
+    df, stats = geocoder.geocode_frame(rows, geocoder.GeocodeCache(cache.path), url=url)
+    assert stats == {'cached': len(rows)}
+
+
+def test_retry_server_errors(request, rows, cache):
+    url = start(request, rows, failures={1: 503, 2: 429})
+    address = geocoder.address_of(rows.iloc[0])
+    assert geocoder.lookup(address, url=url) is not None
+    assert len(geocoder.StandInHandler.requests) == 3
+
+
+def test_retry_timeout(request, rows, monkeypatch):
+    monkeypatch.setattr(geocoder, 'timeout', 0.2)
+    url = start(request, rows, failures={1: 'slow'})
+    address = geocoder.address_of(rows.iloc[0])
+    assert geocoder.lookup(address, url=url) is not None
+
+
+def test_retries_exhausted(request, rows):
+    url = start(request, rows, failures={n: 503 for n in range(1, geocoder.retries + 1)})
+    with pytest.raises(RuntimeError):
+        geocoder.lookup(geocoder.address_of(rows.iloc[0]), url=url)
+    assert len(geocoder.StandInHandler.requests) == geocoder.retries
+
+
+def test_rate_limit(request, rows, cache):
+    url = start(request, rows)
+    rate = 20.0
+    geocoder.geocode_frame(rows, cache, n_workers=4, rate=rate, url=url)
+    times = sorted(geocoder.StandInHandler.requests)
+    assert len(times) == len(rows)
+    # the limiter spaces the requests of all threads, allow a little scheduling jitter
+    gaps = [b - a for a, b in zip(times, times[1:])]
+    assert min(gaps) > 0.8 / rate
+    assert times[-1] - times[0] >= (len(rows) - 1) * 0.9 / rate
+
+
+def test_partial_failure(request, rows, cache):
+    # the third request is rejected (400 is not retried): the addresses resolved so far
+    # stay in the cache and the lookups that have not started are cancelled
+    url = start(request, rows, failures={3: 400})
+    with pytest.raises(urllib.error.HTTPError):
+        geocoder.geocode_frame(rows, cache, n_workers=2, rate=50, url=url)
+    served = len(geocoder.StandInHandler.requests)
+    assert served < len(rows)
+    assert len(cache.entries) == served - 1
+    assert len(geocoder.GeocodeCache(cache.path).entries) == served - 1
+
+    # the next run only looks up the rest
+    geocoder.StandInHandler.failures = {}
+    df, stats = geocoder.geocode_frame(rows, cache, n_workers=2, rate=0, url=url)
+    assert stats['cached'] == served - 1
+    assert stats['api'] == len(rows) - served + 1
+    assert df['Latitude'].notna().all()
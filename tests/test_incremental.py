@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import classification
+import data_store
+import map_engine
+import rollup
+
+load_dataset = data_store.load_dataset
+
+
+# Function to change the rows of some regions of a dataset the way a new snapshot would:
+# the counts of the first two regions swapped, the third one with a new count, the fourth
+# one removed
+def next_snapshot(monkeypatch, dataset, new_count):
+    df = load_dataset(dataset)
+    column = 'canton' if dataset.endswith('_canton') else 'commune'
+    df = df[df['count'].notna()].sort_values('count', ascending=False)
+    names = df[column].iloc[[3, 4, 5, 6]].tolist()
+
+    def load(name):
+        frame = load_dataset(name)
+        if name != dataset:
+            return frame
+        frame = frame.copy()
+        rows = [frame.index[frame[column] == region][0] for region in names]
+        frame.loc[rows[0], 'count'], frame.loc[rows[1], 'count'] = frame.loc[rows[1], 'count'], frame.loc[rows[0], 'count']
+        if new_count is not None:
+            frame.loc[rows[2], 'count'] = new_count
+        return frame.drop(index=rows[3] if new_count is not None else []).reset_index(drop=True)
+    monkeypatch.setattr(data_store, 'load_dataset', load)
+    return {dataset: set(names if new_count is not None else names[:2])}
+
+
+# Function to build a value again from scratch (the cached one is the old snapshot)
+def rebuilt(get, *args):
+    data_store.clear_cache()
+    return get(*args)
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    data_store.clear_cache()
+    yield
+    data_store.clear_cache()
+
+
+@pytest.mark.parametrize('new_count', [None, 12345.0])
+def test_cube_update(monkeypatch, new_count):
+    old = rollup._build_cube()
+    changes = next_snapshot(monkeypatch, 'goats_commune', new_count)
+    updated = rollup._update_cube(old, changes)
+    full = rollup._build_cube()
+    for key in ['by_region', 'by_parent']:
+        pd.testing.assert_frame_equal(updated[key], full[key], check_dtype=False)
+
+
+@pytest.mark.parametrize('level, dataset', [('canton', 'goats_map_canton'), ('commune', 'goats_commune')])
+def test_classes_and_layer_update(monkeypatch, level, dataset):
+    old_classes = classification.classes(level, 'goats')
+    old_layer = map_engine.map_layer(level, 'goats')
+    changes = next_snapshot(monkeypatch, dataset, None)
+    # swapped values keep the breaks: the classes and the layer are updated in place
+    classes = classification.update_classes(old_classes, changes, level, 'goats')
+    assert classes is not None
+    layer = map_engine.update_layer(old_layer, changes, level, 'goats')
+    assert layer is not None
+    full_classes = rebuilt(classification.classes, level, 'goats')
+    full_layer = map_engine.map_layer(level, 'goats')
+    assert np.array_equal(classes['breaks'], full_classes['breaks'])
+    assert classes['labels'] == full_classes['labels']
+    pd.testing.assert_series_equal(classes['values'], full_classes['values'])
+    assert layer['geometries'] == full_layer['geometries']
+    assert layer['geometries'] != old_layer['geometries']
+
+
+def test_classes_rebuilt_when_values_change(monkeypatch):
+    old = classification.classes('commune', 'goats')
+    changes = next_snapshot(monkeypatch, 'goats_commune', 12345.0)
+    assert classification.update_classes(old, changes, 'commune', 'goats') is None
+
+
+def test_derived_update(monkeypatch, tmp_path):
+    source = tmp_path / 'source.csv'
+    source.write_text('a')
+    calls = []
+
+    def update(old, changes):
+        calls.append(changes)
+        return None if old == 'updated' else 'updated'
+    monkeypatch.setattr(data_store, 'changed_regions', lambda *args: {'source': {'Bern'}})
+    assert data_store.derived('test', [str(source)], lambda: 'built', update) == 'built'
+    source.write_text('ab')
+    assert data_store.derived('test', [str(source)], lambda: 'built', update) == 'updated'
+    assert data_store.derived('test', [str(source)], lambda: 'built', update) == 'updated'
+    source.write_text('abc')
+    # the update gives up: the value is built again
+    assert data_store.derived('test', [str(source)], lambda: 'built', update) == 'built'
+    assert calls == [{'source': {'Bern'}}, {'source': {'Bern'}}]
+    assert data_store.cache_stats()['derived_updates'] == 1
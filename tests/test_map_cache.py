@@ -0,0 +1,33 @@
+import map_cache
+
+
+def test_hits_and_file_changes(tmp_path):
+    map_cache.clear_cache()
+    source = tmp_path / 'source.csv'
+    source.write_text('a')
+    renders = []
+
+    def render():
+        renders.append(1)
+        return f'<html>{len(renders)}</html>'
+    assert map_cache.get_html(('map', 'x'), [str(source)], render) == '<html>1</html>'
+    assert map_cache.get_html(('map', 'x'), [str(source)], render) == '<html>1</html>'
+    source.write_text('ab')
+    assert map_cache.get_html(('map', 'x'), [str(source)], render) == '<html>2</html>'
+    asset = map_cache.cache_stats()['assets']['map/x']
+    assert (asset['hits'], asset['misses'], asset['bytes']) == (1, 2, len('<html>2</html>'))
+    assert asset['hit_rate'] == 1 / 3
+
+
+def test_least_recently_used_evicted(monkeypatch, tmp_path):
+    map_cache.clear_cache()
+    monkeypatch.setattr(map_cache, 'budget_bytes', 25)
+    source = tmp_path / 'source.csv'
+    source.write_text('a')
+    for name in ['a', 'b', 'a', 'c']:
+        map_cache.get_html(('map', name), [str(source)], lambda: name * 10)
+    stats = map_cache.cache_stats()
+    # b was used least recently when c came in
+    assert [key for key, asset in stats['assets'].items() if asset['cached']] == ['map/a', 'map/c']
+    assert (stats['bytes'], stats['evictions']) == (20, 1)
+    map_cache.clear_cache()
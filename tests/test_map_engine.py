@@ -0,0 +1,25 @@
+import folium
+import pytest
+
+import map_elements
+import map_engine
+
+
+# Function to find the tooltip of the choropleth layer of a map
+def tooltip_of(m):
+    for child in m._children.values():
+        if isinstance(child, map_elements.CompactTopoJson):
+            return next(item for item in child._children.values() if isinstance(item, folium.GeoJsonTooltip))
+    raise AssertionError('no choropleth layer')
+
+
+@pytest.mark.parametrize('level, language, region', [
+    ('canton', 'de', 'Kanton'),
+    ('canton', 'fr', 'Canton'),
+    ('commune', 'de', 'Gemeinde'),
+    ('commune', 'fr', 'Commune'),
+])
+def test_tooltip_aliases(level, language, region):
+    tooltip = tooltip_of(map_engine.build_map(level, 'cattle', language))
+    assert tooltip.aliases == map_engine.tooltip_labels(level, 'cattle', language)
+    assert tooltip.aliases[0] == region
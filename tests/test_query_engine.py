@@ -0,0 +1,52 @@
+import pandas as pd
+import pytest
+
+import data_store
+import query_engine
+import slaughterhouse_layer
+
+# SQLite's LIKE ignores the case of ASCII letters only
+ascii_lower = str.maketrans('ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz')
+
+
+# Function to get all matching rows of a query
+def all_rows(table, filters, sort):
+    page, total = query_engine.query(table, filters, sort, page_size=10000)
+    assert len(page) == total
+    return page
+
+
+# Function to list the slaughterhouses of some rows (number and name, sorted)
+def keys(df):
+    return sorted((str(number), str(name)) for number, name in zip(df['Bew.-Nr.'], df['Firmenname']))
+
+
+@pytest.mark.parametrize('species', query_engine.species_list)
+@pytest.mark.parametrize('prefix', ['sc', 'SC', 'St. ', 'la c', 'z', 'Zü', 'zü', 'Ü', ' bern ', '%', 'a_', 'x'])
+def test_commune_prefix(species, prefix):
+    page = all_rows('communes', {'species': species, 'commune': prefix}, 'commune')
+    communes = data_store.load_dataset(f'{species}_commune')['commune'].astype(str)
+    wanted = prefix.strip().translate(ascii_lower)
+    expected = communes[communes.map(lambda name: name.translate(ascii_lower).startswith(wanted))]
+    assert sorted(page['commune']) == sorted(expected)
+
+
+@pytest.mark.parametrize('code', slaughterhouse_layer.tierart_codes + list(slaughterhouse_layer.species_codes))
+def test_slaughterhouse_code(code):
+    page = all_rows('slaughterhouses', {'code': code}, 'Firmenname')
+    df = data_store.load_dataset('slaughterhouses')
+    wanted = slaughterhouse_layer.species_codes.get(code, code)
+    codes = df['Tierart'].astype(object).fillna('').str.split(r'\s*,\s*', regex=True)
+    expected = df[codes.map(lambda listed: wanted in listed).to_numpy()]
+    assert len(page) == len(expected)
+    assert keys(page) == keys(expected)
+
+
+def test_slaughterhouse_code_and_place():
+    page = all_rows('slaughterhouses', {'code': 'goats', 'place': 'b'}, 'Ort/Region')
+    df = data_store.load_dataset('slaughterhouses')
+    codes = df['Tierart'].astype(object).fillna('').str.split(r'\s*,\s*', regex=True)
+    places = df['Ort/Region'].astype(object).fillna('').str.lower()
+    expected = df[(codes.map(lambda listed: 'C' in listed) & places.str.startswith('b')).to_numpy()]
+    assert len(page) == len(expected) > 0
+    assert pd.Series(page['Ort/Region']).str.lower().str.startswith('b').all()
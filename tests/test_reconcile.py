@@ -0,0 +1,107 @@
+import pandas as pd
+import pytest
+
+import data_store
+import geodata
+import reconcile
+
+# GADM features of a small Switzerland (gid, name, canton)
+features = [
+    ('G1', 'Bern', 'BE'),
+    ('G2', 'Wald', 'ZH'),
+    ('G3', 'Wald', 'AR'),
+    ('G4', 'LaChaux-de-Fonds', 'NE'),
+    ('G5', 'St.Gallen', 'SG'),
+    ('G6', 'Wolfenschiesen', 'NW'),
+    ('G7', 'Schwanden', 'GL'),
+    ('G8', 'Elm', 'GL'),
+    ('G9', 'Gampel', 'VS'),
+    ('G10', 'Bratsch', 'VS'),
+    ('G11', 'Klosters-Serneus', 'GR'),
+    ('G12', 'Ennenda', 'GL'),
+]
+
+mergers = [
+    ('Glarus Süd', 'GL', 'Schwanden', 'merger'),
+    ('Glarus Süd', 'GL', 'Elm', 'merger'),
+    # renamed: a merger of one former commune
+    ('Klosters', 'GR', 'Klosters-Serneus', 'merger'),
+    ('Oberbern', 'BE', 'Bern', 'shared'),
+]
+
+# Identitas name -> (step, GADM names)
+expected = {
+    'Glarus Süd': ('merger', ['Schwanden', 'Elm']),
+    'Klosters': ('merger', ['Klosters-Serneus']),
+    'Bern': ('exact', ['Bern']),
+    'Wald (ZH)': ('exact', ['Wald']),
+    'Wald (AR)': ('exact', ['Wald']),
+    'La Chaux-de-Fonds': ('normalized', ['LaChaux-de-Fonds']),
+    'St. Gallen': ('normalized', ['St.Gallen']),
+    'Wolfenschiessen': ('fuzzy', ['Wolfenschiesen']),
+    'Gampel-Bratsch': ('parts', ['Gampel', 'Bratsch']),
+    'Oberbern': ('shared', ['Bern']),
+    'Vaduz': ('outside', []),
+    # blocked by its canton: no feature in SG is called Wald
+    'Wald (SG)': ('unmatched', []),
+    # Ennenda is in GL, not in ZH
+    'Ennenda (ZH)': ('unmatched', []),
+}
+
+
+@pytest.fixture
+def gadm(monkeypatch):
+    attributes = pd.DataFrame(features, columns=['gid', 'commune', 'canton_abbr'])
+    monkeypatch.setattr(geodata, 'commune_geometry', lambda: {'attributes': attributes})
+    monkeypatch.setattr(reconcile, 'read_mergers',
+                        lambda: pd.DataFrame(mergers, columns=['commune', 'canton', 'former', 'relation']))
+
+
+# Function to get the step and GADM names of every commune of an alias table
+def steps(aliases):
+    return {name: (rows['method'].iat[0], rows['gadm_name'].dropna().tolist())
+            for name, rows in aliases.groupby('commune', sort=False)}
+
+
+def test_split_canton():
+    assert reconcile.split_canton('Wald (ZH)') == ('Wald', 'ZH')
+    assert reconcile.split_canton('Wald') == ('Wald', None)
+    assert reconcile.split_canton('Wald (Zürich)') == ('Wald (Zürich)', None)
+
+
+@pytest.mark.parametrize('name', list(expected))
+def test_steps(gadm, name):
+    assert steps(reconcile.reconcile(list(expected)))[name] == expected[name]
+
+
+def test_canton_of_unmatched_suffix(gadm):
+    aliases = reconcile.reconcile(['Wald (SG)'])
+    assert aliases[['canton_abbr', 'gid', 'score']].iloc[0].tolist() == ['SG', None, 0.0]
+
+
+def test_taken_features_skipped(gadm):
+    # Bern's feature belongs to another commune, no step takes it again
+    assert steps(reconcile.reconcile(['Bern'], taken=['G1']))['Bern'] == ('unmatched', [])
+
+
+def test_update_aliases(gadm, monkeypatch, tmp_path):
+    exports = {'cattle': ['Bern', 'Wald (ZH)', 'Glarus Süd'], 'goats': ['Vaduz'], 'sheep': ['Bern']}
+    monkeypatch.setattr(reconcile, 'aliases_file', str(tmp_path / 'commune_aliases.csv'))
+    monkeypatch.setattr(data_store, 'load_dataset',
+                        lambda name: pd.DataFrame({'commune': exports[name.split('_')[0]]}))
+    aliases, added, removed = reconcile.update_aliases()
+    assert added == ['Bern', 'Wald (ZH)', 'Glarus Süd', 'Vaduz'] and removed == []
+
+    # Bern is renamed Berne: the new name gets the feature the old one left
+    exports.update(cattle=['Berne', 'Wald (ZH)', 'Glarus Süd', 'Wald (AR)'], sheep=[])
+    aliases, added, removed = reconcile.update_aliases()
+    assert (added, removed) == (['Berne', 'Wald (AR)'], ['Bern'])
+    assert steps(aliases) == {
+        'Wald (ZH)': ('exact', ['Wald']),
+        'Glarus Süd': ('merger', ['Schwanden', 'Elm']),
+        'Vaduz': ('outside', []),
+        'Berne': ('fuzzy', ['Bern']),
+        'Wald (AR)': ('exact', ['Wald']),
+    }
+    assert steps(pd.read_csv(tmp_path / 'commune_aliases.csv', dtype={'gid': str})) == steps(aliases)
+    assert reconcile.update_aliases()[1:] == ([], [])
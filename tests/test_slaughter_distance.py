@@ -0,0 +1,13 @@
+import pytest
+
+import slaughter_distance
+
+
+@pytest.mark.parametrize('species', ['cattle', 'goats', 'sheep'])
+def test_underserved_weighted_by_animals(species):
+    df = slaughter_distance.underserved(species, n=10)
+    distances = slaughter_distance.commune_distances(species)
+    distances = distances[(distances['count'] >= 1) & distances['distance_1_km'].notna()]
+    expected = (distances['count'] * distances['distance_1_km']).nlargest(10)
+    assert df.index.tolist() == expected.index.tolist()
+    assert df['animal_km'].tolist() == expected.round(0).tolist()
@@ -0,0 +1,162 @@
+import functools
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+##########################################################################################
+############ Timing of the dashboard stages ##############################################
+# Lightweight spans around the stages of a rerun (load, aggregate, figure, map,
+# dataframe). Every span is added to three places:
+#   - the current run (thread of the Streamlit script, shown by the debug panel)
+#   - the session (dict kept in st.session_state by the dashboard)
+#   - the process (all sessions, exported as a Prometheus text file)
+# TIMING_LOG=<file> appends one JSON line per span, TIMING_METRICS=<file> rewrites the
+# Prometheus file at the end of every run. Outside of a run (scripts, benchmarks) the
+# spans only go to the process totals.
+
+log_file = os.environ.get('TIMING_LOG')
+metrics_file = os.environ.get('TIMING_METRICS')
+
+_lock = threading.Lock()
+_process = {}
+_local = threading.local()
+
+
+# Function to add a duration to an aggregate dict (stage, name) -> [calls, seconds, max]
+def _add(totals, key, seconds):
+    entry = totals.get(key)
+    if entry is None:
+        totals[key] = [1, seconds, seconds]
+    else:
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2] = max(entry[2], seconds)
+
+
+# Function to start the spans of a rerun (session: dict that outlives the rerun)
+def begin_run(session=None, session_id=''):
+    _local.run = []
+    _local.session = session if session is not None else {}
+    _local.session_id = session_id
+    _local.started = time.perf_counter()
+
+
+# Function to end a rerun, returns its spans [(stage, name, seconds), ...]
+def end_run():
+    run = getattr(_local, 'run', None) or []
+    if getattr(_local, 'started', None) is not None:
+        total = time.perf_counter() - _local.started
+        run.append(('run', '', total))
+        _record('run', '', total)
+        _local.started = None
+    if metrics_file:
+        write_prometheus(metrics_file)
+    _local.run = None
+    return run
+
+
+# Function to record a finished span everywhere it is aggregated
+def _record(stage, name, seconds):
+    key = (stage, name)
+    session = getattr(_local, 'session', None)
+    if session is not None:
+        _add(session, key, seconds)
+    with _lock:
+        _add(_process, key, seconds)
+    if log_file:
+        line = json.dumps({'time': round(time.time(), 3), 'session': getattr(_local, 'session_id', ''),
+                           'stage': stage, 'name': name, 'seconds': round(seconds, 6)}, ensure_ascii=False)
+        with _lock:
+            with open(log_file, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+
+
+# Context manager to time one stage of the current run
+@contextmanager
+def span(stage, name=''):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        run = getattr(_local, 'run', None)
+        if run is not None:
+            run.append((stage, name, seconds))
+        _record(stage, name, seconds)
+
+
+# Decorator to time every call of a function as a span of a stage
+def timed(stage, name=None):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(stage, name or function.__name__):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# Function to turn an aggregate dict into rows (stage, name, calls, seconds, max)
+def rows(totals):
+    return [{'stage': stage, 'name': name, 'calls': calls, 'seconds': round(seconds, 4), 'max': round(longest, 4)}
+            for (stage, name), (calls, seconds, longest) in sorted(totals.items(), key=lambda item: -item[1][1])]
+
+
+# Function to get the totals of the current session
+def session_totals():
+    return rows(getattr(_local, 'session', None) or {})
+
+
+# Function to get the totals of all sessions of the process
+def process_totals():
+    with _lock:
+        return rows(_process)
+
+
+# Function to format the process totals as Prometheus text
+def prometheus_text():
+    lines = [
+        '# HELP dashboard_stage_seconds_total Time spent per dashboard stage.',
+        '# TYPE dashboard_stage_seconds_total counter',
+    ]
+    totals = process_totals()
+    for row in totals:
+        lines.append(f'dashboard_stage_seconds_total{{stage="{row["stage"]}",name="{_escape(row["name"])}"}} {row["seconds"]}')
+    lines += ['# HELP dashboard_stage_calls_total Number of timed calls per dashboard stage.',
+              '# TYPE dashboard_stage_calls_total counter']
+    for row in totals:
+        lines.append(f'dashboard_stage_calls_total{{stage="{row["stage"]}",name="{_escape(row["name"])}"}} {row["calls"]}')
+    lines += ['# HELP dashboard_stage_seconds_max Longest timed call per dashboard stage.',
+              '# TYPE dashboard_stage_seconds_max gauge']
+    for row in totals:
+        lines.append(f'dashboard_stage_seconds_max{{stage="{row["stage"]}",name="{_escape(row["name"])}"}} {row["max"]}')
+    return '\n'.join(lines) + '\n'
+
+
+# Function to escape a Prometheus label value
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# Function to replace a text file atomically; every writer uses its own temporary file
+# next to it, so the sessions (threads) of a server can write the same file at once
+def write_text_file(path, text):
+    folder = os.path.dirname(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=folder, prefix=os.path.basename(path) + '.',
+                                     suffix='.tmp', delete=False) as f:
+        f.write(text)
+    try:
+        # temporary files are private, the file is read by the metrics collector
+        os.chmod(f.name, 0o644)
+        os.replace(f.name, path)
+    except OSError:
+        os.remove(f.name)
+        raise
+
+
+# Function to write the Prometheus text file
+def write_prometheus(path):
+    write_text_file(path, prometheus_text())
@@ -0,0 +1,402 @@
+import hashlib
+import json
+import os
+import sys
+
+import numpy as np
+import shapely
+from shapely.geometry import mapping, shape
+
+import data_store
+import geodata
+
+##########################################################################################
+############ Simplified, quantized boundary topology #####################################
+# The boundaries are converted into a TopoJSON topology: coordinates are snapped to an
+# integer grid, every ring is cut into arcs at the points where neighbouring regions
+# meet, and each shared border is stored once. Simplifying the arcs (instead of the
+# polygons) keeps neighbouring regions on the same simplified border, so no gaps open
+# up between them. Several levels of detail are built for communes, districts and
+# cantons; all levels share the same arc indices, only the arcs themselves differ, so
+# the maps embed the coarse arcs and load the arcs of the finer levels when they are
+# zoomed in (static/geometry/, served by Streamlit under app/static/).
+
+quantization = 100000
+
+# level -> (Douglas-Peucker tolerance in degrees, quantization of the output)
+levels = {
+    'coarse': (0.0035, 10000),
+    'medium': (0.001, 50000),
+    'fine': (0.00025, 100000),
+}
+
+# layer -> columns the clean communes are dissolved by (None: communes themselves)
+layers = {
+    'communes': None,
+    'districts': ['canton', 'district', 'canton_abbr'],
+    'cantons': ['canton', 'canton_abbr'],
+}
+
+# unclaimed faces larger than this (in square degrees, about 0.8 km²) are real holes,
+# e.g. the Büsingen and Campione d'Italia enclaves, and are not given to a commune
+max_gap_area = 0.0001
+
+output_dir = 'geometry'
+# arcs of the finer levels loaded by the maps (the static folder of the Streamlit app)
+static_dir = os.path.join('static', 'geometry')
+
+
+# Function to list the levels of detail from the coarsest to the finest
+def levels_by_detail():
+    return sorted(levels, key=lambda level: -levels[level][0])
+
+
+# Function to pick the level of detail for a zoom level: the coarsest level whose
+# tolerance stays below half a screen pixel (the maps do the same in the browser)
+def level_for_zoom(zoom):
+    pixel_degrees = 360 / (256 * 2 ** zoom)
+    for level in levels_by_detail():
+        if levels[level][0] <= pixel_degrees / 2:
+            return level
+    return levels_by_detail()[-1]
+
+
+# Function to turn the GADM communes into a clean coverage. GADM borders do not share
+# their vertices and overlap or leave slivers, so the linework is noded and cut into
+# faces; each face goes to the commune that contains it and small gaps go to the
+# nearest commune. Neighbours then share exactly the same border.
+def clean_coverage(geometries):
+    shapes = shapely.make_valid(np.array([shape(geometry) for geometry in geometries]))
+    lines = shapely.union_all(shapely.boundary(shapes))
+    faces = shapely.get_parts(shapely.polygonize(shapely.get_parts(lines)))
+    points = shapely.point_on_surface(faces)
+    tree = shapely.STRtree(shapes)
+    face_index, shape_index = tree.query(points, predicate='within')
+    owner = np.full(len(faces), -1)
+    owner[face_index] = shape_index
+    gaps = np.flatnonzero((owner < 0) & (shapely.area(faces) < max_gap_area))
+    if len(gaps):
+        owner[gaps] = tree.nearest(points[gaps])
+    cleaned = list(shapes)
+    claimed = np.flatnonzero(owner >= 0)
+    order = claimed[np.argsort(owner[claimed], kind='stable')]
+    for group in np.split(order, np.flatnonzero(np.diff(owner[order])) + 1):
+        if len(group):
+            cleaned[owner[group[0]]] = shapely.union_all(faces[group])
+    return cleaned
+
+
+# Function to iterate over the polygons of a GeoJSON geometry
+def _polygons(geometry):
+    if geometry['type'] == 'Polygon':
+        return [geometry['coordinates']]
+    return geometry['coordinates']
+
+
+# Function to compute the quantization transform of a list of geometries
+def _transform(geometries):
+    points = np.concatenate([np.asarray(ring, dtype=float)[:, :2]
+                             for geometry in geometries
+                             for polygon in _polygons(geometry)
+                             for ring in polygon])
+    x0, y0 = points.min(axis=0)
+    x1, y1 = points.max(axis=0)
+    scale = [(x1 - x0) / (quantization - 1), (y1 - y0) / (quantization - 1)]
+    return {'scale': scale, 'translate': [float(x0), float(y0)]}
+
+
+# Function to snap a ring to the integer grid (closing point dropped, repeats removed)
+def _quantize_ring(ring, transform):
+    coords = np.asarray(ring, dtype=float)[:, :2]
+    q = np.round((coords - transform['translate']) / transform['scale']).astype(np.int64)
+    keep = np.ones(len(q), dtype=bool)
+    keep[1:] = np.any(q[1:] != q[:-1], axis=1)
+    q = q[keep]
+    if len(q) > 1 and (q[0] == q[-1]).all():
+        q = q[:-1]
+    return [tuple(point) for point in q.tolist()]
+
+
+# Function to find the junctions: points where a ring meets a different neighbour
+def _junctions(rings):
+    neighbours = {}
+    junctions = set()
+    for ring in rings:
+        n = len(ring)
+        for i, point in enumerate(ring):
+            pair = frozenset((ring[i - 1], ring[(i + 1) % n]))
+            seen = neighbours.get(point)
+            if seen is None:
+                neighbours[point] = pair
+            elif seen != pair:
+                junctions.add(point)
+    return junctions
+
+
+# Function to cut a ring into arcs at its junctions
+def _cut_ring(ring, junctions):
+    cuts = [i for i, point in enumerate(ring) if point in junctions]
+    if not cuts:
+        return None
+    start = cuts[0]
+    rotated = ring[start:] + ring[:start]
+    cuts = [i - start for i in cuts] + [len(ring)]
+    rotated = rotated + [rotated[0]]
+    return [rotated[a:b + 1] for a, b in zip(cuts[:-1], cuts[1:])]
+
+
+# Function to rotate a closed ring without junctions into a canonical form
+def _canonical_ring(ring):
+    k = ring.index(min(ring))
+    forward = ring[k:] + ring[:k]
+    backward = [forward[0]] + forward[1:][::-1]
+    return forward, backward
+
+
+# Function to build the topology (arcs and arc references) of a list of geometries
+def build_topology(geometries):
+    transform = _transform(geometries)
+    quantized = [[[_quantize_ring(ring, transform) for ring in polygon]
+                  for polygon in _polygons(geometry)]
+                 for geometry in geometries]
+    rings = [ring for polygons in quantized for polygon in polygons for ring in polygon if len(ring) >= 3]
+    junctions = _junctions(rings)
+
+    arcs = []
+    arc_index = {}
+
+    def add_arc(points):
+        key = tuple(points)
+        if key in arc_index:
+            return arc_index[key]
+        reverse = key[::-1]
+        if reverse in arc_index:
+            return ~arc_index[reverse]
+        arc_index[key] = len(arcs)
+        arcs.append(points)
+        return arc_index[key]
+
+    def add_closed(ring):
+        forward, backward = _canonical_ring(ring)
+        key = tuple(forward + [forward[0]])
+        if key in arc_index:
+            return arc_index[key]
+        reverse = tuple(backward + [backward[0]])
+        if reverse in arc_index:
+            return ~arc_index[reverse]
+        arc_index[key] = len(arcs)
+        arcs.append(list(key))
+        return arc_index[key]
+
+    objects = []
+    for polygons in quantized:
+        polygon_arcs = []
+        for polygon in polygons:
+            if len(polygon[0]) < 3:
+                continue
+            ring_arcs = []
+            for ring in polygon:
+                if len(ring) < 3:
+                    continue
+                pieces = _cut_ring(ring, junctions)
+                if pieces is None:
+                    ring_arcs.append([add_closed(ring)])
+                else:
+                    ring_arcs.append([add_arc(piece) for piece in pieces])
+            if ring_arcs:
+                polygon_arcs.append(ring_arcs)
+        objects.append(polygon_arcs)
+    return {'transform': transform, 'arcs': arcs, 'objects': objects}
+
+
+# Function to simplify one arc with Douglas-Peucker, keeping both end points
+# (and at least min_interior points in between)
+def _simplify_arc(points, tolerance, min_interior):
+    coords = np.asarray(points, dtype=float)
+    n = len(coords)
+    if n <= 2:
+        return points
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    closed = (coords[0] == coords[-1]).all()
+    stack = [(0, n - 1)]
+    if closed:
+        far = int(np.argmax(np.hypot(*(coords - coords[0]).T)))
+        keep[far] = True
+        stack = [(0, far), (far, n - 1)]
+    first = True
+    while stack:
+        a, b = stack.pop()
+        if b - a < 2:
+            continue
+        segment = coords[b] - coords[a]
+        offsets = coords[a + 1:b] - coords[a]
+        length = np.hypot(*segment)
+        if length == 0:
+            distances = np.hypot(*offsets.T)
+        else:
+            distances = np.abs(segment[0] * offsets[:, 1] - segment[1] * offsets[:, 0]) / length
+        i = int(np.argmax(distances))
+        if distances[i] > tolerance or (first and min_interior):
+            keep[a + 1 + i] = True
+            stack.append((a, a + 1 + i))
+            stack.append((a + 1 + i, b))
+        first = False
+    if closed and keep.sum() < 4:
+        keep[np.linspace(0, n - 1, 4).astype(int)] = True
+    return [points[i] for i in np.flatnonzero(keep)]
+
+
+# Function to encode a topology at one level of detail as a TopoJSON dict
+def encode_topology(topology, name, level, properties=None):
+    tolerance, level_quantization = levels[level]
+    transform = topology['transform']
+    factor = quantization / level_quantization
+    grid_tolerance = tolerance / min(transform['scale'])
+    # arcs of rings with fewer than three arcs keep an interior point, so small
+    # regions never collapse into a line
+    protected = set()
+    for polygons in topology['objects']:
+        for polygon in polygons:
+            for ring in polygon:
+                if len(ring) < 3:
+                    protected.update(i if i >= 0 else ~i for i in ring)
+    encoded_arcs = []
+    for i, points in enumerate(topology['arcs']):
+        simplified = np.asarray(_simplify_arc(points, grid_tolerance, i in protected), dtype=float)
+        simplified = np.round(simplified / factor).astype(np.int64)
+        keep = np.ones(len(simplified), dtype=bool)
+        keep[1:-1] = np.any(simplified[1:-1] != simplified[:-2], axis=1)
+        deltas = np.diff(simplified[keep], axis=0, prepend=[[0, 0]])
+        encoded_arcs.append(deltas.tolist())
+    geometries = []
+    for i, polygons in enumerate(topology['objects']):
+        if len(polygons) == 1:
+            geometry = {'type': 'Polygon', 'arcs': polygons[0], 'id': i}
+        else:
+            geometry = {'type': 'MultiPolygon', 'arcs': polygons, 'id': i}
+        if properties is not None:
+            geometry['properties'] = properties[i]
+        geometries.append(geometry)
+    return {
+        'type': 'Topology',
+        'transform': {'scale': [float(scale * factor) for scale in transform['scale']],
+                      'translate': transform['translate']},
+        'objects': {name: {'type': 'GeometryCollection', 'geometries': geometries}},
+        'arcs': encoded_arcs,
+    }
+
+
+# Function to decode the arcs of a TopoJSON dict back to coordinates
+def decode_arcs(topojson):
+    scale = np.asarray(topojson['transform']['scale'])
+    translate = np.asarray(topojson['transform']['translate'])
+    return [np.cumsum(np.asarray(arc, dtype=float).reshape(-1, 2), axis=0) * scale + translate
+            for arc in topojson['arcs']]
+
+
+# Function to get the clean commune shapes (built once per process)
+def clean_communes():
+    return data_store.derived('clean_communes', [geodata.gadm_file],
+                              lambda: clean_coverage(geodata.commune_geometry()['geometries']))
+
+
+# Function to get the attributes and clean shapes of a layer
+def layer_shapes(layer):
+    if layers[layer] is None:
+        return geodata.commune_geometry()['attributes'], clean_communes()
+    return geodata.dissolve(layers[layer], clean_communes())
+
+
+# Function to build the arc topology of a layer (built once per process)
+def layer_arcs(layer):
+    def build():
+        attributes, shapes = layer_shapes(layer)
+        topology = build_topology([mapping(outline) for outline in shapes])
+        topology['attributes'] = attributes
+        return topology
+    return data_store.derived(('topology', layer), [geodata.gadm_file], build)
+
+
+# Function to hash the content of the GADM file (once per file version)
+def _gadm_digest():
+    def build():
+        with open(data_store.data_path(geodata.gadm_file), 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    return data_store.derived('gadm_digest', [geodata.gadm_file], build)
+
+
+# Function to describe what the TopoJSON of a layer and level is built from (the GADM
+# content and the simplification parameters); stored in the files of build_all
+def source_key(layer, level):
+    return {'gadm': _gadm_digest(), 'layer': layers[layer], 'level': list(levels[level]),
+            'quantization': quantization, 'max_gap_area': max_gap_area}
+
+
+# Function to get the TopoJSON of a layer at a level of detail (with the region names
+# as properties). A file written by build_all is used when it was built from the
+# current GADM file and parameters, otherwise the topology is built in memory.
+def layer_topology(layer, level):
+    path = data_store.data_path(os.path.join(output_dir, f'{layer}_{level}.topo.json'))
+    if os.path.exists(path):
+        def load():
+            with open(path, 'r', encoding='utf-8') as f:
+                topojson = json.load(f)
+            return topojson if topojson.get('source') == source_key(layer, level) else None
+        topojson = data_store.derived(('topojson_file', layer, level), [path, geodata.gadm_file], load)
+        if topojson is not None:
+            return topojson
+    def build():
+        topology = layer_arcs(layer)
+        return encode_topology(topology, layer, level, topology['attributes'].to_dict('records'))
+    return data_store.derived(('topojson', layer, level), [geodata.gadm_file], build)
+
+
+# Function to write the arcs of a layer at a level of detail to the static folder (once
+# per process), returns the file name. The name holds a hash of source_key(), so a
+# file is never changed once written and the browser may cache it.
+def level_arcs_file(layer, level):
+    import timing
+
+    def write():
+        version = hashlib.sha256(json.dumps(source_key(layer, level), sort_keys=True).encode()).hexdigest()[:16]
+        file_name = f'{layer}_{level}.{version}.arcs.json'
+        folder = data_store.data_path(static_dir)
+        os.makedirs(folder, exist_ok=True)
+        if not os.path.exists(os.path.join(folder, file_name)):
+            topojson = layer_topology(layer, level)
+            timing.write_text_file(os.path.join(folder, file_name),
+                                   json.dumps({'transform': topojson['transform'], 'arcs': topojson['arcs']},
+                                              separators=(',', ':')))
+        # files of earlier versions (another process may remove them at the same time)
+        for old in os.listdir(folder):
+            if old.startswith(f'{layer}_{level}.') and old != file_name:
+                try:
+                    os.remove(os.path.join(folder, old))
+                except FileNotFoundError:
+                    pass
+        return file_name
+    return data_store.derived(('level_arcs_file', layer, level), [geodata.gadm_file], write)
+
+
+# Function to write every layer and level to the geometry folder
+def build_all(out_dir=output_dir):
+    out_dir = data_store.data_path(out_dir)
+    os.makedirs(out_dir, exist_ok=True)
+    sizes = {}
+    for layer in layers:
+        topology = layer_arcs(layer)
+        properties = topology['attributes'].to_dict('records')
+        for level in levels:
+            topojson = encode_topology(topology, layer, level, properties)
+            topojson['source'] = source_key(layer, level)
+            path = os.path.join(out_dir, f'{layer}_{level}.topo.json')
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(topojson, f, ensure_ascii=False, separators=(',', ':'))
+            sizes[os.path.basename(path)] = os.path.getsize(path)
+    return sizes
+
+
+if __name__ == '__main__':
+    for file_name, size in build_all(*sys.argv[1:]).items():
+        print(f'{file_name}: {size / 1024:.0f} KB')
@@ -0,0 +1,426 @@
+import gzip
+import json
+import math
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import folium
+import numpy as np
+import shapely
+from branca.colormap import StepColormap
+from folium.plugins import VectorGridProtobuf
+from folium.template import Template
+from shapely.geometry import Polygon, MultiPolygon
+
+import classification
+import data_store
+import map_cache
+import map_engine
+import topology
+
+##########################################################################################
+############ Vector-tile pyramid of the commune and canton boundaries ####################
+# The inline maps of map_engine send every commune polygon of the country with each
+# map view. This build step cuts the TopoJSON boundaries of topology.py into z/x/y
+# Mapbox Vector Tiles (MVT, protobuf) with the livestock values of all species
+# attached, and stores them in one MBTiles file (tiles/communes.mbtiles, SQLite).
+# Every zoom uses the level of detail of topology.level_for_zoom, so tiles of the
+# whole country stay small and tiles of a canton carry the fine borders.
+#
+# A small HTTP endpoint (serve) answers /tiles/{z}/{x}/{y}.pbf from the MBTiles file
+# next to the Streamlit app; the browser then only fetches the visible tiles. The
+# dashboard uses the tiles for the commune maps when MAP_TILES=1 is set and the file
+# has been built (TILE_URL when the endpoint is reached under another address). The
+# endpoint listens on TILE_HOST:TILE_PORT (127.0.0.1:8766); when it can't bind, the
+# dashboard falls back to the inline maps.
+# The values in the tiles are those of the build, so rebuild after a new export.
+#
+# Usage: python vector_tiles.py [build]     writes tiles/communes.mbtiles
+#        python vector_tiles.py serve [PORT [HOST]]  runs the tile endpoint
+
+tiles_file = os.path.join('tiles', 'communes.mbtiles')
+
+min_zoom = 7
+max_zoom = 12
+
+# tile coordinate space of MVT and the margin around every tile (avoids seams)
+extent = 4096
+buffer = 64
+
+# Define the bounding box for Switzerland
+switzerland_bounds = [[45.8179, 5.9561], [47.8085, 10.4923]]
+
+# TopoJSON layer -> (map level, region column)
+tile_layers = {'communes': ('commune', 'commune'), 'cantons': ('canton', 'canton')}
+
+tile_host = os.environ.get('TILE_HOST', '127.0.0.1')
+tile_port = int(os.environ.get('TILE_PORT', 8766))
+tile_url = os.environ.get('TILE_URL', f'http://localhost:{tile_port}/tiles/{{z}}/{{x}}/{{y}}.pbf')
+
+_tile_pattern = re.compile(r'^/tiles/(\d+)/(\d+)/(\d+)\.pbf$')
+
+
+# Function to check if the dashboard should draw the commune maps from the tiles
+def enabled():
+    return os.environ.get('MAP_TILES') == '1' and os.path.exists(data_store.data_path(tiles_file))
+
+
+# Function to get the tile column and row of a point (lat, lon) at a zoom level
+def tile_of(lat, lon, zoom):
+    x, y = _project(np.array([lon]), np.array([lat]), zoom)
+    return int(x[0]), int(y[0])
+
+
+# Function to project lon / lat (degrees) to web mercator tile units of a zoom level
+def _project(lon, lat, zoom):
+    n = 2 ** zoom
+    x = (lon + 180.0) / 360.0 * n
+    lat = np.radians(np.clip(lat, -85.0511, 85.0511))
+    y = (1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / math.pi) / 2.0 * n
+    return x, y
+
+
+# Function to turn the TopoJSON geometries of a layer into shapely polygons
+def _decode_shapes(topojson, layer):
+    arcs = topology.decode_arcs(topojson)
+
+    def ring(indices):
+        points = [arcs[i] if i >= 0 else arcs[~i][::-1] for i in indices]
+        return np.concatenate([points[0]] + [p[1:] for p in points[1:]])
+
+    shapes = []
+    for geometry in topojson['objects'][layer]['geometries']:
+        polygons = [geometry['arcs']] if geometry['type'] == 'Polygon' else geometry['arcs']
+        parts = []
+        for polygon in polygons:
+            rings = [ring(indices) for indices in polygon]
+            rings = [r for r in rings if len(r) >= 4]
+            if rings:
+                parts.append(Polygon(rings[0], rings[1:]))
+        shapes.append(shapely.make_valid(MultiPolygon(parts)) if parts else Polygon())
+    return np.array(shapes, dtype=object)
+
+
+# Function to collect the values of every region of a layer (all species and metrics)
+def _layer_properties(layer):
+    level, name_column = tile_layers[layer]
+    regions = topology.layer_topology(layer, 'coarse')['objects'][layer]['geometries']
+    properties = [{name_column: region['properties'][name_column], 'canton': region['properties']['canton']}
+                  for region in regions]
+    for species in map_engine.species_list:
+        metric = map_engine.distance_metric if level == 'commune' else 'count'
+        _, df = map_engine.joined_values(level, species, metric)
+        columns = map_engine.metrics + ([map_engine.distance_metric] if level == 'commune' else [])
+        for position, row in zip(df.index, df[columns + [name_column]].itertuples(index=False)):
+            values = row._asdict()
+            properties[position][name_column] = values.pop(name_column)
+            for column, value in values.items():
+                if value is not None and not (isinstance(value, float) and math.isnan(value)):
+                    properties[position][f'{species}_{column}'] = float(value)
+    return properties
+
+
+# Function to encode an unsigned varint
+def _varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+# Function to encode a protobuf field with its wire type
+def _field(number, wire_type, payload):
+    key = _varint((number << 3) | wire_type)
+    if wire_type == 2:
+        return key + _varint(len(payload)) + payload
+    return key + payload
+
+
+# Function to zigzag encode a signed integer
+def _zigzag(value):
+    return (value << 1) ^ (value >> 31)
+
+
+# Function to encode the rings of a clipped polygon as MVT geometry commands
+def _geometry_commands(geometry, origin_x, origin_y):
+    commands = []
+    cursor = [0, 0]
+    for polygon in shapely.get_parts(geometry):
+        if polygon.geom_type != 'Polygon' or polygon.is_empty:
+            continue
+        rings = [polygon.exterior] + list(polygon.interiors)
+        for i, ring in enumerate(rings):
+            coords = np.asarray(ring.coords)[:-1]
+            points = np.round((coords - [origin_x, origin_y]) * extent).astype(np.int64)
+            keep = np.ones(len(points), dtype=bool)
+            keep[1:] = np.any(points[1:] != points[:-1], axis=1)
+            points = points[keep]
+            if len(points) > 1 and (points[0] == points[-1]).all():
+                points = points[:-1]
+            if len(points) < 3:
+                if i == 0:
+                    break
+                continue
+            # exterior rings have a positive area in tile coordinates (y down), holes negative
+            area = np.sum(points[:, 0] * np.roll(points[:, 1], -1) - np.roll(points[:, 0], -1) * points[:, 1])
+            if (area > 0) != (i == 0):
+                points = points[::-1]
+            deltas = np.diff(np.vstack([cursor, points]), axis=0)
+            cursor = points[-1].tolist()
+            commands.append((1 & 0x7) | (1 << 3))
+            commands += [_zigzag(int(v)) for v in deltas[0]]
+            commands.append((2 & 0x7) | ((len(points) - 1) << 3))
+            commands += [_zigzag(int(v)) for d in deltas[1:] for v in d]
+            commands.append((7 & 0x7) | (1 << 3))
+    return commands
+
+
+# Function to encode one MVT layer (features: list of (id, commands, properties))
+def _encode_layer(name, features):
+    keys = {}
+    values = {}
+    body = _field(15, 0, _varint(2)) + _field(1, 2, name.encode()) + _field(5, 0, _varint(extent))
+    for feature_id, commands, properties in features:
+        tags = []
+        for key, value in properties.items():
+            tags.append(keys.setdefault(key, len(keys)))
+            tags.append(values.setdefault((type(value).__name__, value), len(values)))
+        feature = _field(1, 0, _varint(feature_id))
+        feature += _field(2, 2, b''.join(_varint(tag) for tag in tags))
+        feature += _field(3, 0, _varint(3))
+        feature += _field(4, 2, b''.join(_varint(command) for command in commands))
+        body += _field(2, 2, feature)
+    for key in keys:
+        body += _field(3, 2, key.encode())
+    for kind, value in values:
+        if kind == 'str':
+            encoded = _field(1, 2, value.encode())
+        else:
+            encoded = _field(3, 1, np.float64(value).tobytes())
+        body += _field(4, 2, encoded)
+    return _field(3, 2, body)
+
+
+# Function to cut every layer into the tiles of one zoom level, yields (x, y, tile)
+def _zoom_tiles(zoom, layers):
+    margin = buffer / extent
+    projected = {}
+    for layer, (shapes, properties) in layers.items():
+        moved = shapely.transform(shapes, lambda coords: np.column_stack(_project(coords[:, 0], coords[:, 1], zoom)))
+        projected[layer] = (moved, shapely.STRtree(moved), properties)
+    (min_lat, min_lon), (max_lat, max_lon) = switzerland_bounds
+    x0, y0 = tile_of(max_lat, min_lon, zoom)
+    x1, y1 = tile_of(min_lat, max_lon, zoom)
+    for x in range(x0, x1 + 1):
+        for y in range(y0, y1 + 1):
+            tile = b''
+            for layer, (moved, tree, properties) in projected.items():
+                features = []
+                for position in sorted(tree.query(shapely.box(x - margin, y - margin, x + 1 + margin, y + 1 + margin))):
+                    clipped = shapely.clip_by_rect(moved[position], x - margin, y - margin, x + 1 + margin, y + 1 + margin)
+                    commands = _geometry_commands(clipped, x, y) if not clipped.is_empty else []
+                    if commands:
+                        features.append((int(position), commands, properties[position]))
+                if features:
+                    tile += _encode_layer(layer, features)
+            if tile:
+                yield x, y, tile
+
+
+# Function to build the tile pyramid into the MBTiles file
+def build(file_name=tiles_file):
+    path = data_store.data_path(file_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    connection = sqlite3.connect(path + '.tmp')
+    connection.executescript("""
+        DROP TABLE IF EXISTS metadata; DROP TABLE IF EXISTS tiles;
+        CREATE TABLE metadata (name TEXT, value TEXT);
+        CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB);
+        CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row);
+    """)
+    properties = {layer: _layer_properties(layer) for layer in tile_layers}
+    counts = {}
+    for zoom in range(min_zoom, max_zoom + 1):
+        level = topology.level_for_zoom(zoom)
+        layers = {layer: (_decode_shapes(topology.layer_topology(layer, level), layer), properties[layer])
+                  for layer in tile_layers}
+        rows = [(zoom, x, 2 ** zoom - 1 - y, gzip.compress(tile)) for x, y, tile in _zoom_tiles(zoom, layers)]
+        connection.executemany('INSERT INTO tiles VALUES (?, ?, ?, ?)', rows)
+        counts[zoom] = (len(rows), sum(len(row[3]) for row in rows))
+    (min_lat, min_lon), (max_lat, max_lon) = switzerland_bounds
+    metadata = {
+        'name': 'communes', 'format': 'pbf', 'minzoom': min_zoom, 'maxzoom': max_zoom,
+        'bounds': f'{min_lon},{min_lat},{max_lon},{max_lat}',
+        'json': '{"vector_layers": [%s]}' % ', '.join(f'{{"id": "{layer}"}}' for layer in tile_layers),
+    }
+    connection.executemany('INSERT INTO metadata VALUES (?, ?)', [(k, str(v)) for k, v in metadata.items()])
+    connection.commit()
+    connection.close()
+    os.replace(path + '.tmp', path)
+    return counts
+
+
+# Function to read one tile (gzip compressed protobuf) from the MBTiles file, None if empty
+def read_tile(zoom, x, y, file_name=tiles_file):
+    connection = sqlite3.connect(f'file:{data_store.data_path(file_name)}?mode=ro', uri=True)
+    try:
+        row = connection.execute('SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?',
+                                 (zoom, x, 2 ** zoom - 1 - y)).fetchone()
+    finally:
+        connection.close()
+    return row[0] if row else None
+
+
+# Handler of the tile endpoint: /tiles/{z}/{x}/{y}.pbf
+class TileHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        match = _tile_pattern.match(self.path.split('?')[0])
+        if not match:
+            self.send_error(404)
+            return
+        tile = read_tile(*map(int, match.groups()))
+        self.send_response(200 if tile else 204)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Cache-Control', 'public, max-age=3600')
+        if tile:
+            self.send_header('Content-Type', 'application/x-protobuf')
+            self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Content-Length', str(len(tile)))
+        self.end_headers()
+        if tile:
+            self.wfile.write(tile)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Vector tile layer that shows a tooltip with the values of the region under the mouse
+class TooltipVectorGrid(VectorGridProtobuf):
+    _template = Template(
+        """
+            {% macro script(this, kwargs) -%}
+            var {{ this.get_name() }} = L.vectorGrid.protobuf('{{ this.url }}', {{ this.options }});
+            var {{ this.get_name() }}_tooltip = L.tooltip({sticky: true});
+            {{ this.get_name() }}.on('mouseover mousemove', function(e) {
+                {{ this.get_name() }}_tooltip.setLatLng(e.latlng).setContent({{ this.tooltip }}(e.layer.properties));
+                {{ this._parent.get_name() }}.openTooltip({{ this.get_name() }}_tooltip);
+            });
+            {{ this.get_name() }}.on('mouseout', function(e) {
+                {{ this._parent.get_name() }}.closeTooltip({{ this.get_name() }}_tooltip);
+            });
+            {%- endmacro %}
+            """
+    )
+
+    def __init__(self, url, options, tooltip, **kwargs):
+        super().__init__(url, options=options, **kwargs)
+        self.tooltip = tooltip
+
+
+# Function to build the folium map of one level, species and language from the tiles
+def build_map(level, species, language, metric='count'):
+    layer = 'cantons' if level == 'canton' else 'communes'
+    name_column = tile_layers[layer][1]
+    _, df = map_engine.joined_values(level, species, metric)
+    classes = classification.classes(level, species, metric)
+    breaks, colors = classes['breaks'], classes['colors']
+
+    fields = map_engine.metrics + ([map_engine.distance_metric] if metric == map_engine.distance_metric else [])
+    # same labels as the tooltips of the inline maps
+    all_fields = [name_column] + map_engine.metrics + ['top5breeds', 'top5names']
+    if metric == map_engine.distance_metric:
+        all_fields = all_fields[:2] + [map_engine.distance_metric, 'slaughterhouse'] + all_fields[2:]
+    labels = dict(zip(all_fields, map_engine.tooltip_labels(level, species, language, metric)))
+    labels = [labels[field] for field in [name_column] + fields]
+    rows = json.dumps([[label, key] for label, key in zip(labels, [name_column] + [f'{species}_{field}' for field in fields])],
+                      ensure_ascii=False)
+    tooltip = (f"function(p) {{ return '<table>' + {rows}.map(function(r) {{ return '<tr><th>' + r[0] + '</th><td>' + "
+               "(p[r[1]] === undefined ? '' : p[r[1]]) + '</td></tr>'; }).join('') + '</table>'; }")
+
+    style = map_engine.base_style
+    options = f"""{{
+        interactive: true,
+        maxNativeZoom: {max_zoom},
+        vectorTileLayerStyles: {{
+            {'cantons' if layer == 'communes' else 'communes'}: [],
+            {layer}: function(p) {{
+                var v = p['{species}_{metric}'], breaks = {[float(b) for b in breaks]}, colors = {colors};
+                var fill = '{map_engine.missing_color}';
+                if (v !== undefined) {{
+                    var i = 0;
+                    while (i < colors.length - 1 && v > breaks[i + 1]) i++;
+                    fill = colors[i];
+                }}
+                return {{fill: true, fillColor: fill, fillOpacity: {style['fillOpacity']}, color: '{style['color']}',
+                         weight: {style['weight']}, dashArray: '{style['dashArray']}'}};
+            }}
+        }}
+    }}"""
+
+    m = folium.Map(
+        location=[46.8182, 8.2275],
+        zoom_start=map_engine.zoom_start,
+        min_zoom=7.5,
+        max_bounds=True,
+        max_lat=47.8085, min_lat=45.8179,
+        max_lon=10.4923, min_lon=5.9561
+    )
+    TooltipVectorGrid(tile_url, options, tooltip, control=False).add_to(m)
+    if len(breaks) > 1:
+        StepColormap(colors, index=list(breaks), vmin=float(breaks[0]), vmax=float(breaks[-1]),
+                     caption=map_engine.legend_caption(species, language, metric)).add_to(m)
+    return m
+
+
+# Function to get the html of a tile map, rendered once per tiles file and data snapshot
+def render_map(level, species, language, metric='count'):
+    sources = [tiles_file, f'{species}_map_canton' if level == 'canton' else f'{species}_commune']
+    return map_cache.get_html(
+        ('tile_map', level, species, language, metric), sources,
+        lambda: build_map(level, species, language, metric).get_root().render())
+
+
+_server = None
+_server_error = None
+_server_lock = threading.Lock()
+
+
+# Function to start the tile endpoint once per process (returns the server, None when
+# the address can't be bound, e.g. the port is taken; the error is reported once)
+def serve(port=tile_port, host=tile_host):
+    global _server, _server_error
+    with _server_lock:
+        if _server is None and _server_error is None:
+            try:
+                _server = ThreadingHTTPServer((host, port), TileHandler)
+            except OSError as e:
+                _server_error = e
+                print(f'tile endpoint not started on {host}:{port}: {e}', file=sys.stderr)
+                return None
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+    return _server
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'build'
+    if command == 'serve':
+        server = serve(int(sys.argv[2]) if len(sys.argv) > 2 else tile_port, sys.argv[3] if len(sys.argv) > 3 else tile_host)
+        if server is None:
+            sys.exit(1)
+        print(f'tiles on http://{server.server_address[0]}:{server.server_port}/tiles/{{z}}/{{x}}/{{y}}.pbf')
+        threading.Event().wait()
+    else:
+        started = time.perf_counter()
+        for zoom, (n_tiles, size) in build().items():
+            print(f'z{zoom}: {n_tiles} tiles, {size / 1024:.0f} KB')
+        print(f'{time.perf_counter() - started:.1f} s -> {tiles_file}')
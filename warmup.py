@@ -0,0 +1,151 @@
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import data_store
+
+##########################################################################################
+############ Warm-up of the process caches and readiness signal ##########################
+# All data work of the dashboard is lazy, so the first visitor after a deploy used to
+# pay for parsing the data, building the topology and rendering every map. start()
+# runs that work once per process in a background thread: every dataset, the
+# aggregates of the section functions, every figure and every map the dashboard shows, in the order
+# a visitor needs them (German cattle first). The dashboard itself never waits for it.
+# Steps that ran are recorded with prefetch.py, which loads the other views again in
+# the background when the data changes later.
+#
+# Readiness: status() / ready() in the process, READY_FILE=<path> is written when the
+# warm-up is done and READY_PORT=<port> answers /ready with 200 (ready) or 503, on
+# READY_HOST (default 127.0.0.1, e.g. 0.0.0.0 for a probe from outside the container).
+# When the port can't be bound the warm-up still runs, the error goes to stderr.
+#
+# "python warmup.py [streamlit options]" starts the warm-up and then the Streamlit
+# server in the same process, so the caches are warm before the first session; with
+# a plain "streamlit run" the warm-up starts with the first session instead.
+
+app_file = '!Dashboard1.py'
+
+ready_file = os.environ.get('READY_FILE')
+ready_port = os.environ.get('READY_PORT')
+ready_host = os.environ.get('READY_HOST', '127.0.0.1')
+
+_lock = threading.Lock()
+_status = {'state': 'idle', 'done': 0, 'total': 0, 'seconds': 0.0, 'errors': []}
+_thread = None
+
+
+# Function to list the warm-up steps (name, function) in the order visitors need them
+def tasks():
+    import breeds
+    import prefetch
+    import query_engine
+    import rollup
+    import search_index
+
+    steps = [(f'dataset {name}', lambda name=name: data_store.load_dataset(name)) for name in data_store.datasets]
+    steps.append(('breeds canton', lambda: breeds.long_table('canton', 'breeds')))
+    steps.append(('rollup cube', rollup.cube))
+    steps.append(('search index', search_index.search_index))
+    steps.append(('table database', query_engine.database))
+    for language in ['de', 'fr']:
+        for species in prefetch.species_list:
+            steps += prefetch.view_tasks(species, language)
+    # views share some steps (datasets, the canton bars), each runs once
+    return list(dict(steps).items())
+
+
+# Function to run all warm-up steps (errors are kept, the next step still runs)
+def run():
+    import prefetch
+
+    started = time.perf_counter()
+    steps = tasks()
+    with _lock:
+        _status.update(state='warming', done=0, total=len(steps), errors=[])
+    for name, step in steps:
+        try:
+            step()
+            prefetch.record(name)
+        except Exception as e:
+            with _lock:
+                _status['errors'].append(f'{name}: {e}')
+        with _lock:
+            _status['done'] += 1
+            _status['seconds'] = round(time.perf_counter() - started, 2)
+    with _lock:
+        _status['state'] = 'ready'
+    if ready_file:
+        with open(ready_file, 'w', encoding='utf-8') as f:
+            json.dump(status(), f)
+
+
+# Function to start the warm-up once per process (in a daemon thread)
+def start():
+    global _thread
+    with _lock:
+        if _thread is not None:
+            return _thread
+        _thread = threading.Thread(target=run, name='warmup', daemon=True)
+        _status['state'] = 'starting'
+    if ready_port:
+        serve_readiness(int(ready_port))
+    _thread.start()
+    return _thread
+
+
+# Function to get a copy of the warm-up status
+def status():
+    with _lock:
+        return dict(_status, errors=list(_status['errors']))
+
+
+# Function to check if the warm-up has finished
+def ready():
+    return status()['state'] == 'ready'
+
+
+# Handler of the readiness endpoint: /ready -> 200 when warm, 503 before
+class ReadinessHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/ready', '/'):
+            self.send_error(404)
+            return
+        body = json.dumps(status()).encode()
+        self.send_response(200 if ready() else 503)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Function to start the readiness endpoint (returns the server, None when the address
+# can't be bound)
+def serve_readiness(port, host=ready_host):
+    try:
+        server = ThreadingHTTPServer((host, port), ReadinessHandler)
+    except OSError as e:
+        print(f'readiness endpoint not started on {host}:{port}: {e}', file=sys.stderr)
+        return None
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    from streamlit.web import bootstrap
+
+    # the dashboard imports this module by name, it must find the running warm-up
+    sys.modules['warmup'] = sys.modules['__main__']
+    start()
+    flag_options = {}
+    for argument in sys.argv[1:]:
+        # --server.port=8501 style options of "streamlit run"
+        key, _, value = argument.lstrip('-').partition('=')
+        flag_options[key.replace('.', '_')] = value
+    bootstrap.load_config_options(flag_options)
+    bootstrap.run(data_store.data_path(app_file), False, [], flag_options)